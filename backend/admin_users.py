@@ -0,0 +1,128 @@
+# backend/admin_users.py
+
+import io
+import csv
+import json
+import logging
+from typing import Iterator, Optional
+
+from sqlalchemy import select, func
+from sqlalchemy.sql import Select
+
+from models import SessionLocal, User, PatientProfile, DoctorProfile
+
+logger = logging.getLogger(__name__)
+
+# --- Поиск и выгрузка пользователей для администратора ---
+
+# Максимальный размер страницы поиска
+USER_SEARCH_MAX_LIMIT = 100
+# Сколько строк читается из серверного курсора за раз и сколько строк собирается в один кусок ответа
+USER_EXPORT_FETCH_SIZE = 1000
+USER_EXPORT_CHUNK_ROWS = 500
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+EXPORT_COLUMNS = [
+    "id", "email", "role", "is_active",
+    "full_name", "contact_phone", "specialization", "is_verified",
+]
+
+
+def escape_like(value: str) -> str:
+    """Экранирует % и _ для LIKE: префикс поиска ищется буквально."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def filter_users(query: Select, email_prefix: Optional[str] = None, role: Optional[str] = None,
+                 is_active: Optional[bool] = None) -> Select:
+    """
+    Добавляет к запросу по users фильтры поиска. Префикс email (LIKE 'abc%') использует индекс users.email,
+    подстрока (LIKE '%abc%') его бы не использовала, поэтому поиск только по началу адреса.
+    """
+    if email_prefix:
+        query = query.where(User.email.like(escape_like(email_prefix) + "%", escape="\\"))
+    if role is not None:
+        query = query.where(User.role == role)
+    if is_active is not None:
+        query = query.where(User.is_active == is_active)
+    return query
+
+
+def search_users(db, after: Optional[str], limit: int, **filters) -> dict:
+    """
+    Страница пользователей в порядке email. Курсор - email последнего пользователя страницы:
+    email уникален, поэтому следующая страница - это просто email > after по тому же индексу.
+    """
+    query = filter_users(select(User), **filters).order_by(User.email).limit(limit)
+    if after is not None:
+        query = query.where(User.email > after)
+    users = db.execute(query).scalars().all()
+    return {
+        "items": users,
+        "next_after": users[-1].email if len(users) == limit else None,
+    }
+
+
+def _export_query(**filters) -> Select:
+    # Пользователь может иметь только один из профилей, поэтому два LEFT JOIN не размножают строки
+    return filter_users(
+        select(
+            User.id, User.email, User.role, User.is_active,
+            func.coalesce(DoctorProfile.full_name, PatientProfile.full_name).label("full_name"),
+            PatientProfile.contact_phone,
+            DoctorProfile.specialization,
+            DoctorProfile.is_verified,
+        )
+        .outerjoin(PatientProfile, PatientProfile.user_id == User.id)
+        .outerjoin(DoctorProfile, DoctorProfile.user_id == User.id),
+        **filters,
+    ).order_by(User.id)
+
+
+def _csv_cell(value):
+    # Ячейки, которые Excel принял бы за формулу (ФИО и телефон вводят сами пользователи), начинаем с апострофа
+    if isinstance(value, str) and value[:1] in ("=", "+", "-", "@"):
+        return "'" + value
+    return value
+
+
+def iter_user_export(export_format: str, **filters) -> Iterator[bytes]:
+    """
+    Генератор выгрузки пользователей (CSV или NDJSON) для StreamingResponse.
+    Строки читаются серверным курсором (stream_results) пачками по USER_EXPORT_FETCH_SIZE
+    и сразу отдаются клиенту, поэтому память не зависит от числа пользователей.
+    Сессия своя, а не из запроса: генератор работает, пока клиент читает ответ.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == "csv":
+        writer.writerow(EXPORT_COLUMNS)
+
+    exported = 0
+    with SessionLocal() as db:
+        result = db.execute(
+            _export_query(**filters).execution_options(stream_results=True, yield_per=USER_EXPORT_FETCH_SIZE)
+        )
+        try:
+            for row in result:
+                values = [getattr(row, column) for column in EXPORT_COLUMNS]
+                if export_format == "csv":
+                    writer.writerow([_csv_cell(value) for value in values])
+                else:
+                    buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, values)), ensure_ascii=False))
+                    buffer.write("\n")
+                exported += 1
+                if exported % USER_EXPORT_CHUNK_ROWS == 0:
+                    yield buffer.getvalue().encode("utf-8")
+                    buffer.seek(0)
+                    buffer.truncate()
+        finally:
+            # Клиент мог оборвать загрузку: закрываем серверный курсор, чтобы освободить соединение
+            result.close()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+    logger.info("User export (%s): %d rows", export_format, exported)
@@ -0,0 +1,32 @@
+"""add composite indexes for doctor catalog sorting
+
+Revision ID: 1a6f3c8e9b27
+Revises: e7b35a90d1c2
+Create Date: 2026-10-19 17:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1a6f3c8e9b27'
+down_revision: Union[str, None] = 'e7b35a90d1c2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_doctor_profiles_specialization_cost_id', 'doctor_profiles', ['specialization', 'cost_per_consultation', 'id'], unique=False)
+    op.create_index('ix_doctor_profiles_cost_id', 'doctor_profiles', ['cost_per_consultation', 'id'], unique=False)
+    op.create_index('ix_doctor_profiles_full_name_id', 'doctor_profiles', ['full_name', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_doctor_profiles_full_name_id', table_name='doctor_profiles')
+    op.drop_index('ix_doctor_profiles_cost_id', table_name='doctor_profiles')
+    op.drop_index('ix_doctor_profiles_specialization_cost_id', table_name='doctor_profiles')
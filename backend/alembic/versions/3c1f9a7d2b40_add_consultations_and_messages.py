@@ -0,0 +1,76 @@
+"""add consultations, messages and message archives
+
+Revision ID: 3c1f9a7d2b40
+Revises: ab1bb0e8752a
+Create Date: 2026-10-19 12:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c1f9a7d2b40'
+down_revision: Union[str, None] = 'ab1bb0e8752a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('consultations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('patient_id', sa.Integer(), nullable=False),
+    sa.Column('doctor_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('last_message_at', sa.DateTime(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['doctor_id'], ['users.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['patient_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_consultations_id'), 'consultations', ['id'], unique=False)
+    op.create_index(op.f('ix_consultations_patient_id'), 'consultations', ['patient_id'], unique=False)
+    op.create_index(op.f('ix_consultations_doctor_id'), 'consultations', ['doctor_id'], unique=False)
+    op.create_index(op.f('ix_consultations_last_message_at'), 'consultations', ['last_message_at'], unique=False)
+    op.create_table('messages',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), autoincrement=True, nullable=False),
+    sa.Column('consultation_id', sa.Integer(), nullable=False),
+    sa.Column('sender_id', sa.Integer(), nullable=False),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['consultation_id'], ['consultations.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['sender_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sqlite_autoincrement=True
+    )
+    op.create_index('ix_messages_consultation_id_id', 'messages', ['consultation_id', 'id'], unique=False)
+    op.create_table('message_archives',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('consultation_id', sa.Integer(), nullable=False),
+    sa.Column('first_message_id', sa.BigInteger(), nullable=False),
+    sa.Column('last_message_id', sa.BigInteger(), nullable=False),
+    sa.Column('message_count', sa.Integer(), nullable=False),
+    sa.Column('payload', sa.LargeBinary(length=16777215), nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['consultation_id'], ['consultations.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_message_archives_id'), 'message_archives', ['id'], unique=False)
+    op.create_index('ix_message_archives_consultation_id_last_message_id', 'message_archives', ['consultation_id', 'last_message_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_message_archives_consultation_id_last_message_id', table_name='message_archives')
+    op.drop_index(op.f('ix_message_archives_id'), table_name='message_archives')
+    op.drop_table('message_archives')
+    op.drop_index('ix_messages_consultation_id_id', table_name='messages')
+    op.drop_table('messages')
+    op.drop_index(op.f('ix_consultations_last_message_at'), table_name='consultations')
+    op.drop_index(op.f('ix_consultations_doctor_id'), table_name='consultations')
+    op.drop_index(op.f('ix_consultations_patient_id'), table_name='consultations')
+    op.drop_index(op.f('ix_consultations_id'), table_name='consultations')
+    op.drop_table('consultations')
@@ -0,0 +1,91 @@
+"""add data migration progress, backfill doctor locations
+
+Revision ID: 4e9a7b1c6d58
+Revises: 6c3d9a2f8e14
+Create Date: 2026-10-19 19:20:00.000000
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from geo import location_values
+from reference_data import district_centroid
+from migration_utils import backfill
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4e9a7b1c6d58'
+down_revision: Union[str, None] = '6c3d9a2f8e14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_NAME = "doctor_profiles_location_from_district"
+
+# Колонки таблиц на момент этой ревизии (не модели: модели меняются вместе с кодом приложения)
+doctor_profiles = sa.table(
+    'doctor_profiles',
+    sa.column('id', sa.Integer), sa.column('practice_areas', sa.String),
+    sa.column('latitude', sa.Float), sa.column('longitude', sa.Float), sa.column('geohash', sa.String),
+)
+doctor_profile_changes = sa.table(
+    'doctor_profile_changes',
+    sa.column('doctor_id', sa.Integer), sa.column('operation', sa.String), sa.column('changed_at', sa.DateTime),
+)
+districts = sa.table('districts', sa.column('name', sa.String), sa.column('latitude', sa.Float), sa.column('longitude', sa.Float))
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('data_migration_progress',
+    sa.Column('name', sa.String(length=128), nullable=False),
+    sa.Column('last_key', sa.BigInteger(), nullable=True),
+    sa.Column('rows_done', sa.BigInteger(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+    # Профили, созданные до c4a8d2f06e15, не имеют координат и не находятся поиском near:
+    # ставим им центр района практики, как это делает запись профиля
+    bind = op.get_bind()
+    centroids = {
+        row.name: (row.latitude, row.longitude)
+        for row in bind.execute(sa.select(districts)).all()
+        if row.latitude is not None and row.longitude is not None
+    }
+    update_location = (
+        doctor_profiles.update()
+        .where(doctor_profiles.c.id == sa.bindparam('doctor_id'))
+        .values(latitude=sa.bindparam('latitude'), longitude=sa.bindparam('longitude'), geohash=sa.bindparam('geohash'))
+    )
+
+    def process_batch(connection, rows):
+        changed_at = datetime.utcnow()
+        updates = []
+        for row in rows:
+            centroid = district_centroid(row.practice_areas, centroids)
+            if centroid is not None:
+                updates.append({"doctor_id": row.id, **location_values(*centroid)})
+        if updates:
+            connection.execute(update_location, updates)
+            # Журнал изменений: колоночный каталог и снимок каталога подхватят новые координаты
+            connection.execute(doctor_profile_changes.insert(), [
+                {"doctor_id": values["doctor_id"], "operation": "upsert", "changed_at": changed_at} for values in updates
+            ])
+
+    with op.get_context().autocommit_block():
+        backfill(
+            bind, BACKFILL_NAME, doctor_profiles, process_batch,
+            where=sa.and_(doctor_profiles.c.latitude.is_(None), doctor_profiles.c.practice_areas.is_not(None)),
+            columns=[doctor_profiles.c.practice_areas],
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Заполненные координаты не откатываются: они не отличаются от координат, поставленных приложением
+    op.drop_table('data_migration_progress')
@@ -0,0 +1,28 @@
+"""add doctor verification queue index
+
+Revision ID: 6c3d9a2f8e14
+Revises: 2b8e5f1a7c93
+Create Date: 2026-10-19 18:50:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6c3d9a2f8e14'
+down_revision: Union[str, None] = '2b8e5f1a7c93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_doctor_profiles_is_verified_id', 'doctor_profiles', ['is_verified', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_doctor_profiles_is_verified_id', table_name='doctor_profiles')
@@ -0,0 +1,44 @@
+"""add doctor slots
+
+Revision ID: 8e4b27c5f913
+Revises: 3c1f9a7d2b40
+Create Date: 2026-10-19 13:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e4b27c5f913'
+down_revision: Union[str, None] = '3c1f9a7d2b40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('doctor_slots',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('doctor_id', sa.Integer(), nullable=False),
+    sa.Column('start_at', sa.DateTime(), nullable=False),
+    sa.Column('end_at', sa.DateTime(), nullable=False),
+    sa.Column('patient_id', sa.Integer(), nullable=True),
+    sa.Column('booked_at', sa.DateTime(), nullable=True),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['doctor_id'], ['doctor_profiles.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['patient_id'], ['users.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('doctor_id', 'start_at', name='uq_doctor_slots_doctor_id_start_at')
+    )
+    op.create_index(op.f('ix_doctor_slots_id'), 'doctor_slots', ['id'], unique=False)
+    op.create_index(op.f('ix_doctor_slots_patient_id'), 'doctor_slots', ['patient_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_doctor_slots_patient_id'), table_name='doctor_slots')
+    op.drop_index(op.f('ix_doctor_slots_id'), table_name='doctor_slots')
+    op.drop_table('doctor_slots')
@@ -0,0 +1,30 @@
+"""add message client_message_id
+
+Revision ID: 9d2f6a4c8b31
+Revises: 4e9a7b1c6d58
+Create Date: 2026-10-19 21:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d2f6a4c8b31'
+down_revision: Union[str, None] = '4e9a7b1c6d58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('messages', sa.Column('client_message_id', sa.String(length=36), nullable=True))
+    op.create_unique_constraint('uq_messages_consultation_id_client_message_id', 'messages', ['consultation_id', 'client_message_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_messages_consultation_id_client_message_id', 'messages', type_='unique')
+    op.drop_column('messages', 'client_message_id')
@@ -0,0 +1,39 @@
+"""add doctor profile change log
+
+Revision ID: 9f0b6d4e2a71
+Revises: 1a6f3c8e9b27
+Create Date: 2026-10-19 17:50:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9f0b6d4e2a71'
+down_revision: Union[str, None] = '1a6f3c8e9b27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('doctor_profile_changes',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), autoincrement=True, nullable=False),
+    sa.Column('doctor_id', sa.Integer(), nullable=False),
+    sa.Column('operation', sa.String(length=10), nullable=False),
+    sa.Column('changed_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sqlite_autoincrement=True
+    )
+    op.create_index(op.f('ix_doctor_profile_changes_doctor_id'), 'doctor_profile_changes', ['doctor_id'], unique=False)
+    op.create_index(op.f('ix_doctor_profile_changes_changed_at'), 'doctor_profile_changes', ['changed_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_doctor_profile_changes_changed_at'), table_name='doctor_profile_changes')
+    op.drop_index(op.f('ix_doctor_profile_changes_doctor_id'), table_name='doctor_profile_changes')
+    op.drop_table('doctor_profile_changes')
@@ -0,0 +1,71 @@
+"""add doctor location_explicit
+
+Revision ID: a3c7e1f9d245
+Revises: 9d2f6a4c8b31
+Create Date: 2026-10-19 22:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from reference_data import district_centroid
+from migration_utils import backfill
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c7e1f9d245'
+down_revision: Union[str, None] = '9d2f6a4c8b31'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_NAME = "doctor_profiles_location_explicit"
+
+# Колонки таблиц на момент этой ревизии (не модели: модели меняются вместе с кодом приложения)
+doctor_profiles = sa.table(
+    'doctor_profiles',
+    sa.column('id', sa.Integer), sa.column('practice_areas', sa.String),
+    sa.column('latitude', sa.Float), sa.column('longitude', sa.Float), sa.column('location_explicit', sa.Boolean),
+)
+districts = sa.table('districts', sa.column('name', sa.String), sa.column('latitude', sa.Float), sa.column('longitude', sa.Float))
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('doctor_profiles', sa.Column('location_explicit', sa.Boolean(), server_default='0', nullable=False))
+
+    # Координаты, не совпадающие с центром района практики, врач указал сам - отмечаем их как явные,
+    # чтобы смена practice_areas их не сбросила
+    bind = op.get_bind()
+    centroids = {
+        row.name: (row.latitude, row.longitude)
+        for row in bind.execute(sa.select(districts)).all()
+        if row.latitude is not None and row.longitude is not None
+    }
+    mark_explicit = (
+        doctor_profiles.update()
+        .where(doctor_profiles.c.id == sa.bindparam('doctor_id'))
+        .values(location_explicit=True)
+    )
+
+    def process_batch(connection, rows):
+        updates = [
+            {"doctor_id": row.id}
+            for row in rows
+            if district_centroid(row.practice_areas, centroids) != (row.latitude, row.longitude)
+        ]
+        if updates:
+            connection.execute(mark_explicit, updates)
+
+    with op.get_context().autocommit_block():
+        backfill(
+            bind, BACKFILL_NAME, doctor_profiles, process_batch,
+            where=doctor_profiles.c.latitude.is_not(None),
+            columns=[doctor_profiles.c.practice_areas, doctor_profiles.c.latitude, doctor_profiles.c.longitude],
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('doctor_profiles', 'location_explicit')
@@ -0,0 +1,29 @@
+"""drop doctor specialization index
+
+Revision ID: b5e8d2a6c917
+Revises: a3c7e1f9d245
+Create Date: 2026-10-19 22:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5e8d2a6c917'
+down_revision: Union[str, None] = 'a3c7e1f9d245'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Фильтр по специализации - поиск подстроки (специализация врача - свободный текст), индекс им не используется
+    op.drop_index('ix_doctor_profiles_specialization_cost_id', table_name='doctor_profiles')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index('ix_doctor_profiles_specialization_cost_id', 'doctor_profiles', ['specialization', 'cost_per_consultation', 'id'], unique=False)
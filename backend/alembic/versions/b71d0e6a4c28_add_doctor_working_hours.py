@@ -0,0 +1,36 @@
+"""add doctor working hours bitmaps
+
+Revision ID: b71d0e6a4c28
+Revises: 8e4b27c5f913
+Create Date: 2026-10-19 14:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b71d0e6a4c28'
+down_revision: Union[str, None] = '8e4b27c5f913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+WEEKDAY_COLUMNS = ('hours_mon', 'hours_tue', 'hours_wed', 'hours_thu', 'hours_fri', 'hours_sat', 'hours_sun')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for column in WEEKDAY_COLUMNS:
+        op.add_column('doctor_profiles', sa.Column(column, sa.BigInteger(), server_default='0', nullable=False))
+    op.add_column('doctor_profiles', sa.Column('working_days', sa.SmallInteger(), server_default='0', nullable=False))
+    op.create_index(op.f('ix_doctor_profiles_working_days'), 'doctor_profiles', ['working_days'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_doctor_profiles_working_days'), table_name='doctor_profiles')
+    op.drop_column('doctor_profiles', 'working_days')
+    for column in reversed(WEEKDAY_COLUMNS):
+        op.drop_column('doctor_profiles', column)
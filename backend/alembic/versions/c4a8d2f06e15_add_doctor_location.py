@@ -0,0 +1,34 @@
+"""add doctor practice location and geohash
+
+Revision ID: c4a8d2f06e15
+Revises: 5d2e91c7a3f6
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4a8d2f06e15'
+down_revision: Union[str, None] = '5d2e91c7a3f6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('doctor_profiles', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('doctor_profiles', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('doctor_profiles', sa.Column('geohash', sa.String(length=12), nullable=True))
+    op.create_index(op.f('ix_doctor_profiles_geohash'), 'doctor_profiles', ['geohash'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_doctor_profiles_geohash'), table_name='doctor_profiles')
+    op.drop_column('doctor_profiles', 'geohash')
+    op.drop_column('doctor_profiles', 'longitude')
+    op.drop_column('doctor_profiles', 'latitude')
@@ -0,0 +1,49 @@
+"""add districts and specializations reference tables
+
+Revision ID: e7b35a90d1c2
+Revises: c4a8d2f06e15
+Create Date: 2026-10-19 16:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7b35a90d1c2'
+down_revision: Union[str, None] = 'c4a8d2f06e15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Таблицы заполняются начальными данными при первом запуске приложения (reference_data.py)
+    op.create_table('districts',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=255), nullable=False),
+    sa.Column('latitude', sa.Float(), nullable=True),
+    sa.Column('longitude', sa.Float(), nullable=True),
+    sa.Column('sort_order', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_index(op.f('ix_districts_id'), 'districts', ['id'], unique=False)
+    op.create_table('specializations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=255), nullable=False),
+    sa.Column('sort_order', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_index(op.f('ix_specializations_id'), 'specializations', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_specializations_id'), table_name='specializations')
+    op.drop_table('specializations')
+    op.drop_index(op.f('ix_districts_id'), table_name='districts')
+    op.drop_table('districts')
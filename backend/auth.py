@@ -1,17 +1,26 @@
 # backend/auth.py
 
 import os
+import hmac
+import time
+import hashlib
+import threading
+import anyio.to_thread
 import requests  # Добавляем для HTTP-запросов к Google API
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional, Annotated # Добавляем Annotated
+from typing import Optional, Annotated, Tuple # Добавляем Annotated
 from models import User, get_db
+from rate_limit import bcrypt_limiter # Ограничение параллельных вычислений bcrypt
+from signing_keys import keyring, KEY_ALGORITHM # Ключи ES256 для подписи JWT (с ротацией по kid)
+from logging_config import set_log_user # id пользователя в контексте логов запроса
 
 # Импорты для FastAPI зависимостей и обработки токена
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer # Для схемы Bearer токена
 
 # Импорт для работы с базой данных в зависимости
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 
 # Импорты для хеширования паролей
 from passlib.context import CryptContext
@@ -47,6 +56,7 @@ if SECRET_KEY is None:
 
 
 # Алгоритм шифрования для JWT. HS256 - распространенный выбор для HMAC подписи.
+# Используется, только если в каталоге ключей нет ключей ES256 (см. signing_keys.py).
 ALGORITHM = "HS256"
 
 # Время жизни токена доступа в минутах.
@@ -55,6 +65,12 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30 # 30 минут - стандартное вре
 # Длина безопасного токена (для верификации email и т.д.)
 SECURE_TOKEN_LENGTH = 32
 
+# Время жизни ссылки подтверждения email в часах (проверяется в /verify-email, просроченные токены чистит maintenance.py)
+EMAIL_VERIFICATION_TOKEN_EXPIRE_HOURS = int(os.getenv("EMAIL_VERIFICATION_TOKEN_EXPIRE_HOURS", "24"))
+
+# Сколько проверенных токенов хранится в кэше процесса (см. VerifiedTokenCache)
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+
 # --- Схема OAuth2 для получения токена из заголовка ---
 
 # Настраиваем схему OAuth2 Bearer. FastAPI будет ожидать токен в заголовке "Authorization: Bearer <токен>".
@@ -78,8 +94,10 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     сохраненному хешированному паролю.
     Использует алгоритм, настроенный в pwd_context (bcrypt).
     """
-    # pwd_context.verify обрабатывает соль и сравнивает хэши
-    return pwd_context.verify(plain_password, hashed_password)
+    # pwd_context.verify обрабатывает соль и сравнивает хэши.
+    # bcrypt_limiter не дает всплеску логинов занять все ядра: лишние запросы получают 503.
+    with bcrypt_limiter.slot():
+        return pwd_context.verify(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
@@ -88,7 +106,23 @@ def get_password_hash(password: str) -> str:
     Использует алгоритм, настроенный в pwd_context (bcrypt).
     """
     # pwd_context.hash автоматически генерирует соль и создает хэш
-    return pwd_context.hash(password)
+    with bcrypt_limiter.slot():
+        return pwd_context.hash(password)
+
+
+# Варианты для async-кода: вызов из цикла событий не должен ни считать bcrypt, ни ждать место в bcrypt_limiter
+# в потоке цикла - иначе на это время останавливаются все async-запросы и потоки событий (SSE).
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password для async-кода: ожидание места и вычисление bcrypt - вне цикла событий."""
+    async with bcrypt_limiter.async_slot():
+        return await anyio.to_thread.run_sync(pwd_context.verify, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash для async-кода: ожидание места и вычисление bcrypt - вне цикла событий."""
+    async with bcrypt_limiter.async_slot():
+        return await anyio.to_thread.run_sync(pwd_context.hash, password)
 
 
 # --- Функции для работы с JWT ---
@@ -121,10 +155,14 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     # JWT стандарты используют Unix Timestamp. jwt.encode делает это автоматически.
     to_encode.update({"exp": expire})
 
-    # Кодируем payload в JWT токен, используя секретный ключ и алгоритм.
-    # SECRET_KEY должен быть известен только серверу, который подписывает токены,
-    # и серверам, которые их проверяют.
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    # Подписываем активным ключом ES256: kid в заголовке говорит проверяющей стороне, какой открытый ключ
+    # из /.well-known/jwks.json использовать. Без ключей - прежняя подпись HS256 с SECRET_KEY,
+    # который должен быть известен только этому серверу.
+    signing_key = keyring.signing_key()
+    if signing_key is not None:
+        encoded_jwt = jwt.encode(to_encode, signing_key.private_pem, algorithm=KEY_ALGORITHM, headers={"kid": signing_key.kid})
+    else:
+        encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
     return encoded_jwt
 
@@ -206,7 +244,7 @@ async def authenticate_google_user(google_data: dict, db: Session) -> User:
     
     # Если пользователя нет, создаем нового с ролью "patient" по умолчанию
     # Пароль не нужен, так как вход через Google
-    hashed_password = get_password_hash(os.urandom(32).hex())  # Генерируем случайный пароль
+    hashed_password = await get_password_hash_async(os.urandom(32).hex())  # Генерируем случайный пароль
     
     new_user = User(
         email=email,
@@ -240,39 +278,89 @@ class Token(BaseModel):
     token_type: str = "bearer"
 
 
-async def get_current_user(
-    # FastAPI автоматически предоставляет токен, извлекая его из заголовка "Authorization: Bearer ..."
-    token: Annotated[str, Depends(oauth2_scheme)],
-    # FastAPI автоматически предоставляет сессию БД, используя зависимость get_db (импортирована из models.py)
-    db: Annotated[Session, Depends(get_db)]
-# Возвращаемый тип - модель User SQLAlchemy
-) -> User:
+def credentials_exception() -> HTTPException:
+    """Исключение, которое выбрасывается в случае невалидных учетных данных (токена)."""
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED, # 401 - Неавторизован
+        detail="Could not validate credentials", # Сообщение об ошибке
+        headers={"WWW-Authenticate": "Bearer"}, # Указываем, что требуется Bearer токен (по стандарту OAuth2)
+    )
+
+
+class VerifiedTokenCache:
     """
-    Зависимость FastAPI. Выполняет аутентификацию пользователя по JWT токену.
-    Извлекает токен, проверяет его валидность, извлекает идентификатор пользователя (email)
-    и роль из payload токена, загружает объект пользователя из базы данных.
+    Кэш уже проверенных JWT токенов: один и тот же токен предъявляется сотни раз за время жизни,
+    а разбор и проверка подписи нужны только при первом предъявлении.
 
-    Args:
-        token (str): JWT токен, извлеченный из заголовка Authorization (Bearer <токен>).
-        db (Session): Сессия базы данных, предоставленная зависимостью get_db().
+    Ключ - HMAC-SHA256 токена на случайном ключе процесса (сам токен в памяти не хранится).
+    Словарь индексируется первыми 8 байтами дайджеста, а полный дайджест сравнивается
+    через hmac.compare_digest (за постоянное время). Запись живет до 'exp' токена;
+    число записей ограничено, при переполнении вытесняются давно не использовавшиеся (LRU).
+    """
 
-    Returns:
-        User: Объект пользователя SQLAlchemy, соответствующий токену.
+    def __init__(self, max_size: int = JWT_CACHE_SIZE):
+        self.max_size = max_size
+        self._key = os.urandom(32)
+        self._entries: "OrderedDict[bytes, Tuple[bytes, str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _digest(self, token: str) -> bytes:
+        return hmac.new(self._key, token.encode("utf-8"), hashlib.sha256).digest()
+
+    def get(self, token: str) -> Optional[str]:
+        """Возвращает email из ранее проверенного и еще не истекшего токена или None."""
+        digest = self._digest(token)
+        with self._lock:
+            entry = self._entries.get(digest[:8])
+            if entry is not None and hmac.compare_digest(entry[0], digest):
+                if entry[2] > time.time():
+                    self._entries.move_to_end(digest[:8])
+                    self.hits += 1
+                    return entry[1]
+                # Токен истек - дальше его отклонит полная проверка
+                del self._entries[digest[:8]]
+            self.misses += 1
+            return None
+
+    def put(self, token: str, email: str, expires_at: float):
+        digest = self._digest(token)
+        with self._lock:
+            self._entries[digest[:8]] = (digest, email, expires_at)
+            self._entries.move_to_end(digest[:8])
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+verified_tokens = VerifiedTokenCache()
+
+
+def decode_token_subject(token: str) -> str:
+    """
+    Проверяет JWT токен и возвращает email пользователя из поля 'sub'.
+    Повторные предъявления того же токена до его истечения обслуживаются из verified_tokens без проверки подписи.
 
     Raises:
-        HTTPException: С кодом 401 (Unauthorized), если токен невалидный, истек,
-                       или пользователь не найден/неактивен.
+        HTTPException: С кодом 401, если токен невалидный, истек или в нем нет email/роли.
     """
-    # Определяем исключение, которое будет выброшено в случае невалидных учетных данных (токена)
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED, # 401 - Неавторизован
-        detail="Could not validate credentials", # Сообщение об ошибке
-        headers={"WWW-Authenticate": "Bearer"}, # Указываем, что требуется Bearer токен (по стандарту OAuth2)
-    )
+    email = verified_tokens.get(token)
+    if email is not None:
+        return email
 
     try:
         # Декодируем токен. jwt.decode автоматически проверяет подпись, срок действия ('exp'), и т.д.
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        # Токены с kid проверяются только открытым ключом ES256 с этим kid, токены без kid - только HS256,
+        # поэтому подменить алгоритм в заголовке нельзя.
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid is not None:
+            verification_key = keyring.verification_key(kid)
+            if verification_key is None:
+                # Ключ удален из каталога (истек период ротации) или kid подделан
+                raise credentials_exception()
+            payload = jwt.decode(token, verification_key.public_key, algorithms=[KEY_ALGORITHM])
+        else:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
 
         # Извлекаем email пользователя из стандартного поля 'sub' (subject) payload.
         # Это поле должно содержать уникальный идентификатор пользователя. Мы используем email.
@@ -282,7 +370,7 @@ async def get_current_user(
 
         if email is None or user_role is None:
             # Если в токене отсутствуют необходимые поля (email или роль), считаем его невалидным.
-            raise credentials_exception
+            raise credentials_exception()
 
         # Если бы использовали TokenData Pydantic модель:
         # token_data = TokenData(email=email, role=user_role) # Валидируем payload токена
@@ -290,7 +378,40 @@ async def get_current_user(
     except JWTError:
         # Если токен невалидный (неправильная подпись, истек срок действия, неверный формат и т.д.),
         # библиотека jwt выбрасывает JWTError. Мы перехватываем ее и выбрасываем HTTPException.
-        raise credentials_exception
+        raise credentials_exception()
+
+    # Кэшируем только токены со сроком действия: без 'exp' запись жила бы до вытеснения
+    expires_at = payload.get("exp")
+    if isinstance(expires_at, (int, float)):
+        verified_tokens.put(token, email, float(expires_at))
+
+    return email
+
+
+async def get_current_user(
+    # FastAPI автоматически предоставляет токен, извлекая его из заголовка "Authorization: Bearer ..."
+    token: Annotated[str, Depends(oauth2_scheme)],
+    # FastAPI автоматически предоставляет сессию БД, используя зависимость get_db (импортирована из models.py)
+    db: Annotated[Session, Depends(get_db)]
+# Возвращаемый тип - модель User SQLAlchemy
+) -> User:
+    """
+    Зависимость FastAPI. Выполняет аутентификацию пользователя по JWT токену.
+    Извлекает токен, проверяет его валидность, извлекает идентификатор пользователя (email)
+    и роль из payload токена, загружает объект пользователя из базы данных.
+
+    Args:
+        token (str): JWT токен, извлеченный из заголовка Authorization (Bearer <токен>).
+        db (Session): Сессия базы данных, предоставленная зависимостью get_db().
+
+    Returns:
+        User: Объект пользователя SQLAlchemy, соответствующий токену.
+
+    Raises:
+        HTTPException: С кодом 401 (Unauthorized), если токен невалидный, истек,
+                       или пользователь не найден/неактивен.
+    """
+    email = decode_token_subject(token)
 
     # Ищем пользователя в базе данных по email, извлеченному из токена.
     # Это необходимо, чтобы убедиться, что пользователь все еще существует в системе.
@@ -298,7 +419,10 @@ async def get_current_user(
 
     if user is None:
         # Если пользователь из токена не найден в базе данных (например, был удален после выдачи токена).
-        raise credentials_exception
+        raise credentials_exception()
+
+    # id пользователя попадает во все записи логов этого запроса
+    set_log_user(user.id)
 
     # TODO: Можно добавить проверку user.is_active здесь, если нужно блокировать пользователей
     # даже при наличии валидного токена (например, если администратор деактивировал пользователя).
@@ -311,6 +435,27 @@ async def get_current_user(
     return user
 
 
+async def get_current_user_with_profile(
+    token: Annotated[str, Depends(oauth2_scheme)],
+    db: Annotated[Session, Depends(get_db)]
+) -> User:
+    """
+    Зависимость FastAPI. То же, что get_current_user, но сразу загружает профиль пациента и врача
+    одним запросом (LEFT OUTER JOIN через отношения User.patient_profile и User.doctor_profile).
+    """
+    email = decode_token_subject(token)
+    user = (
+        db.query(User)
+        .options(joinedload(User.patient_profile), joinedload(User.doctor_profile))
+        .filter(User.email == email)
+        .first()
+    )
+    if user is None:
+        raise credentials_exception()
+    set_log_user(user.id)
+    return user
+
+
 def require_role(role: str):
     """
     Фабрика зависимостей FastAPI. Создает зависимость, которая проверяет,
@@ -391,7 +536,7 @@ async def authenticate_user(email: str, password: str, db: Session) -> Optional[
     
     # Если пользователь найден, проверяем пароль
     # Используем verify_password, чтобы сравнить переданный пароль с хэшем из БД
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password_async(password, user.hashed_password):
         return None  # Если пароль неверный, возвращаем None
     
     # Если пользователь найден и пароль верный, возвращаем объект пользователя
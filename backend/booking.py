@@ -0,0 +1,105 @@
+# backend/booking.py
+
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from models import DoctorSlot
+
+# Максимальная длительность одного слота. Ограничение делает поиск пересечений
+# диапазонным запросом по индексу (doctor_id, start_at): слот, пересекающий интервал [start, end),
+# обязательно начинается в промежутке (start - MAX_SLOT_DURATION, end).
+MAX_SLOT_DURATION = timedelta(hours=4)
+# Минимальная длительность слота
+MIN_SLOT_DURATION = timedelta(minutes=10)
+
+
+class SlotConflictError(Exception):
+    """Слот пересекается с другим слотом или уже забронирован."""
+
+
+def to_naive_utc(value: datetime) -> datetime:
+    """Приводит дату ко времени UTC без tzinfo - так даты хранятся в БД."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def validate_intervals(intervals: List[Tuple[datetime, datetime]]) -> List[Tuple[datetime, datetime]]:
+    """
+    Проверяет новые интервалы и возвращает их отсортированными по началу.
+    Пересечения внутри самой пачки ищутся одним проходом после сортировки (sweep line).
+
+    Raises:
+        ValueError: Если интервал некорректен или находится в прошлом.
+        SlotConflictError: Если интервалы пачки пересекаются между собой.
+    """
+    now = datetime.utcnow()
+    normalized = sorted((to_naive_utc(start), to_naive_utc(end)) for start, end in intervals)
+    for start, end in normalized:
+        if end - start < MIN_SLOT_DURATION or end - start > MAX_SLOT_DURATION:
+            raise ValueError(f"Slot duration must be between {MIN_SLOT_DURATION} and {MAX_SLOT_DURATION}")
+        if start <= now:
+            raise ValueError("Slots must start in the future")
+    for (_, previous_end), (start, _) in zip(normalized, normalized[1:]):
+        if start < previous_end:
+            raise SlotConflictError(f"Slots overlap at {start.isoformat()}")
+    return normalized
+
+
+def find_overlapping_slots(db: Session, doctor_id: int, start: datetime, end: datetime) -> List[DoctorSlot]:
+    """
+    Находит слоты врача, пересекающиеся с интервалом [start, end).
+    Условие по start_at ограничено с двух сторон, поэтому БД читает только узкий диапазон
+    индекса uq_doctor_slots_doctor_id_start_at, а не все слоты врача.
+    """
+    return (
+        db.query(DoctorSlot)
+        .filter(DoctorSlot.doctor_id == doctor_id)
+        .filter(DoctorSlot.start_at > start - MAX_SLOT_DURATION)
+        .filter(DoctorSlot.start_at < end)
+        .filter(DoctorSlot.end_at > start)
+        .all()
+    )
+
+
+def book_slot(db: Session, slot_id: int, patient_id: int) -> bool:
+    """
+    Бронирует свободный слот одним условным UPDATE (compare-and-set).
+    Из нескольких одновременных запросов на один слот условие patient_id IS NULL
+    выполнится только для первого - остальные получат rowcount = 0. Блокировок таблицы нет.
+
+    Returns:
+        bool: True, если слот забронирован этим запросом.
+    """
+    result = db.execute(
+        update(DoctorSlot)
+        .where(DoctorSlot.id == slot_id)
+        .where(DoctorSlot.patient_id.is_(None))
+        .where(DoctorSlot.start_at > datetime.utcnow())
+        .values(patient_id=patient_id, booked_at=datetime.utcnow(), version=DoctorSlot.version + 1)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def cancel_booking(db: Session, slot_id: int, patient_id: int, expected_version: Optional[int] = None) -> bool:
+    """
+    Отменяет бронь пациента. Если передан expected_version, отмена выполняется
+    только при совпадении версии строки (оптимистическая блокировка).
+
+    Returns:
+        bool: True, если бронь отменена.
+    """
+    query = (
+        update(DoctorSlot)
+        .where(DoctorSlot.id == slot_id)
+        .where(DoctorSlot.patient_id == patient_id)
+    )
+    if expected_version is not None:
+        query = query.where(DoctorSlot.version == expected_version)
+    result = db.execute(query.values(patient_id=None, booked_at=None, version=DoctorSlot.version + 1))
+    db.commit()
+    return result.rowcount == 1
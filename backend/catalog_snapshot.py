@@ -0,0 +1,225 @@
+# backend/catalog_snapshot.py
+
+import os
+import json
+import mmap
+import struct
+import logging
+import tempfile
+import threading
+import time
+from typing import Callable, Iterable, Optional, Tuple
+
+from sqlalchemy import select
+
+from models import SessionLocal, DoctorProfile, DoctorProfileChange
+from doctor_catalog import grace_watermark
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки нет, снимок обновляет каждый воркер (переименование все равно атомарно)
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# --- Снимок публичного каталога врачей в общем файле ---
+# Один воркер (тот, кто захватил файловую блокировку) периодически записывает все публичные профили врачей
+# в файл снимка, остальные воркеры отображают этот файл в память (mmap) только для чтения.
+# Страницы файла лежат в page cache один раз на машину, а не копией в памяти каждого воркера,
+# и новому воркеру не нужно прогревать кэш запросами к БД.
+#
+# Новая версия пишется во временный файл рядом и публикуется os.replace (атомарное переименование):
+# читатели видят либо старый, либо новый файл целиком. Читатель замечает новый файл по смене inode
+# и просто подменяет ссылку на отображение - без блокировок на чтение.
+#
+# Формат файла:
+#   заголовок: MAGIC, id последней учтенной строки журнала doctor_profile_changes, число записей;
+#   индекс: записи (id врача, смещение, длина), отсортированные по id - поиск врача двоичным поиском;
+#   данные: JSON каждого профиля.
+CATALOG_SNAPSHOT = os.getenv("CATALOG_SNAPSHOT", "off") == "on"
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH", os.path.join(tempfile.gettempdir(), "vrachi-catalog.snap"))
+# Как часто (в секундах) обновляющий воркер проверяет журнал изменений и пересобирает снимок
+CATALOG_SNAPSHOT_REFRESH_SECONDS = float(os.getenv("CATALOG_SNAPSHOT_REFRESH_SECONDS", "10"))
+# Как часто (в секундах) читатель проверяет, не опубликован ли новый файл
+CATALOG_SNAPSHOT_CHECK_SECONDS = 1.0
+
+MAGIC = b"VRCATv01"
+_HEADER = struct.Struct("<8sqI")
+_INDEX_ENTRY = struct.Struct("<qQI")
+
+
+def write_snapshot(path: str, watermark: int, records: Iterable[Tuple[int, dict]]):
+    """Записывает снимок во временный файл и атомарно публикует его под именем path."""
+    records = sorted(records, key=lambda record: record[0])
+    payloads = [json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8") for _, data in records]
+    offset = _HEADER.size + _INDEX_ENTRY.size * len(records)
+    index = bytearray()
+    for (doctor_id, _), payload in zip(records, payloads):
+        index += _INDEX_ENTRY.pack(doctor_id, offset, len(payload))
+        offset += len(payload)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temp_path = tempfile.mkstemp(prefix=".catalog-", dir=directory)
+    try:
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, watermark, len(records)))
+            f.write(index)
+            for payload in payloads:
+                f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+class _MappedSnapshot:
+    """Одна опубликованная версия снимка, отображенная в память."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.watermark, self.count = _HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a catalog snapshot")
+
+    def _entry(self, position: int) -> Tuple[int, int, int]:
+        return _INDEX_ENTRY.unpack_from(self.buffer, _HEADER.size + position * _INDEX_ENTRY.size)
+
+    def get(self, doctor_id: int) -> Optional[dict]:
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            entry_id, offset, length = self._entry(middle)
+            if entry_id < doctor_id:
+                low = middle + 1
+            elif entry_id > doctor_id:
+                high = middle
+            else:
+                return json.loads(self.buffer[offset:offset + length])
+        return None
+
+
+class CatalogSnapshotReader:
+    """
+    Доступ воркера к последнему опубликованному снимку. Ссылка на отображение подменяется целиком,
+    поэтому запросы, уже читающие старую версию, дочитывают ее (старое отображение закроется сборщиком мусора).
+    """
+
+    def __init__(self, path: str = CATALOG_SNAPSHOT_PATH):
+        self.path = path
+        self._snapshot: Optional[_MappedSnapshot] = None
+        self._checked_at = 0.0
+
+    def _maybe_swap(self):
+        now = time.monotonic()
+        if now - self._checked_at < CATALOG_SNAPSHOT_CHECK_SECONDS:
+            return
+        self._checked_at = now
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return
+        current = self._snapshot
+        if current is None or current.inode != inode:
+            try:
+                self._snapshot = _MappedSnapshot(self.path)
+            except (OSError, ValueError):
+                logger.exception("Failed to map catalog snapshot %s", self.path)
+
+    def get(self, doctor_id: int) -> Optional[dict]:
+        """Публичный профиль врача из снимка или None (врача нет в снимке или снимок еще не опубликован)."""
+        self._maybe_swap()
+        snapshot = self._snapshot
+        return snapshot.get(doctor_id) if snapshot is not None else None
+
+    @property
+    def watermark(self) -> Optional[int]:
+        snapshot = self._snapshot
+        return snapshot.watermark if snapshot is not None else None
+
+
+class CatalogSnapshotRefresher:
+    """
+    Фоновый поток, который пересобирает снимок, если в журнале изменений появились новые строки.
+    Потоки запускаются во всех воркерах, но работу выполняет только захвативший файловую блокировку.
+    """
+
+    def __init__(self, serialize: Callable[[DoctorProfile], dict], path: str = CATALOG_SNAPSHOT_PATH,
+                 interval: float = CATALOG_SNAPSHOT_REFRESH_SECONDS):
+        self.serialize = serialize
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock_file = None
+
+    def _try_lock(self) -> bool:
+        if fcntl is None:
+            return True
+        if self._lock_file is None:
+            self._lock_file = open(self.path + ".lock", "a")
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _published_watermark(self) -> Optional[int]:
+        try:
+            with open(self.path, "rb") as f:
+                magic, watermark, _ = _HEADER.unpack(f.read(_HEADER.size))
+            return watermark if magic == MAGIC else None
+        except (OSError, struct.error):
+            return None
+
+    def refresh(self, force: bool = False) -> bool:
+        """Пересобирает снимок, если он устарел. Возвращает True, если новая версия опубликована."""
+        with SessionLocal() as db:
+            published = self._published_watermark()
+            if not force and published is not None:
+                newer = db.execute(select(DoctorProfileChange.id).where(DoctorProfileChange.id > published).limit(1)).scalar()
+                if newer is None:
+                    return False
+            # В файл пишется id, до которого журнал учтен точно (строки старше CATALOG_CHANGE_GRACE_SECONDS):
+            # строка с меньшим id может закоммититься позже большего. Пока в журнале есть более новые строки,
+            # снимок пересобирается каждый интервал - изменение попадает в снимок не позже чем через
+            # CATALOG_SNAPSHOT_REFRESH_SECONDS после commit, даже если его id меньше уже учтенного.
+            watermark = grace_watermark(db)
+            started = time.monotonic()
+            # Профили читаются после watermark: изменение, попавшее между запросами, будет учтено и в этой версии,
+            # и в следующей
+            records = [(doctor.id, self.serialize(doctor)) for doctor in db.query(DoctorProfile).yield_per(1000)]
+        write_snapshot(self.path, watermark, records)
+        logger.info("Catalog snapshot published: %d doctors in %.2fs", len(records), time.monotonic() - started)
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._try_lock():
+                    self.refresh()
+            except Exception:
+                logger.exception("Failed to refresh catalog snapshot")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="catalog-snapshot-refresher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self._lock_file is not None:
+            # Закрытие файла снимает блокировку - обновлять снимок начнет другой воркер
+            self._lock_file.close()
+            self._lock_file = None
+
+
+# Снимок процесса (None, если снимок выключен)
+catalog_snapshot: Optional[CatalogSnapshotReader] = CatalogSnapshotReader() if CATALOG_SNAPSHOT else None
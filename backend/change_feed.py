@@ -0,0 +1,85 @@
+# backend/change_feed.py
+
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from models import DoctorProfile, DoctorProfileChange
+from doctor_catalog import CATALOG_CHANGE_GRACE_SECONDS, OPERATION_UPSERT, OPERATION_DELETE
+
+# --- Лента изменений каталога врачей (GET /api/doctors/changes) ---
+# Внешние потребители (поисковый индексатор, зеркало партнера, хранилище аналитики) синхронизируются
+# по журналу doctor_profile_changes, а не перечитывают весь каталог: позиция в ленте - id строки журнала (seq).
+#
+# Изменение отдается как текущее состояние врача (upsert с краткими полями) или delete, если профиля уже нет.
+# Несколько изменений одного врача на странице сворачиваются в одно - с последним seq.
+#
+# Курсор next_since продвигается только до строк старше CATALOG_CHANGE_GRACE_SECONDS: id выдается при вставке,
+# а строка видна после commit, поэтому более поздний id может появиться раньше более раннего. Молодые строки
+# отдаются сразу, но придут и в следующем ответе - применение одного и того же состояния повторно безопасно.
+#
+# Журнал хранится DOCTOR_CHANGES_RETENTION_DAYS дней (очищает задача purge_doctor_changes в maintenance.py). Курсор старше журнала
+# получает 410: потребитель должен заново загрузить каталог и продолжить с текущей позиции (запрос без since).
+DOCTOR_CHANGES_RETENTION_DAYS = int(os.getenv("DOCTOR_CHANGES_RETENTION_DAYS", "7"))
+DOCTOR_CHANGES_MAX_LIMIT = 1000
+
+
+class ChangeFeedExpired(Exception):
+    """Курсор указывает на изменения, уже удаленные из журнала."""
+
+
+def current_position(db: Session) -> int:
+    """Текущая позиция ленты: с нее начинает потребитель после полной загрузки каталога."""
+    return db.execute(select(func.max(DoctorProfileChange.id))).scalar() or 0
+
+
+def read_doctor_changes(db: Session, since: int, limit: int) -> dict:
+    """Изменения с seq > since (не больше limit строк журнала) в порядке seq."""
+    oldest = db.execute(select(func.min(DoctorProfileChange.id))).scalar()
+    # Очистка журнала всегда оставляет последнюю строку, поэтому пропуск перед oldest означает удаленные строки
+    if oldest is not None and since < oldest - 1:
+        raise ChangeFeedExpired()
+
+    rows = db.execute(
+        select(DoctorProfileChange.id, DoctorProfileChange.doctor_id, DoctorProfileChange.changed_at)
+        .where(DoctorProfileChange.id > since)
+        .order_by(DoctorProfileChange.id)
+        .limit(limit)
+    ).all()
+
+    # Курсор - до первой молодой строки: все строки до нее уже точно видны
+    cutoff = datetime.utcnow() - timedelta(seconds=CATALOG_CHANGE_GRACE_SECONDS)
+    next_since = since
+    for row in rows:
+        if row.changed_at >= cutoff:
+            break
+        next_since = row.id
+
+    latest = {}  # doctor_id -> последний seq на странице
+    for row in rows:
+        latest[row.doctor_id] = row.id
+    doctors = {
+        doctor.id: doctor
+        for doctor in db.execute(
+            select(
+                DoctorProfile.id, DoctorProfile.user_id, DoctorProfile.full_name, DoctorProfile.specialization,
+                DoctorProfile.cost_per_consultation, DoctorProfile.is_verified,
+            ).where(DoctorProfile.id.in_(latest))
+        ).all()
+    } if latest else {}
+
+    changes = []
+    for doctor_id, seq in sorted(latest.items(), key=lambda item: item[1]):
+        doctor = doctors.get(doctor_id)
+        changes.append({
+            "seq": seq,
+            "op": OPERATION_UPSERT if doctor is not None else OPERATION_DELETE,
+            "doctor_id": doctor_id,
+            "doctor": doctor._mapping if doctor is not None else None,
+        })
+    # Если курсор остановился на молодых строках, сразу повторять запрос бессмысленно - has_more = false
+    has_more = len(rows) == limit and next_since == rows[-1].id
+    return {"changes": changes, "next_since": next_since, "has_more": has_more}
+
@@ -0,0 +1,314 @@
+# backend/chat.py
+
+import os
+import json
+import zlib
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select, insert, update, delete, or_, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import engine, SessionLocal, Consultation, Message, MessageArchive
+
+logger = logging.getLogger(__name__)
+
+# --- Настройки буфера записи сообщений ---
+
+# Максимум сообщений в одном многострочном INSERT
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "50"))
+# Сколько миллисекунд буфер ждет новых сообщений перед записью неполной пачки
+MESSAGE_FLUSH_INTERVAL_MS = int(os.getenv("MESSAGE_FLUSH_INTERVAL_MS", "20"))
+# Сколько секунд запрос ждет записи своего сообщения. Сообщение остается в буфере и может быть записано позже,
+# поэтому по таймауту клиент получает ключ client_message_id, а не ошибку
+MESSAGE_WRITE_TIMEOUT_SECONDS = 5
+
+# --- Настройки архивации ---
+
+# Консультации без новых сообщений дольше этого срока переносятся в архив
+MESSAGE_ARCHIVE_AFTER_DAYS = int(os.getenv("MESSAGE_ARCHIVE_AFTER_DAYS", "180"))
+# Сколько сообщений переносится в архив одной короткой транзакцией
+MESSAGE_ARCHIVE_CHUNK_SIZE = int(os.getenv("MESSAGE_ARCHIVE_CHUNK_SIZE", "500"))
+
+
+class _PendingMessage:
+    """Сообщение, ожидающее записи в БД, и событие, по которому запрос узнает о результате."""
+
+    def __init__(self, values: dict):
+        self.values = values
+        self.done = threading.Event()
+        self.error: Optional[Exception] = None
+
+
+class MessageWriteBuffer:
+    """
+    Буфер записи сообщений (group commit).
+    Запросы складывают сообщения в очередь, фоновый поток записывает их
+    пачками до MESSAGE_BATCH_SIZE штук одним многострочным INSERT и одним commit.
+    append() возвращается только после того, как пачка записана, поэтому
+    сообщение сразу видно в истории (read-your-writes).
+    Сообщение с уже записанным client_message_id не вставляется повторно (повтор запроса клиентом).
+    """
+
+    def __init__(self, batch_size: int = MESSAGE_BATCH_SIZE, flush_interval_ms: int = MESSAGE_FLUSH_INTERVAL_MS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self._pending: List[_PendingMessage] = []
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def append(self, consultation_id: int, sender_id: int, content: str, client_message_id: str) -> datetime:
+        """
+        Добавляет сообщение в буфер и ждет его записи. Возвращает время создания сообщения
+        (для повтора - время уже записанного). TimeoutError - сообщение еще в буфере, запись не подтверждена.
+        """
+        item = _PendingMessage({
+            "consultation_id": consultation_id,
+            "sender_id": sender_id,
+            "content": content,
+            "created_at": datetime.utcnow(),
+            "client_message_id": client_message_id,
+        })
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Message buffer is closed")
+            self._ensure_started()
+            self._pending.append(item)
+            self._condition.notify()
+        if not item.done.wait(MESSAGE_WRITE_TIMEOUT_SECONDS):
+            raise TimeoutError("Message was not written in time")
+        if item.error is not None:
+            raise item.error
+        return item.values["created_at"]
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="message-write-buffer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending and self._closed:
+                    return
+                # Даем другим запросам немного времени, чтобы пачка наполнилась
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._pending) < self.batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+            self._flush(batch)
+
+    def _flush(self, batch: List[_PendingMessage]):
+        error = None
+        try:
+            try:
+                self._write(batch)
+            except IntegrityError:
+                # Повтор с тем же ключом записал другой процесс между проверкой и INSERT - проверяем заново
+                self._write(batch)
+        except Exception as e:
+            logger.exception("Failed to write a batch of %d messages", len(batch))
+            error = e
+        for item in batch:
+            item.error = error
+            item.done.set()
+
+    def _write(self, batch: List[_PendingMessage]):
+        with engine.begin() as connection:
+            # Ключи, которые уже записаны (клиент повторил запрос после таймаута): такие сообщения не вставляем,
+            # а отвечаем временем существующего. Одинаковые ключи внутри пачки тоже записываются один раз
+            keys = {(item.values["consultation_id"], item.values["client_message_id"]) for item in batch}
+            written = {
+                (row.consultation_id, row.client_message_id): row.created_at
+                for row in connection.execute(
+                    select(Message.consultation_id, Message.client_message_id, Message.created_at)
+                    .where(tuple_(Message.consultation_id, Message.client_message_id).in_(keys))
+                )
+            }
+            rows = []
+            for item in batch:
+                key = (item.values["consultation_id"], item.values["client_message_id"])
+                if key in written:
+                    item.values["created_at"] = written[key]
+                    continue
+                written[key] = item.values["created_at"]
+                rows.append(item.values)
+            if not rows:
+                return
+            # executemany -> драйвер собирает один многострочный INSERT ... VALUES (...), (...)
+            connection.execute(insert(Message), rows)
+            # Обновляем время последнего сообщения один раз на консультацию
+            last_at = {}
+            for values in rows:
+                last_at[values["consultation_id"]] = values["created_at"]
+            for consultation_id, created_at in last_at.items():
+                connection.execute(
+                    update(Consultation)
+                    .where(Consultation.id == consultation_id)
+                    .values(last_message_at=created_at)
+                )
+
+    def close(self):
+        """Записывает оставшиеся сообщения и останавливает поток (при остановке приложения)."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=MESSAGE_WRITE_TIMEOUT_SECONDS)
+
+
+# Общий буфер процесса
+message_buffer = MessageWriteBuffer()
+
+
+def _message_to_dict(row) -> dict:
+    return {
+        "id": row.id,
+        "consultation_id": row.consultation_id,
+        "sender_id": row.sender_id,
+        "content": row.content,
+        "created_at": row.created_at,
+        "client_message_id": row.client_message_id,
+    }
+
+
+def _decode_archive(payload: bytes) -> List[dict]:
+    messages = json.loads(zlib.decompress(payload))
+    for message in messages:
+        message["created_at"] = datetime.fromisoformat(message["created_at"])
+    return messages
+
+
+def fetch_history(db: Session, consultation_id: int, before_id: Optional[int], limit: int) -> Tuple[List[dict], Optional[int]]:
+    """
+    Возвращает страницу истории консультации, идя от новых сообщений к старым.
+    Курсор before_id - id самого старого сообщения предыдущей страницы.
+    Если в основной таблице сообщений не хватает (консультация частично или полностью в архиве),
+    страница дополняется из message_archives.
+
+    Returns:
+        (сообщения страницы в хронологическом порядке, курсор следующей страницы или None)
+    """
+    query = (
+        select(
+            Message.id, Message.consultation_id, Message.sender_id, Message.content, Message.created_at,
+            Message.client_message_id,
+        )
+        .where(Message.consultation_id == consultation_id)
+        .order_by(Message.id.desc())
+        .limit(limit + 1) # Берем на одну строку больше, чтобы узнать, есть ли следующая страница
+    )
+    if before_id is not None:
+        query = query.where(Message.id < before_id)
+    messages = [_message_to_dict(row) for row in db.execute(query)]
+
+    if len(messages) <= limit:
+        # Основная таблица исчерпана - дочитываем архив (сообщения в нем всегда старше оставшихся в messages)
+        cursor = messages[-1]["id"] if messages else before_id
+        archive_query = (
+            select(MessageArchive.payload)
+            .where(MessageArchive.consultation_id == consultation_id)
+            .order_by(MessageArchive.last_message_id.desc())
+        )
+        if cursor is not None:
+            archive_query = archive_query.where(MessageArchive.first_message_id < cursor)
+        for (payload,) in db.execute(archive_query):
+            chunk = [m for m in reversed(_decode_archive(payload)) if cursor is None or m["id"] < cursor]
+            messages.extend(chunk)
+            if len(messages) > limit:
+                break
+
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    next_before_id = messages[-1]["id"] if has_more and messages else None
+    messages.reverse()
+    return messages, next_before_id
+
+
+def _archive_consultation(consultation_id: int, chunk_size: int) -> int:
+    """
+    Переносит сообщения одной консультации в архив пачками, от старых к новым.
+    Каждая пачка - отдельная короткая транзакция (SELECT + INSERT в архив + DELETE по диапазону id),
+    поэтому блокировки держатся миллисекунды, а прерванную работу можно просто запустить снова.
+    """
+    moved = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                select(
+                    Message.id, Message.consultation_id, Message.sender_id, Message.content, Message.created_at,
+                    Message.client_message_id,
+                )
+                .where(Message.consultation_id == consultation_id)
+                .order_by(Message.id)
+                .limit(chunk_size)
+            ).all()
+            if not rows:
+                connection.execute(
+                    update(Consultation)
+                    .where(Consultation.id == consultation_id)
+                    .values(archived_at=datetime.utcnow())
+                )
+                return moved
+            payload = [
+                {**_message_to_dict(row), "created_at": row.created_at.isoformat()}
+                for row in rows
+            ]
+            connection.execute(insert(MessageArchive).values(
+                consultation_id=consultation_id,
+                first_message_id=rows[0].id,
+                last_message_id=rows[-1].id,
+                message_count=len(rows),
+                payload=zlib.compress(json.dumps(payload, ensure_ascii=False).encode("utf-8")),
+                archived_at=datetime.utcnow(),
+            ))
+            connection.execute(
+                delete(Message)
+                .where(Message.consultation_id == consultation_id)
+                .where(Message.id.between(rows[0].id, rows[-1].id))
+            )
+            moved += len(rows)
+
+
+def archive_old_consultations(
+    older_than_days: int = MESSAGE_ARCHIVE_AFTER_DAYS,
+    chunk_size: int = MESSAGE_ARCHIVE_CHUNK_SIZE,
+    max_consultations: int = 100,
+) -> dict:
+    """
+    Задача архивации: переносит сообщения консультаций, в которых давно не было новых сообщений,
+    в сжатую таблицу message_archives. За один запуск обрабатывается не больше max_consultations.
+
+    Returns:
+        dict: Статистика запуска (сколько консультаций и сообщений перенесено).
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    with SessionLocal() as db:
+        consultation_ids = db.execute(
+            select(Consultation.id)
+            .where(Consultation.last_message_at < cutoff)
+            .where(or_(Consultation.archived_at.is_(None), Consultation.archived_at < Consultation.last_message_at))
+            .order_by(Consultation.id)
+            .limit(max_consultations)
+        ).scalars().all()
+
+    moved = 0
+    for consultation_id in consultation_ids:
+        moved += _archive_consultation(consultation_id, chunk_size)
+    return {"consultations": len(consultation_ids), "messages": moved}
+
+
+if __name__ == "__main__":
+    # Ручной запуск архивации: python chat.py
+    print(archive_old_consultations())
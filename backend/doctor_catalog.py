@@ -0,0 +1,330 @@
+# backend/doctor_catalog.py
+
+import os
+import time
+import logging
+import threading
+from array import array
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, insert, func
+from sqlalchemy.orm import Session
+
+from models import SessionLocal, DoctorProfile, DoctorProfileChange
+from reference_data import reference_catalog
+
+try:
+    import numpy as np
+except ImportError:  # numpy есть в requirements.txt; без него фильтры выполняются обычными циклами по array (медленнее)
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# --- Колоночный каталог врачей в памяти ---
+# Включается настройкой CATALOG_ENGINE=columnar (по умолчанию каталог ищется SQL-запросом).
+# Поля, по которым фильтруется и сортируется список врачей, хранятся в компактных колонках array:
+# id, стоимость, is_verified, код специализации (словарное кодирование) и битовая маска районов практики.
+# Фильтр + сортировка + страница считаются векторно (numpy: маски и lexsort), из БД читается
+# только сама страница по первичному ключу.
+#
+# Каталог поддерживается в актуальном состоянии журналом изменений doctor_profile_changes:
+# каждая запись профиля врача добавляет в него строку в той же транзакции (record_doctor_change),
+# а каталог периодически дочитывает новые строки журнала и перечитывает измененные профили.
+CATALOG_ENGINE = os.getenv("CATALOG_ENGINE", "sql")
+# Как часто (в секундах) каталог проверяет журнал изменений
+CATALOG_SYNC_SECONDS = float(os.getenv("CATALOG_SYNC_SECONDS", "1"))
+# Строки журнала моложе этого срока перечитываются при каждой синхронизации: id строк журнала выдаются
+# при вставке, а видны после commit, поэтому более поздний id может стать видимым раньше более раннего.
+# Повторное применение изменения безопасно - профиль просто перечитывается из БД.
+CATALOG_CHANGE_GRACE_SECONDS = float(os.getenv("CATALOG_CHANGE_GRACE_SECONDS", "5"))
+CATALOG_SYNC_BATCH_SIZE = 1000
+
+OPERATION_UPSERT = "upsert"
+OPERATION_DELETE = "delete"
+
+
+def grace_watermark(db: Session, after: int = 0) -> int:
+    """Наибольший id журнала, который уже старше CATALOG_CHANGE_GRACE_SECONDS (его можно больше не перечитывать)."""
+    cutoff = datetime.utcnow() - timedelta(seconds=CATALOG_CHANGE_GRACE_SECONDS)
+    watermark = db.execute(
+        select(func.max(DoctorProfileChange.id))
+        .where(DoctorProfileChange.id > after)
+        .where(DoctorProfileChange.changed_at < cutoff)
+    ).scalar()
+    return watermark or after
+
+
+def record_doctor_change(db: Session, doctor_id: int, operation: str = OPERATION_UPSERT):
+    """Добавляет запись в журнал изменений профилей врачей. Не выполняет commit - пишется в транзакции изменения."""
+    db.execute(insert(DoctorProfileChange).values(doctor_id=doctor_id, operation=operation, changed_at=datetime.utcnow()))
+
+
+def record_doctor_changes(db: Session, doctor_ids: List[int], operation: str = OPERATION_UPSERT):
+    """То же для массовых изменений: одна вставка нескольких строк журнала. Не выполняет commit."""
+    if doctor_ids:
+        changed_at = datetime.utcnow()
+        db.execute(insert(DoctorProfileChange), [
+            {"doctor_id": doctor_id, "operation": operation, "changed_at": changed_at} for doctor_id in doctor_ids
+        ])
+
+
+class UnsupportedQuery(Exception):
+    """Запрос нельзя выполнить по колонкам каталога - нужно использовать SQL."""
+
+
+def _district_names(districts: List[str]) -> List[str]:
+    """Названия районов из справочника в нижнем регистре; номер в списке - номер бита в маске районов."""
+    return [name.lower() for name in districts][:63]
+
+
+def _district_stem(name: str) -> str:
+    """Основа названия района: "чиланзар" из "чиланзарский район" - находит и "Чиланзар", и "Чиланзарский"."""
+    stem = name.split()[0]
+    return stem[:-4] if stem.endswith("ский") else stem
+
+
+def _district_mask(practice_areas: Optional[str], names: List[str]) -> int:
+    """Маска районов, упомянутых в свободном тексте районов практики врача."""
+    text = (practice_areas or "").lower()
+    mask = 0
+    for bit, name in enumerate(names):
+        if _district_stem(name) in text:
+            mask |= 1 << bit
+    return mask
+
+
+def _query_district_bit(practice_area: str, names: List[str]) -> int:
+    """Бит района для фильтра: как ILIKE '%...%' по названию района. 0, если подходит не ровно один район."""
+    area = practice_area.strip().lower()
+    bits = [1 << bit for bit, name in enumerate(names) if area and area in name]
+    return bits[0] if len(bits) == 1 else 0
+
+
+class ColumnarDoctorCatalog:
+    """
+    Колонки каталога врачей. Строка врача занимает одну позицию во всех колонках;
+    удаленный врач помечается alive = 0, позиция не переиспользуется до полной перестройки.
+    Все чтения и изменения колонок идут под одной блокировкой: запрос по колонкам занимает миллисекунды.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+        self._watermark = 0 # Все строки журнала с id <= watermark уже применены
+        self._synced_at: Optional[float] = None
+
+    def _reset(self):
+        self.ids = array("q")
+        self.costs = array("q")
+        self.verified = array("b")
+        self.specializations = array("i")
+        self.districts = array("q")
+        self.alive = array("b")
+        self.names: List[str] = []
+        self._rows: Dict[int, int] = {} # id врача -> позиция в колонках
+        self._specialization_codes: Dict[str, int] = {}
+        # Маски районов считаются по справочнику этой версии; при смене версии каталог перестраивается
+        reference = reference_catalog.snapshot()
+        self._district_names = _district_names(reference.districts)
+        self._reference_version = reference.version
+        self._name_ranks: Optional[array] = None # Ранг имени для sort=name, пересчитывается после изменений
+
+    def _specialization_code(self, specialization: str) -> int:
+        code = self._specialization_codes.get(specialization)
+        if code is None:
+            code = self._specialization_codes[specialization] = len(self._specialization_codes)
+        return code
+
+    def _apply_row(self, row):
+        position = self._rows.get(row.id)
+        values = (
+            row.cost_per_consultation,
+            1 if row.is_verified else 0,
+            self._specialization_code(row.specialization),
+            _district_mask(row.practice_areas, self._district_names),
+            (row.full_name or "").casefold(),
+        )
+        if position is None:
+            self._rows[row.id] = len(self.ids)
+            self.ids.append(row.id)
+            self.costs.append(values[0])
+            self.verified.append(values[1])
+            self.specializations.append(values[2])
+            self.districts.append(values[3])
+            self.alive.append(1)
+            self.names.append(values[4])
+        else:
+            self.costs[position], self.verified[position], self.specializations[position], self.districts[position], self.names[position] = values
+            self.alive[position] = 1
+        self._name_ranks = None
+
+    def _remove(self, doctor_id: int):
+        position = self._rows.pop(doctor_id, None)
+        if position is not None:
+            self.alive[position] = 0
+
+    @staticmethod
+    def _select_columns():
+        return select(
+            DoctorProfile.id, DoctorProfile.cost_per_consultation, DoctorProfile.is_verified,
+            DoctorProfile.specialization, DoctorProfile.practice_areas, DoctorProfile.full_name,
+        )
+
+    def rebuild(self):
+        """Полностью загружает каталог из БД."""
+        with SessionLocal() as db:
+            watermark = grace_watermark(db, 0)
+            rows = db.execute(self._select_columns().order_by(DoctorProfile.id)).all()
+        with self._lock:
+            self._reset()
+            for row in rows:
+                self._apply_row(row)
+            self._watermark = watermark
+            self._synced_at = time.monotonic()
+        logger.info("Columnar doctor catalog loaded: %d doctors, %d districts (%s)",
+                    len(rows), len(self._district_names), "numpy" if np is not None else "python loops")
+
+    def sync(self):
+        """Применяет новые строки журнала изменений: перечитывает измененные профили пачками."""
+        with SessionLocal() as db:
+            after = self._watermark
+            new_watermark = grace_watermark(db, after)
+            while True:
+                changes = db.execute(
+                    select(DoctorProfileChange.id, DoctorProfileChange.doctor_id)
+                    .where(DoctorProfileChange.id > after)
+                    .order_by(DoctorProfileChange.id)
+                    .limit(CATALOG_SYNC_BATCH_SIZE)
+                ).all()
+                if not changes:
+                    break
+                doctor_ids = {change.doctor_id for change in changes}
+                rows = db.execute(self._select_columns().where(DoctorProfile.id.in_(doctor_ids))).all()
+                with self._lock:
+                    for row in rows:
+                        self._apply_row(row)
+                    # Врачи из журнала, которых нет в таблице, удалены
+                    for doctor_id in doctor_ids - {row.id for row in rows}:
+                        self._remove(doctor_id)
+                after = changes[-1].id
+                if len(changes) < CATALOG_SYNC_BATCH_SIZE:
+                    break
+        with self._lock:
+            self._watermark = max(self._watermark, new_watermark)
+            self._synced_at = time.monotonic()
+
+    def mark_stale(self):
+        """Следующий поиск сначала применит журнал (после записи профиля в этом процессе)."""
+        self._synced_at = 0.0 if self._synced_at is not None else None
+
+    def _ensure_fresh(self):
+        # Новый район справочника (POST /admin/districts) получает бит только при пересчете масок всех врачей,
+        # а тексты районов практики в колонках не хранятся - поэтому полная перестройка (районы меняются редко)
+        if self._synced_at is None or self._reference_version != reference_catalog.snapshot().version:
+            self.rebuild()
+        elif time.monotonic() - self._synced_at >= CATALOG_SYNC_SECONDS:
+            self.sync()
+
+    def _names_ranked(self) -> array:
+        if self._name_ranks is None:
+            order = sorted(range(len(self.names)), key=lambda position: (self.names[position], self.ids[position]))
+            ranks = array("q", bytes(8 * len(order)))
+            for rank, position in enumerate(order):
+                ranks[position] = rank
+            self._name_ranks = ranks
+        return self._name_ranks
+
+    def search(
+        self,
+        specialization: Optional[str] = None,
+        practice_area: Optional[str] = None,
+        min_price: Optional[int] = None,
+        max_price: Optional[int] = None,
+        sort: Optional[str] = None,
+    ) -> List[int]:
+        """
+        Возвращает id всех подходящих врачей в порядке сортировки (страница вырезается вызывающим кодом).
+        Специализация ищется как подстрока без учета регистра (как ILIKE SQL-пути), район - по районам справочника.
+
+        Raises:
+            UnsupportedQuery: Если район не из справочника или в специализации есть символы шаблона LIKE.
+        """
+        if specialization and ("%" in specialization or "_" in specialization):
+            raise UnsupportedQuery("specialization contains LIKE wildcards")
+
+        self._ensure_fresh()
+        with self._lock:
+            # Бит района - по тем же названиям, по которым посчитаны маски врачей (под той же блокировкой)
+            district_bit = None
+            if practice_area:
+                district_bit = _query_district_bit(practice_area, self._district_names)
+                if district_bit == 0:
+                    raise UnsupportedQuery("practice area does not match exactly one district")
+            # Подстрока проверяется по словарю специализаций (десятки строк), колонка сравнивается по кодам
+            specialization_codes = None
+            if specialization:
+                term = specialization.casefold()
+                specialization_codes = [
+                    code for name, code in self._specialization_codes.items() if term in name.casefold()
+                ]
+            if sort == "name":
+                self._names_ranked()
+            if np is not None:
+                return self._search_numpy(specialization_codes, district_bit, min_price, max_price, sort)
+            return self._search_python(specialization_codes, district_bit, min_price, max_price, sort)
+
+    def _search_numpy(self, specialization_codes, district_bit, min_price, max_price, sort) -> List[int]:
+        # np.frombuffer - представление колонок без копирования (колонки не меняются, пока держится блокировка)
+        ids = np.frombuffer(self.ids, dtype=np.int64)
+        costs = np.frombuffer(self.costs, dtype=np.int64)
+        mask = np.frombuffer(self.alive, dtype=np.int8).astype(bool)
+        if specialization_codes is not None:
+            mask &= np.isin(np.frombuffer(self.specializations, dtype=np.int32), specialization_codes)
+        if district_bit is not None:
+            mask &= (np.frombuffer(self.districts, dtype=np.int64) & district_bit) != 0
+        if min_price is not None:
+            mask &= costs >= min_price
+        if max_price is not None:
+            mask &= costs <= max_price
+        positions = np.flatnonzero(mask)
+        if sort == "price":
+            positions = positions[np.lexsort((ids[positions], costs[positions]))]
+        elif sort == "-price":
+            positions = positions[np.lexsort((-ids[positions], -costs[positions]))]
+        elif sort == "name":
+            positions = positions[np.argsort(np.frombuffer(self._name_ranks, dtype=np.int64)[positions], kind="stable")]
+        elif sort == "newest":
+            positions = positions[np.argsort(-ids[positions], kind="stable")]
+        else:
+            positions = positions[np.argsort(ids[positions], kind="stable")]
+        return ids[positions].tolist()
+
+    def _search_python(self, specialization_codes, district_bit, min_price, max_price, sort) -> List[int]:
+        codes = set(specialization_codes) if specialization_codes is not None else None
+        positions = [
+            position for position in range(len(self.ids))
+            if self.alive[position]
+            and (codes is None or self.specializations[position] in codes)
+            and (district_bit is None or self.districts[position] & district_bit)
+            and (min_price is None or self.costs[position] >= min_price)
+            and (max_price is None or self.costs[position] <= max_price)
+        ]
+        if sort == "price":
+            positions.sort(key=lambda position: (self.costs[position], self.ids[position]))
+        elif sort == "-price":
+            positions.sort(key=lambda position: (-self.costs[position], -self.ids[position]))
+        elif sort == "name":
+            positions.sort(key=lambda position: self._name_ranks[position])
+        elif sort == "newest":
+            positions.sort(key=lambda position: -self.ids[position])
+        else:
+            positions.sort(key=lambda position: self.ids[position])
+        return [self.ids[position] for position in positions]
+
+
+if CATALOG_ENGINE == "columnar" and np is None:
+    logger.warning("numpy is not installed: columnar doctor catalog filters run as Python loops (much slower)")
+
+# Каталог процесса (None, если включен SQL-путь)
+doctor_catalog: Optional[ColumnarDoctorCatalog] = ColumnarDoctorCatalog() if CATALOG_ENGINE == "columnar" else None
@@ -0,0 +1,84 @@
+# backend/doctor_queries.py
+
+from typing import Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from models import DoctorProfile
+from working_hours import apply_open_now_filter, apply_open_on_filter
+from geo import apply_near_filter
+
+# --- SQL-запрос списка врачей (GET /api/doctors) ---
+# Вынесен из main.py, чтобы планы запросов можно было проверять отдельно от приложения
+# (tests/test_doctor_query_plans.py: ни одна комбинация фильтров и сортировки не читает всю таблицу).
+
+# Варианты сортировки списка врачей. id в конце делает порядок однозначным (стабильные страницы),
+# а составные индексы doctor_profiles (см. models.py) позволяют БД читать строки уже в нужном порядке.
+DOCTOR_SORTS = {
+    "price": (DoctorProfile.cost_per_consultation.asc(), DoctorProfile.id.asc()),
+    "-price": (DoctorProfile.cost_per_consultation.desc(), DoctorProfile.id.desc()),
+    "name": (DoctorProfile.full_name.asc(), DoctorProfile.id.asc()),
+    "newest": (DoctorProfile.id.desc(),),
+}
+
+
+def build_doctor_query(
+    db: Session,
+    specialization: Optional[str] = None,
+    practice_area: Optional[str] = None,
+    min_price: Optional[int] = None,
+    max_price: Optional[int] = None,
+    open_on: Optional[int] = None,
+    open_now: bool = False,
+    point: Optional[Tuple[float, float]] = None,
+    radius: float = 5.0,
+    sort: Optional[str] = None,
+):
+    """
+    Запрос врачей с фильтрами и сортировкой. open_on - номер дня недели (0 - понедельник),
+    point - (lat, lon) для поиска рядом (без sort результаты - от ближнего к дальнему).
+    """
+    query = db.query(DoctorProfile)
+    indexed = False  # Есть ли фильтр, который БД может выполнить по индексу
+    if specialization:
+        # Поиск подстроки: специализация врача - свободный текст ("Терапевт, кардиолог"), не значение справочника
+        query = query.filter(DoctorProfile.specialization.ilike(f"%{specialization}%"))
+    if practice_area:
+        query = query.filter(DoctorProfile.practice_areas.ilike(f"%{practice_area}%"))
+    if min_price is not None:
+        query = query.filter(DoctorProfile.cost_per_consultation >= min_price)
+        indexed = True
+    if max_price is not None:
+        query = query.filter(DoctorProfile.cost_per_consultation <= max_price)
+        indexed = True
+    # Фильтры по рабочему времени проверяют заранее посчитанные битовые маски, а не разбирают расписание
+    if open_on is not None:
+        query = apply_open_on_filter(query, DoctorProfile, open_on)
+        indexed = True
+    if open_now:
+        query = apply_open_now_filter(query, DoctorProfile)
+        indexed = True
+    # Поиск рядом с точкой: отбор по индексу geohash и сортировка по расстоянию (k ближайших - первая страница)
+    if point is not None:
+        query = apply_near_filter(query, DoctorProfile, point[0], point[1], radius)
+        indexed = True
+        if sort is None:
+            return query
+    if indexed and sort in (None, "newest"):
+        # Порядок по id с LIMIT планировщик охотно выполняет обходом первичного ключа (без сортировки),
+        # и при избирательном фильтре это чтение почти всей таблицы. Выражение id + 0 не совпадает
+        # с первичным ключом: строки отбираются по индексу фильтра, сортируются только найденные.
+        key = DoctorProfile.id + 0
+        return query.order_by(None).order_by(key.desc() if sort == "newest" else key.asc())
+    if sort is not None:
+        # Явная сортировка заменяет сортировку по расстоянию (фильтр по радиусу остается)
+        return query.order_by(None).order_by(*DOCTOR_SORTS[sort])
+    return query.order_by(DoctorProfile.id)
+
+
+def count_doctors(query) -> int:
+    """
+    Общее число врачей по запросу build_doctor_query. ORDER BY убирается: query.count() оборачивает запрос
+    в подзапрос, и сортировка в нем заставляет БД читать всю таблицу в порядке сортировки вместо индекса фильтра.
+    """
+    return query.order_by(None).count()
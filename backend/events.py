@@ -0,0 +1,326 @@
+# backend/events.py
+
+import os
+import json
+import uuid
+import socket
+import asyncio
+import logging
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Callable, Dict, Optional, Set
+
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Типы событий, которые получает пользователь по SSE ---
+EVENT_EMAIL_VERIFIED = "email_verified"   # Email подтвержден, аккаунт активирован
+EVENT_PROFILE_UPDATED = "profile_updated" # Профиль пациента/врача создан или изменен
+EVENT_ROLE_CHANGED = "role_changed"       # Роль пользователя изменилась (Google-профиль)
+EVENT_DOCTOR_VERIFIED = "doctor_verified" # Администратор изменил статус верификации врача
+
+# --- Настройки шины событий ---
+
+# Какой "backplane" используется для доставки событий между воркерами uvicorn:
+#   unix  - Unix-сокеты в общей директории (по умолчанию, для одного хоста)
+#   redis - Redis (или совместимый сервер: Valkey, KeyDB) через PUB/SUB
+#   local - только внутри текущего процесса (один воркер, разработка)
+EVENTS_BACKPLANE = os.getenv("EVENTS_BACKPLANE", "unix")
+# Директория, в которой каждый воркер создает свой датаграммный сокет
+EVENTS_SOCKET_DIR = os.getenv("EVENTS_SOCKET_DIR", os.path.join(tempfile.gettempdir(), "vrachi-events"))
+EVENTS_REDIS_URL = os.getenv("EVENTS_REDIS_URL", "redis://localhost:6379/0")
+EVENTS_REDIS_CHANNEL = os.getenv("EVENTS_REDIS_CHANNEL", "vrachi:user-events")
+
+# Как часто отправлять комментарий-keepalive, чтобы прокси не закрывали соединение
+SSE_KEEPALIVE_SECONDS = 15
+# Максимум событий в очереди одного подключения (медленный клиент теряет самые старые)
+SUBSCRIBER_QUEUE_SIZE = 100
+# Максимальный размер датаграммы с событием
+MAX_EVENT_SIZE = 64 * 1024
+
+
+# --- Локальные подписчики (SSE-подключения текущего воркера) ---
+
+class Subscription:
+    """
+    Одно SSE-подключение пользователя. События кладутся в asyncio.Queue
+    из любого потока через loop.call_soon_threadsafe.
+    """
+
+    def __init__(self, user_id: int, loop: asyncio.AbstractEventLoop):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def deliver(self, event: dict):
+        # Вызывается из потока backplane, поэтому передаем событие в event loop подключения
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event: dict):
+        if self.queue.full():
+            # Клиент не успевает читать - выбрасываем самое старое событие
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+
+class LocalHub:
+    """Реестр SSE-подключений текущего процесса, сгруппированных по user_id."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+
+    def subscribe(self, user_id: int, loop: asyncio.AbstractEventLoop) -> Subscription:
+        subscription = Subscription(user_id, loop)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[subscription.user_id]
+
+    def dispatch(self, event: dict):
+        # Копируем множество под блокировкой, а доставляем уже без нее
+        with self._lock:
+            subscriptions = list(self._subscribers.get(event.get("user_id"), ()))
+        for subscription in subscriptions:
+            try:
+                subscription.deliver(event)
+            except RuntimeError:
+                # Event loop подключения уже закрыт (воркер останавливается)
+                self.unsubscribe(subscription)
+
+
+# --- Backplane: доставка событий между воркерами ---
+
+class Backplane(ABC):
+    """
+    Базовый класс backplane. publish() рассылает событие всем воркерам,
+    а каждый воркер передает полученные сообщения в on_message.
+    Реализация без start() или publish() не создается (TypeError при создании, а не при первой публикации).
+    """
+
+    @abstractmethod
+    def start(self, on_message: Callable[[bytes], None]):
+        ...
+
+    @abstractmethod
+    def publish(self, payload: bytes):
+        ...
+
+    def close(self):
+        pass
+
+
+class LocalBackplane(Backplane):
+    """Доставка только внутри текущего процесса (один воркер)."""
+
+    def start(self, on_message: Callable[[bytes], None]):
+        self._on_message = on_message
+
+    def publish(self, payload: bytes):
+        self._on_message(payload)
+
+
+class UnixSocketBackplane(Backplane):
+    """
+    Backplane для одного хоста без отдельного брокера.
+    Каждый воркер привязывает свой датаграммный Unix-сокет в общей директории,
+    publish() отправляет датаграмму в каждый сокет директории (fan-out),
+    а фоновый поток воркера читает свой сокет и раздает события локальным подписчикам.
+    Сокеты завершившихся воркеров удаляются при первой неудачной отправке.
+    """
+
+    def __init__(self, socket_dir: str = EVENTS_SOCKET_DIR):
+        self.socket_dir = socket_dir
+        self.path: Optional[str] = None
+        self._receiver: Optional[socket.socket] = None
+        self._sender: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, on_message: Callable[[bytes], None]):
+        os.makedirs(self.socket_dir, mode=0o700, exist_ok=True)
+        self.path = os.path.join(self.socket_dir, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.sock")
+        self._receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._receiver.bind(self.path)
+        self._receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+        # Отправляющий сокет не блокируется: если у получателя переполнен буфер, событие теряется,
+        # но запрос, который его опубликовал, не ждет
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.setblocking(False)
+
+        def receive_loop():
+            while True:
+                try:
+                    payload = self._receiver.recv(MAX_EVENT_SIZE)
+                except OSError:
+                    # Сокет закрыт в close()
+                    return
+                on_message(payload)
+
+        self._thread = threading.Thread(target=receive_loop, name="events-unix-backplane", daemon=True)
+        self._thread.start()
+
+    def publish(self, payload: bytes):
+        for entry in os.scandir(self.socket_dir):
+            if not entry.name.endswith(".sock"):
+                continue
+            try:
+                self._sender.sendto(payload, entry.path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Воркер, создавший сокет, больше не существует
+                if entry.path != self.path:
+                    try:
+                        os.unlink(entry.path)
+                    except FileNotFoundError:
+                        pass
+            except BlockingIOError:
+                logger.warning("Event dropped: receive buffer of %s is full", entry.name)
+
+    def close(self):
+        for sock in (self._receiver, self._sender):
+            if sock is not None:
+                sock.close()
+        if self.path:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class RedisBackplane(Backplane):
+    """
+    Backplane через Redis PUB/SUB (работает и с совместимыми серверами).
+    Нужен пакет redis (pip install redis), он не входит в обязательные зависимости.
+    """
+
+    def __init__(self, url: str = EVENTS_REDIS_URL, channel: str = EVENTS_REDIS_CHANNEL):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("EVENTS_BACKPLANE=redis requires the 'redis' package (pip install redis)") from e
+        self.channel = channel
+        self._client = redis.Redis.from_url(url)
+        self._pubsub = None
+        self._thread = None
+
+    def start(self, on_message: Callable[[bytes], None]):
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{self.channel: lambda message: on_message(message["data"])})
+        self._thread = self._pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+
+    def publish(self, payload: bytes):
+        self._client.publish(self.channel, payload)
+
+    def close(self):
+        if self._thread is not None:
+            self._thread.stop()
+        if self._pubsub is not None:
+            self._pubsub.close()
+        self._client.close()
+
+
+def create_backplane(kind: str = EVENTS_BACKPLANE) -> Backplane:
+    """Создает backplane по имени из настройки EVENTS_BACKPLANE."""
+    if kind == "redis":
+        return RedisBackplane()
+    if kind == "unix":
+        if not hasattr(socket, "AF_UNIX"):
+            logger.warning("Unix sockets are not available on this platform, falling back to local event delivery")
+            return LocalBackplane()
+        return UnixSocketBackplane()
+    if kind == "local":
+        return LocalBackplane()
+    raise ValueError(f"Unknown EVENTS_BACKPLANE: {kind}")
+
+
+# --- Публичный интерфейс модуля ---
+
+hub = LocalHub()
+_backplane: Optional[Backplane] = None
+_backplane_lock = threading.Lock()
+
+
+def _on_message(payload: bytes):
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        logger.warning("Malformed event payload received from backplane")
+        return
+    hub.dispatch(event)
+
+
+def get_backplane() -> Backplane:
+    """Возвращает backplane текущего процесса, запуская его при первом обращении."""
+    global _backplane
+    if _backplane is None:
+        with _backplane_lock:
+            if _backplane is None:
+                backplane = create_backplane()
+                backplane.start(_on_message)
+                _backplane = backplane
+    return _backplane
+
+
+def close_backplane():
+    """Останавливает backplane (вызывается при остановке приложения)."""
+    global _backplane
+    with _backplane_lock:
+        if _backplane is not None:
+            _backplane.close()
+            _backplane = None
+
+
+def publish_user_event(user_id: int, event_type: str, data: Optional[dict] = None):
+    """
+    Публикует событие для всех SSE-подключений пользователя во всех воркерах.
+    Вызывается ПОСЛЕ commit(), чтобы клиент не увидел событие раньше данных.
+    Ошибки доставки только логируются - запись в БД уже выполнена и не должна падать из-за уведомления.
+    """
+    event = {
+        "id": uuid.uuid4().hex,
+        "type": event_type,
+        "user_id": user_id,
+        "data": data or {},
+        "ts": datetime.utcnow().isoformat(),
+    }
+    try:
+        get_backplane().publish(json.dumps(event, ensure_ascii=False).encode("utf-8"))
+    except Exception:
+        logger.exception("Failed to publish %s event for user %s", event_type, user_id)
+
+
+def format_sse(event: dict) -> str:
+    """Форматирует событие в формате text/event-stream."""
+    data = json.dumps({"type": event["type"], "data": event["data"], "ts": event["ts"]}, ensure_ascii=False)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+async def stream_user_events(user_id: int):
+    """
+    Асинхронный генератор для StreamingResponse: подписывает подключение на события
+    пользователя и отдает их в формате SSE, пока клиент не отключится.
+    """
+    get_backplane()
+    subscription = hub.subscribe(user_id, asyncio.get_running_loop())
+    try:
+        # Просим EventSource переподключаться через 5 секунд после обрыва
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield format_sse(event)
+    finally:
+        hub.unsubscribe(subscription)
@@ -0,0 +1,61 @@
+# backend/field_selection.py
+
+from functools import lru_cache
+from typing import List, Optional, Tuple, Type
+
+from pydantic import BaseModel, create_model
+from sqlalchemy.orm import load_only
+
+from models import DoctorProfile
+
+# --- Выборочные поля ответа (?fields=full_name,specialization) ---
+# Клиент перечисляет нужные поля; ответ строится по модели, в которой есть только эти поля,
+# а из БД читаются только колонки, нужные для них (длинный education не читается и не передается).
+# Модели для каждого набора полей создаются один раз и кэшируются (create_model заметно дорогой).
+
+# Поля ответа, которые вычисляются из нескольких колонок или не хранятся в doctor_profiles
+DOCTOR_FIELD_COLUMNS = {
+    "working_hours": [
+        DoctorProfile.hours_mon, DoctorProfile.hours_tue, DoctorProfile.hours_wed, DoctorProfile.hours_thu,
+        DoctorProfile.hours_fri, DoctorProfile.hours_sat, DoctorProfile.hours_sun,
+    ],
+    "rating": [],         # Заглушка, колонки нет
+    "reviews_count": [],  # Заглушка, колонки нет
+}
+
+
+def parse_fields(value: Optional[str], model: Type[BaseModel]) -> Optional[Tuple[str, ...]]:
+    """
+    Разбирает список полей "a,b,c" и проверяет его по полям модели ответа (allow-list).
+    Возвращает отсортированный кортеж (одинаковый для любого порядка в запросе) или None, если fields не передан.
+    id включается всегда: по нему клиент сопоставляет записи.
+    """
+    if value is None:
+        return None
+    fields = {field.strip() for field in value.split(",") if field.strip()}
+    unknown = sorted(fields - set(model.model_fields))
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(model.model_fields)}")
+    if "id" in model.model_fields:
+        fields.add("id")
+    return tuple(sorted(fields))
+
+
+@lru_cache(maxsize=256)
+def sparse_model(model: Type[BaseModel], fields: Tuple[str, ...]) -> Type[BaseModel]:
+    """Модель ответа только с полями fields (типы и значения по умолчанию - из исходной модели)."""
+    definitions = {name: (model.model_fields[name].annotation, model.model_fields[name]) for name in fields}
+    return create_model(f"{model.__name__}[{','.join(fields)}]", __config__=model.model_config, **definitions)
+
+
+def doctor_load_options(fields: Optional[Tuple[str, ...]]) -> List:
+    """Опции запроса DoctorProfile: читать только колонки, нужные для полей fields (все, если fields=None)."""
+    if fields is None:
+        return []
+    columns = []
+    for field in fields:
+        if field in DOCTOR_FIELD_COLUMNS:
+            columns.extend(DOCTOR_FIELD_COLUMNS[field])
+        else:
+            columns.append(getattr(DoctorProfile, field))
+    return [load_only(*columns)]
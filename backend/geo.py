@@ -0,0 +1,117 @@
+# backend/geo.py
+
+import math
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+
+# --- Поиск врачей рядом с точкой ---
+# Место практики врача хранится как latitude/longitude и geohash (GEOHASH_PRECISION символов) с индексом.
+# Geohash - это строка, у которой общий префикс означает общую ячейку сетки, поэтому отбор кандидатов
+# рядом с точкой - несколько диапазонов по индексу geohash (ячейка с точкой и 8 соседних),
+# а не перебор всех врачей. Точное расстояние считается только для кандидатов.
+# Подход одинаково работает в MySQL и в SQLite (локальная разработка), в отличие от SPATIAL индексов MySQL.
+GEOHASH_PRECISION = 6 # Ячейка около 1.2 x 0.6 км
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32 # Длина градуса широты (и долготы на экваторе)
+MAX_RADIUS_KM = 50.0
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def encode_geohash(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Geohash точки: биты долготы и широты по очереди, по 5 бит на символ."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits, bit_count, even = 0, 0, True
+    while len(chars) < precision:
+        target, value = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (target[0] + target[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            target[0] = middle
+        else:
+            target[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def cell_size_degrees(precision: int) -> Tuple[float, float]:
+    """Размер ячейки geohash в градусах: (по широте, по долготе)."""
+    lat_bits = 5 * precision // 2
+    lon_bits = 5 * precision - lat_bits
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def covering_cells(latitude: float, longitude: float, radius_km: float) -> List[str]:
+    """
+    Ячейки geohash, покрывающие круг радиуса radius_km: ячейка с центром и ее соседи.
+    Точность выбирается так, чтобы ячейка была не меньше радиуса, тогда круг не выходит за 9 ячеек.
+    """
+    lon_scale = max(math.cos(math.radians(latitude)), 0.01)
+    precision = GEOHASH_PRECISION
+    while precision > 1:
+        lat_size, lon_size = cell_size_degrees(precision)
+        if lat_size * KM_PER_DEGREE >= radius_km and lon_size * KM_PER_DEGREE * lon_scale >= radius_km:
+            break
+        precision -= 1
+    lat_size, lon_size = cell_size_degrees(precision)
+    cells = set()
+    for lat_step in (-1, 0, 1):
+        for lon_step in (-1, 0, 1):
+            lat = min(max(latitude + lat_step * lat_size, -90.0), 90.0)
+            lon = (longitude + lon_step * lon_size + 180.0) % 360.0 - 180.0
+            cells.add(encode_geohash(lat, lon, precision))
+    return sorted(cells)
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Расстояние по поверхности Земли в километрах."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi, d_lambda = phi2 - phi1, math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def parse_point(value: str) -> Tuple[float, float]:
+    """Разбирает "lat,lon" и проверяет диапазоны."""
+    latitude, longitude = (float(part) for part in value.split(","))
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        raise ValueError("Coordinates are out of range")
+    return latitude, longitude
+
+
+def location_values(latitude: Optional[float], longitude: Optional[float]) -> dict:
+    """Значения колонок latitude, longitude и geohash для записи профиля."""
+    if latitude is None or longitude is None:
+        return {"latitude": None, "longitude": None, "geohash": None}
+    return {"latitude": latitude, "longitude": longitude, "geohash": encode_geohash(latitude, longitude)}
+
+
+def _squared_distance(model, latitude: float, longitude: float):
+    """
+    Квадрат расстояния в градусах широты (равнопромежуточная проекция) - SQL-выражение для сортировки.
+    На расстояниях в пределах города погрешность меньше процента, а выражение - простая арифметика в любой СУБД.
+    """
+    lon_scale = math.cos(math.radians(latitude))
+    d_lat = model.latitude - latitude
+    d_lon = (model.longitude - longitude) * lon_scale
+    return d_lat * d_lat + d_lon * d_lon
+
+
+def apply_near_filter(query, model, latitude: float, longitude: float, radius_km: float):
+    """
+    Оставляет врачей в радиусе radius_km от точки и сортирует их от ближнего к дальнему.
+    Кандидаты отбираются диапазонами по индексу geohash, затем отсекаются по расстоянию.
+    """
+    cells = covering_cells(latitude, longitude, radius_km)
+    # Диапазон [cell, cell + '~') - это все geohash с префиксом cell ('~' больше любого символа base32)
+    query = query.filter(or_(*[and_(model.geohash >= cell, model.geohash < cell + "~") for cell in cells]))
+    distance = _squared_distance(model, latitude, longitude)
+    query = query.filter(distance <= (radius_km / KM_PER_DEGREE) ** 2)
+    return query.order_by(distance, model.id)
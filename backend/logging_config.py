@@ -0,0 +1,216 @@
+# backend/logging_config.py
+
+import os
+import sys
+import copy
+import json
+import time
+import uuid
+import queue
+import atexit
+import random
+import logging
+import contextvars
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+# --- Структурированное логирование через очередь ---
+# Код запроса (в цикле событий или в потоке пула) только кладет запись в очередь в памяти - без ввода-вывода.
+# Запись в stdout (JSON-строка на запись) делает отдельный поток QueueListener. Очередь ограничена:
+# если поток записи не успевает, новые записи отбрасываются (и считаются), а не блокируют запрос.
+#
+# К каждой записи добавляются поля текущего запроса (request_id, method, route, user_id) из контекста,
+# который заполняет RequestLogMiddleware; в конце запроса пишется строка access-лога с latency_ms.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json - одна JSON-строка на запись (продакшен), text - читаемый вид для разработки
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Доля записей, которые сохраняются, по уровням: "DEBUG=0.01,INFO=0.1". Уровни WARNING и выше по умолчанию не сэмплируются.
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+# Писать ли access-лог (строку на каждый запрос)
+LOG_REQUESTS = os.getenv("LOG_REQUESTS", "on") == "on"
+
+REQUEST_ID_HEADER = b"x-request-id"
+
+# Контекст текущего запроса. Изменяемый словарь, а не отдельные переменные: поля, заполненные
+# в потоке пула (например, user_id в зависимости аутентификации), видны и middleware в цикле событий.
+_request_context: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("request_context", default=None)
+
+# Стандартные атрибуты LogRecord - все остальные (переданные через extra=) попадают в JSON как поля
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+def set_log_user(user_id: int):
+    """Добавляет id пользователя в контекст логов текущего запроса (вызывается после аутентификации)."""
+    context = _request_context.get()
+    if context is not None:
+        context["user_id"] = user_id
+
+
+def _parse_sample_rates(value: str) -> Dict[int, float]:
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        level, _, rate = item.partition("=")
+        rates[logging.getLevelName(level.strip().upper())] = float(rate)
+    return rates
+
+
+class ContextFilter(logging.Filter):
+    """
+    Выполняется в потоке, который пишет запись (до очереди): добавляет поля текущего запроса
+    и отбрасывает часть записей по LOG_SAMPLE_RATES.
+    """
+
+    def __init__(self, sample_rates: Dict[int, float]):
+        super().__init__()
+        self.sample_rates = sample_rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.sample_rates.get(record.levelno)
+        if rate is not None and random.random() >= rate:
+            return False
+        context = _request_context.get()
+        if context is not None:
+            for key, value in context.items():
+                if not hasattr(record, key):
+                    setattr(record, key, value)
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler, который при переполненной очереди отбрасывает запись вместо ожидания."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Аргументы сообщения подставляются сразу (объекты могут измениться, пока запись в очереди),
+        # текст исключения - отдельным полем exc_text, а не в конце сообщения, как в стандартном prepare
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, сообщение, поля контекста и extra."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                data[key] = value
+        # NonBlockingQueueHandler.prepare уже превратил исключение в текст (exc_text)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _LoggingState:
+    def __init__(self):
+        self.handler: Optional[NonBlockingQueueHandler] = None
+        self.listener: Optional[QueueListener] = None
+
+
+_state = _LoggingState()
+
+
+def configure_logging():
+    """
+    Подключает очередь к корневому логгеру и запускает поток записи. Повторный вызов ничего не делает.
+    Поток останавливается при выходе из процесса (atexit) - после остановки приложения и его фоновых потоков.
+    """
+    if _state.listener is not None:
+        return
+    log_queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    output = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s]: %(message)s", defaults={"request_id": "-"}))
+
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(ContextFilter(_parse_sample_rates(LOG_SAMPLE_RATES)))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    _state.handler = handler
+    _state.listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _state.listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Дописывает записи из очереди и останавливает поток записи."""
+    listener, _state.listener = _state.listener, None
+    if listener is not None:
+        listener.stop()
+        if _state.handler is not None and _state.handler.dropped:
+            sys.stderr.write(f"logging: {_state.handler.dropped} records dropped (queue full)\n")
+
+
+access_logger = logging.getLogger("access")
+
+
+class RequestLogMiddleware:
+    """
+    ASGI middleware: заводит контекст логов запроса (request_id из X-Request-ID или новый),
+    возвращает X-Request-ID в ответе и пишет строку access-лога со статусом и latency_ms.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for key, value in scope["headers"]:
+            if key == REQUEST_ID_HEADER:
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        context = {"request_id": request_id, "method": scope["method"], "path": scope["path"], "user_id": None}
+        token = _request_context.set(context)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (REQUEST_ID_HEADER, request_id.encode("latin-1"))]}
+                # Маршрут (шаблон пути) известен после маршрутизации - к началу ответа он уже в scope
+                route = scope.get("route")
+                if route is not None:
+                    context["route"] = route.path
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            if LOG_REQUESTS:
+                access_logger.info(
+                    "%s %s %d", scope["method"], scope["path"], status_code,
+                    extra={"status": status_code, "latency_ms": round((time.perf_counter() - started) * 1000, 2)},
+                )
+            _request_context.reset(token)
@@ -2,26 +2,82 @@
 
 import os
 import uuid # Импортируем uuid для генерации токенов
-from fastapi import FastAPI, Depends, HTTPException, status, APIRouter, BackgroundTasks, Query # Добавляем BackgroundTasks для фоновых задач и Query для поиска
+from fastapi import FastAPI, Depends, HTTPException, status, APIRouter, BackgroundTasks, Query, Request # Добавляем BackgroundTasks для фоновых задач и Query для поиска
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer # Добавляем OAuth2PasswordRequestForm и OAuth2PasswordBearer
 from sqlalchemy.orm import Session
-from typing import Annotated, List, Optional, Union
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import insert, update, select, false, case
+from typing import Annotated, List, Optional, Tuple, Union
 from datetime import timedelta, datetime # Импортируем timedelta и datetime
 from fastapi.middleware.cors import CORSMiddleware
 import smtplib  # Для SMTP-соединения
 from email.mime.text import MIMEText  # Для создания email
 from email.mime.multipart import MIMEMultipart  # Для создания составных email
 from math import ceil
+from contextlib import asynccontextmanager
 from pydantic import BaseModel  # Для моделей данных
+from fastapi.responses import StreamingResponse, JSONResponse, Response  # Для потока событий (Server-Sent Events)
 
 # Импортируем наши модели и функцию для получения сессии БД
-from models import User, PatientProfile, DoctorProfile, get_db, DATABASE_URL, engine, Base # Добавляем модели профилей
+from models import User, PatientProfile, DoctorProfile, Consultation, DoctorSlot, District, Specialization, get_db, DATABASE_URL, engine, Base # Добавляем модели профилей
 # Импортируем функции для работы с паролями и JWT, а также зависимости для аутентификации и ролей
 # get_current_user и require_role используются как зависимости в эндпоинтах
-from auth import get_password_hash, verify_password, create_access_token, SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user, require_role, authenticate_user, get_current_active_user, SECURE_TOKEN_LENGTH, Token as TokenModel, verify_google_token, authenticate_google_user
+from auth import get_password_hash, verify_password, create_access_token, SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, get_current_user, require_role, authenticate_user, get_current_active_user, get_current_user_with_profile, SECURE_TOKEN_LENGTH, EMAIL_VERIFICATION_TOKEN_EXPIRE_HOURS, Token as TokenModel, verify_google_token, authenticate_google_user
 
 # Импортируем pydantic модели для валидации данных запросов и ответов
 from schemas import UserCreate, UserResponse, Token, PatientProfileCreateUpdate, PatientProfileResponse, DoctorProfileCreateUpdate, DoctorProfileResponse, Field, DoctorFilter, DoctorBrief, DoctorDetail, DoctorListResponse # Импортируем Field (хотя он нужен только в schemas.py), DoctorFilter, DoctorBrief, DoctorDetail, DoctorListResponse
+from schemas import ConsultationCreate, ConsultationResponse, MessageCreate, MessageAccepted, MessageHistoryResponse
+from schemas import SlotsCreate, SlotResponse
+from schemas import DoctorBatchRequest, DoctorBatchResponse
+from schemas import SessionBootstrapResponse, ReferenceDataResponse, DistrictCreate, SpecializationCreate
+from schemas import RefreshTokenRequest
+from schemas import DoctorSuggestion
+from schemas import DoctorVerificationQueueResponse, DoctorVerificationRequest, DoctorVerificationResult
+from schemas import UserSearchResponse
+from schemas import DoctorChangesResponse
+
+# Шина событий пользователя (SSE) с доставкой между воркерами
+from events import publish_user_event, stream_user_events, close_backplane, EVENT_EMAIL_VERIFIED, EVENT_PROFILE_UPDATED, EVENT_ROLE_CHANGED, EVENT_DOCTOR_VERIFIED
+# Буфер записи сообщений чата и чтение истории
+from chat import message_buffer, fetch_history
+# Расписание врачей и бронирование слотов
+from booking import validate_intervals, find_overlapping_slots, book_slot, cancel_booking, to_naive_utc, SlotConflictError
+# Фильтры по рабочим часам врачей (битовые маски)
+from working_hours import parse_weekday, encode_week, decode_week
+# Запись одним запросом (upsert) с опорой на уникальные ограничения
+from upserts import upsert_returning, update_returning_id
+# Справочные данные (районы) с версией содержимого
+from reference_data import reference_catalog, get_reference_data, district_centroid, DEFAULT_SPECIALIZATION
+# Колоночный каталог врачей в памяти (CATALOG_ENGINE=columnar) и журнал изменений профилей
+from doctor_catalog import doctor_catalog, record_doctor_change, record_doctor_changes, UnsupportedQuery
+# Общий для воркеров снимок каталога врачей в файле, отображенном в память (CATALOG_SNAPSHOT=on)
+from catalog_snapshot import catalog_snapshot, CatalogSnapshotRefresher
+# Индекс подсказок (typeahead) по ФИО врачей и специализациям
+from suggest import doctor_suggestions, SUGGEST_MAX_LIMIT
+# Поиск ближайших врачей по geohash
+from geo import parse_point, location_values, haversine_km, MAX_RADIUS_KM
+# Открытые ключи подписи JWT для других сервисов
+from signing_keys import keyring
+# Ротируемые refresh-токены (обновление access-токена без пароля)
+from refresh_tokens import issue_refresh_token, rotate_refresh_token, revoke_refresh_token, RefreshTokenError
+# Ограничение частоты запросов и сброс нагрузки для эндпоинтов аутентификации
+from rate_limit import enforce_auth_rate_limit, shed_load_if_saturated, limiter_metrics, ServiceOverloaded
+# Фоновое обслуживание БД (очистка просроченных токенов и неподтвержденных аккаунтов, архивация)
+from maintenance import maintenance_scheduler, maintenance_status
+# Поиск и потоковая выгрузка пользователей для администратора
+from admin_users import search_users, iter_user_export, USER_SEARCH_MAX_LIMIT, EXPORT_FORMATS
+# Выборочное профилирование запросов (flame graph по маршрутам)
+from profiling import SamplingProfilerMiddleware, PROFILING_ENABLED, PROFILING_TOKEN_MAX_MINUTES, PROFILE_HEADER, create_profile_token
+# Структурированные логи (JSON) через очередь и фоновый поток записи
+from logging_config import configure_logging, RequestLogMiddleware
+# Выборочные поля ответа (?fields=...) для эндпоинтов чтения врачей
+from field_selection import parse_fields, sparse_model, doctor_load_options
+
+# SQL-запрос списка врачей (фильтры и сортировки GET /api/doctors)
+from doctor_queries import DOCTOR_SORTS, build_doctor_query, count_doctors
+
+from change_feed import read_doctor_changes, current_position, ChangeFeedExpired, DOCTOR_CHANGES_MAX_LIMIT
+import logging
 
 
 # Для загрузки .env файла (важно вызвать где-то в начале приложения, лучше в auth.py)
@@ -31,6 +87,10 @@ from dotenv import load_dotenv
 # Можно вызвать явно здесь, если уверены, что он не вызывается в импортируемых модулях:
 load_dotenv()
 
+# Логи настраиваются до создания таблиц и старта фоновых потоков, чтобы их записи тоже попали в JSON-лог
+configure_logging()
+logger = logging.getLogger(__name__)
+
 
 # Определяем базовый URL для подтверждения email (адрес страницы фронтенда, куда пользователь перейдет по ссылке из письма)
 # В реальном проекте это должна быть переменная окружения, читаемая из .env!
@@ -57,12 +117,37 @@ try:
 except Exception as e:
     # Логируем ошибку, если не удалось подключиться к БД при старте (например, БД не запущена).
     # Это полезно для отладки.
-    print(f"Error creating database tables: {e}")
+    logger.error("Error creating database tables: %s", e)
     # Можно также решить, стоит ли останавливать приложение, если БД недоступна при старте.
     # Для разработки можно просто вывести ошибку, для продакшена, возможно, лучше остановить.
 
 
-app = FastAPI() # Создаем экземпляр FastAPI приложения
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Жизненный цикл приложения: код до yield выполняется при старте воркера, после - при остановке.
+    """
+    # Загружаем справочники (и заполняем пустые таблицы) до первого запроса
+    reference_catalog.snapshot()
+    # Снимок каталога обновляет один воркер из всех (по файловой блокировке), остальные только читают
+    snapshot_refresher = CatalogSnapshotRefresher(doctor_public_fields) if catalog_snapshot is not None else None
+    if snapshot_refresher is not None:
+        snapshot_refresher.start()
+    # Планировщик обслуживания работает в каждом воркере, задачи выполняет только держатель аренды в БД
+    if maintenance_scheduler is not None:
+        maintenance_scheduler.start()
+    yield
+    if maintenance_scheduler is not None:
+        maintenance_scheduler.stop()
+    if snapshot_refresher is not None:
+        snapshot_refresher.stop()
+    # Дописываем сообщения, оставшиеся в буфере записи
+    message_buffer.close()
+    # Закрываем сокет/подписку backplane событий, чтобы другие воркеры не слали в него события
+    close_backplane()
+
+
+app = FastAPI(lifespan=lifespan) # Создаем экземпляр FastAPI приложения
 origins = [
     "http://localhost", # Разрешаем доступ с localhost (обычно для статики)
     "http://localhost:5173", # <--- РАЗРЕШАЕМ ДОСТУП С НАШЕГО ФРОНТЕНДА НА VITE!
@@ -78,6 +163,22 @@ app.add_middleware(
     allow_methods=["*"], # Разрешаем все HTTP методы (GET, POST, PUT, DELETE и т.д.)
     allow_headers=["*"], # Разрешаем все заголовки в запросах (включая Authorization)
 )
+# Выборочное профилирование запросов (PROFILING_ENABLED=on); выключенное не добавляет middleware вовсе
+if PROFILING_ENABLED:
+    app.add_middleware(SamplingProfilerMiddleware)
+# Контекст логов запроса (request_id, маршрут, пользователь) и access-лог; внешний middleware - видит полное время запроса
+app.add_middleware(RequestLogMiddleware)
+
+
+# Перегрузка (очередь bcrypt или пула потоков заполнена) превращается в 503 с Retry-After,
+# чтобы клиенты повторили запрос позже, а не держали соединение в очереди.
+@app.exception_handler(ServiceOverloaded)
+async def service_overloaded_handler(request: Request, exc: ServiceOverloaded):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Service is busy, please try again later"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 
 # Dependency для получения сессии базы данных. Используется в роутах для взаимодействия с БД.
@@ -180,18 +281,12 @@ def send_verification_email(email: str, token: str):
         # Закрываем соединение
         server.quit()
         
-        print(f"Email verification sent to {email}")
+        logger.info("Email verification sent", extra={"to": email})
     except Exception as e:
-        # В случае ошибки выводим сообщение в консоль
-        # В продакшене здесь должна быть реализована система логирования ошибок
-        print(f"Error sending email: {e}")
-        
-        # В случае ошибки отправки, выводим ссылку в консоль (как запасной вариант)
-        print(f"\n--- EMAIL VERIFICATION FAILED, SHOWING LINK ---")
-        print(f"To: {email}")
-        print(f"Subject: Confirm your email address")
-        print(f"Link: {verification_link}")
-        print(f"--------------------------------------------\n")
+        logger.error("Error sending verification email: %s", e, extra={"to": email})
+        # Ссылка содержит одноразовый токен, поэтому как запасной вариант для разработки
+        # она пишется только на уровне DEBUG (LOG_LEVEL=DEBUG), в продакшен-логи не попадает
+        logger.debug("Verification link for %s: %s", email, verification_link)
 
 # --- Роуты для базовых пользователей и аутентификации ---
 
@@ -205,21 +300,19 @@ def get_status():
 
 
 # Эндпоинт для регистрации нового пользователя. Не требует авторизации.
-@app.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED) # 201 Created - стандартный статус для успешного создания
+@app.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED, dependencies=[Depends(shed_load_if_saturated)]) # 201 Created - стандартный статус для успешного создания
 def register_user(
     user: UserCreate, # Pydantic модель для валидации входных данных запроса
     db: DbDependency, # Зависимость для получения сессии БД
-    background_tasks: BackgroundTasks # Зависимость для выполнения задач в фоновом режиме (например, отправки письма)
+    background_tasks: BackgroundTasks, # Зависимость для выполнения задач в фоновом режиме (например, отправки письма)
+    request: Request # Нужен для определения IP клиента (ограничение частоты запросов)
 ):
     """
     Регистрация нового пользователя (Пациента, Врача или Администратора).
     Пользователь будет создан как неактивный и получит ссылку для подтверждения email.
     """
-    # Проверяем, существует ли пользователь с таким email в базе данных
-    db_user = db.query(User).filter(User.email == user.email).first()
-    if db_user:
-        # Если пользователь с таким email уже зарегистрирован, возвращаем ошибку 400 Bad Request
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered")
+    # Проверяем лимиты по IP и email до хеширования пароля и отправки письма
+    enforce_auth_rate_limit(request, "register", email=user.email)
 
     # Хешируем пароль перед сохранением в базе данных. НИКОГДА не храните пароли в открытом виде!
     hashed_password = get_password_hash(user.password)
@@ -229,42 +322,47 @@ def register_user(
     # Сохраняем метку времени создания токена (для проверки срока действия)
     token_created_at = datetime.utcnow()
 
-    # Создаем новый объект пользователя SQLAlchemy на основе данных из запроса и сгенерированных полей
-    new_user = User(
-        email=user.email,
-        hashed_password=hashed_password,
-        is_active=False, # <--- Новый пользователь создается как НЕАКТИВНЫЙ
-        role=user.role,
-        email_verification_token=verification_token, # Сохраняем токен подтверждения в БД
-        email_verification_token_created_at=token_created_at # Сохраняем время создания токена в БД
-    )
-
-    # Добавляем нового пользователя в сессию базы данных и сохраняем изменения (commit)
-    db.add(new_user)
-    db.commit()
-    # Обновляем объект new_user, чтобы получить сгенерированный базой данных id и другие актуальные поля
-    db.refresh(new_user)
+    # Вставляем пользователя одним INSERT без предварительного SELECT:
+    # занятый email отсекает уникальный индекс users.email, id берется из ответа на INSERT (lastrowid).
+    try:
+        result = db.execute(insert(User).values(
+            email=user.email,
+            hashed_password=hashed_password,
+            is_active=False, # <--- Новый пользователь создается как НЕАКТИВНЫЙ
+            role=user.role,
+            email_verification_token=verification_token, # Сохраняем токен подтверждения в БД
+            email_verification_token_created_at=token_created_at # Сохраняем время создания токена в БД
+        ))
+        db.commit()
+    except IntegrityError:
+        # Если пользователь с таким email уже зарегистрирован, возвращаем ошибку 400 Bad Request
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered")
+    new_user = {"id": result.inserted_primary_key[0], "email": user.email, "is_active": False, "role": user.role}
 
     # Отправляем письмо с подтверждением email в фоновом режиме.
     # BackgroundTasks позволяют выполнить функцию асинхронно, не блокируя ответ на запрос регистрации.
-    background_tasks.add_task(send_verification_email, new_user.email, verification_token)
+    background_tasks.add_task(send_verification_email, user.email, verification_token)
 
-    # Возвращаем ответ с данными созданного пользователя.
-    # Pydantic UserResponse с from_attributes=True автоматически преобразует объект SQLAlchemy в Pydantic модель.
+    # Возвращаем ответ с данными созданного пользователя (все поля известны, повторно читать строку из БД не нужно).
     return new_user
 
 
 # Эндпоинт для авторизации (получения JWT токена). Не требует авторизации, но проверяет учетные данные.
 # Используем стандартную форму OAuth2 Password Request Form (email/password).
-@app.post("/token", response_model=Token) # response_model=Token указывает, что в ответ ожидается Pydantic модель Token
+@app.post("/token", response_model=Token, dependencies=[Depends(shed_load_if_saturated)]) # response_model=Token указывает, что в ответ ожидается Pydantic модель Token
 def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()], # Зависимость для получения стандартной формы email/password
-    db: DbDependency # Зависимость для получения сессии БД
+    db: DbDependency, # Зависимость для получения сессии БД
+    request: Request # Нужен для определения IP клиента (ограничение частоты запросов)
 ):
     """
     Авторизация пользователя по email и паролю и получение JWT токена доступа.
     Доступ разрешен только для АКТИВНЫХ пользователей.
     """
+    # Проверяем лимиты по IP и email до проверки пароля (bcrypt)
+    enforce_auth_rate_limit(request, "token", email=form_data.username)
+
     # Ищем пользователя в базе данных по email (который в OAuth2PasswordRequestForm приходит как username)
     user = db.query(User).filter(User.email == form_data.username).first()
 
@@ -297,9 +395,50 @@ def login_for_access_token(
         data={"sub": user.email, "role": user.role},
         expires_delta=access_token_expires
     )
+    # Refresh-токен позволяет продлевать сессию через /token/refresh без повторной проверки пароля (bcrypt).
+    refresh_token = issue_refresh_token(db, user.id)
+
+    # Возвращаем ответ с токеном доступа, его типом и refresh-токеном.
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+
+# Эндпоинт обновления токена доступа по refresh-токену. Пароль не нужен.
+@app.post("/token/refresh", response_model=Token)
+def refresh_access_token(data: RefreshTokenRequest, db: DbDependency):
+    """
+    Выдает новый access-токен и новый refresh-токен в обмен на действующий refresh-токен.
+    Каждый refresh-токен одноразовый: повторное использование отзывает всю цепочку токенов этого входа.
+    """
+    try:
+        user, refresh_token = rotate_refresh_token(db, data.refresh_token)
+    except RefreshTokenError as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=str(e),
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    access_token = create_access_token(
+        data={"sub": user.email, "role": user.role},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
 
-    # Возвращаем ответ с токеном доступа и его типом.
-    return {"access_token": access_token, "token_type": "bearer"}
+# Выход: отзыв refresh-токена (и всех токенов, полученных из него ротацией)
+@app.post("/token/revoke", status_code=status.HTTP_204_NO_CONTENT)
+def revoke_token(data: RefreshTokenRequest, db: DbDependency):
+    """Отзывает refresh-токен. Ответ одинаковый, даже если токен не найден."""
+    revoke_refresh_token(db, data.refresh_token)
+
+
+# Открытые ключи подписи токенов (JWK Set). Другие сервисы проверяют наши JWT по kid без обращения к этому API.
+@app.get("/.well-known/jwks.json")
+def get_jwks():
+    """
+    Возвращает открытые ключи ES256, которыми подписаны действующие токены.
+    Пустой список означает, что токены подписываются HS256 и проверить их может только этот сервер.
+    """
+    return JSONResponse(keyring.jwks(), headers={"Cache-Control": "public, max-age=300"})
 
 
 # Эндпоинт для получения информации о текущем авторизованном пользователе. Требует авторизации.
@@ -315,47 +454,81 @@ def read_users_me(current_user: CurrentUser):
     return current_user
 
 
+# Стартовые данные сессии одним запросом: пользователь, его профиль и справочники. Требует авторизации.
+@app.get("/users/me/bootstrap", response_model=SessionBootstrapResponse)
+def read_session_bootstrap(
+    current_user: Annotated[User, Depends(get_current_user_with_profile)],
+    reference_version: Optional[str] = Query(None, description="Версия справочников, уже сохраненная у клиента")
+):
+    """
+    Заменяет три запроса при загрузке страницы (/users/me, /users/me/profile, /api/districts) одним.
+    Пользователь и профиль загружаются одним запросом с JOIN.
+    Если клиент передал актуальную reference_version, справочники не передаются повторно (reference = null).
+    """
+    profile = None
+    if current_user.role == "patient" and current_user.patient_profile is not None:
+        profile = PatientProfileResponse.model_validate(current_user.patient_profile)
+    elif current_user.role == "doctor" and current_user.doctor_profile is not None:
+        profile = DoctorProfileResponse.model_validate(current_user.doctor_profile)
+    return {
+        "user": current_user,
+        "profile": profile,
+        "reference": None if reference_version == reference_catalog.snapshot().version else get_reference_data(),
+    }
+
+
+# Поток событий текущего пользователя (Server-Sent Events). Требует авторизации.
+@app.get("/users/me/events")
+async def stream_my_events(current_user: CurrentUser):
+    """
+    Открывает поток text/event-stream с событиями текущего пользователя:
+    подтверждение email, изменение профиля, смена роли, верификация врача.
+    Заменяет периодический опрос /users/me на фронтенде.
+    """
+    return StreamingResponse(
+        stream_user_events(current_user.id),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache", # События не кэшируются
+            "X-Accel-Buffering": "no", # Отключаем буферизацию ответа в nginx
+        },
+    )
+
+
 # --- НОВЫЙ ЭНДПОИНТ ДЛЯ ПОДТВЕРЖДЕНИЯ EMAIL ---
 # Доступен по ссылке из письма, не требует авторизации.
-@app.get("/verify-email")
-def verify_email(token: str, db: DbDependency): # Принимает токен как параметр запроса (?token=...)
+@app.get("/verify-email", dependencies=[Depends(shed_load_if_saturated)])
+def verify_email(token: str, db: DbDependency, request: Request): # Принимает токен как параметр запроса (?token=...)
     """
     Подтверждение email по токену из письма.
     Активирует пользователя, если токен валиден и не просрочен.
     """
-    # Настройки времени жизни токена подтверждения email (например, 24 часа)
-    # TODO: Вынести это в настройки или переменные окружения
-    VERIFICATION_TOKEN_EXPIRE_HOURS = 24
-
-    # Ищем пользователя в базе данных по предоставленному токену подтверждения email
-    user = db.query(User).filter(User.email_verification_token == token).first()
-
-    if user is None:
-        # Если токен не найден в базе данных, он недействителен.
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, # 400 Bad Request - некорректный запрос/токен
-            detail="Invalid verification token"
-        )
+    # Ограничиваем перебор токенов с одного IP
+    enforce_auth_rate_limit(request, "verify-email")
+
+    # Активируем пользователя одним условным UPDATE: токен должен существовать и быть не старше срока жизни.
+    # Токен очищается в том же запросе, поэтому ссылка одноразовая.
+    cutoff = datetime.utcnow() - timedelta(hours=EMAIL_VERIFICATION_TOKEN_EXPIRE_HOURS)
+    user_id = update_returning_id(
+        db,
+        update(User)
+        .where(User.email_verification_token == token)
+        .where(User.email_verification_token_created_at >= cutoff)
+        .values(is_active=True, email_verification_token=None, email_verification_token_created_at=None),
+        User,
+    )
+    db.commit()
 
-    # Проверяем, не истек ли срок действия токена.
-    # Сравниваем текущее время (UTC) с временем создания токена.
-    token_lifetime = datetime.utcnow() - user.email_verification_token_created_at
-    if token_lifetime > timedelta(hours=VERIFICATION_TOKEN_EXPIRE_HOURS):
-        # Если разница во времени превышает установленный срок жизни токена.
+    if user_id is None:
+        # Разбираем причину отказа только на редком пути ошибки: токена нет или он просрочен
+        expired = db.query(User.id).filter(User.email_verification_token == token).first() is not None
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, # 400 Bad Request - просроченный токен
-            detail="Verification token expired"
+            status_code=status.HTTP_400_BAD_REQUEST, # 400 Bad Request - некорректный или просроченный токен
+            detail="Verification token expired" if expired else "Invalid verification token"
         )
 
-    # Если токен найден, не просрочен и связан с существующим пользователем, активируем пользователя.
-    user.is_active = True
-    # Очищаем поля токена после использования для безопасности (токен становится одноразовым).
-    user.email_verification_token = None
-    user.email_verification_token_created_at = None
-
-    # Сохраняем изменения в базе данных
-    db.commit()
-    db.refresh(user) # Обновляем объект пользователя, чтобы убедиться, что изменения сохранены
+    # Сообщаем открытым вкладкам пользователя, что аккаунт активирован (вместо опроса /users/me)
+    publish_user_event(user_id, EVENT_EMAIL_VERIFIED, {"is_active": True})
 
     # Возвращаем сообщение об успешном подтверждении.
     # В реальном приложении фронтенд может перенаправить пользователя на страницу логина после этого запроса.
@@ -377,29 +550,45 @@ def create_patient_profile(
     Создать или обновить профиль Пациента для текущего авторизованного пользователя.
     Доступно только для пользователей с ролью 'patient'.
     """
-    # Проверяем, существует ли профиль пациента для текущего пользователя (по user_id, связанному с current_user.id)
-    db_profile = db.query(PatientProfile).filter(PatientProfile.user_id == current_user.id).first()
-
-    if db_profile:
-        # Если профиль уже есть, обновляем его поля на основе данных из запроса.
-        # profile_data.model_dump(exclude_unset=True) создает словарь из Pydantic модели,
-        # исключая поля, которые не были явно указаны в запросе (None поля включаются, если они указаны).
-        for key, value in profile_data.model_dump(exclude_unset=True).items():
-            # Обновляем атрибуты объекта SQLAlchemy db_profile
-            setattr(db_profile, key, value)
-        db.commit() # Сохраняем изменения в БД
-        db.refresh(db_profile) # Обновляем объект из БД
-        return db_profile # Возвращаем обновленный профиль
-    else:
-        # Если профиля нет, создаем новый объект PatientProfile
-        new_profile = PatientProfile(
-            user_id=current_user.id, # Связываем профиль с текущим пользователем
-            **profile_data.model_dump() # Распаковываем данные из Pydantic модели PatientProfileCreateUpdate в аргументы конструктора PatientProfile
-        )
-        db.add(new_profile) # Добавляем новый профиль в сессию
-        db.commit() # Сохраняем в БД
-        db.refresh(new_profile) # Обновляем объект
-        return new_profile # Возвращаем созданный профиль
+    # Создаем или обновляем профиль одним INSERT ... ON DUPLICATE KEY UPDATE (ON CONFLICT в SQLite),
+    # опираясь на уникальность patient_profiles.user_id.
+    # При обновлении меняются только поля, явно указанные в запросе (exclude_unset=True).
+    profile = upsert_returning(
+        db, PatientProfile, "user_id",
+        insert_values={"user_id": current_user.id, **profile_data.model_dump()},
+        update_values=profile_data.model_dump(exclude_unset=True),
+    )
+    db.commit()
+    # profile.user_id вместо current_user.id: после commit обращение к current_user перечитало бы его из БД
+    publish_user_event(profile.user_id, EVENT_PROFILE_UPDATED, {"role": "patient", "profile_id": profile.id})
+    return profile
+
+
+def doctor_location_values(
+    practice_areas: Optional[str], latitude: Optional[float], longitude: Optional[float],
+    location_set: bool, practice_areas_set: bool,
+) -> Tuple[dict, dict]:
+    """
+    Колонки места практики врача: (значения для нового профиля, значения для обновления существующего).
+    Место практики - явные координаты или центр района практики; geohash пересчитывается вместе с ними.
+    location_set - координаты переданы в запросе (в том числе явным null), practice_areas_set - передан practice_areas.
+    """
+    explicit = latitude is not None
+    coordinates = (latitude, longitude)
+    if not explicit:
+        coordinates = district_centroid(practice_areas) or coordinates
+    insert_values = {**location_values(*coordinates), "location_explicit": explicit}
+    if explicit or location_set:
+        # Явные координаты или явный null: врач убирает свое место практики (центр района - только из practice_areas запроса)
+        return insert_values, dict(insert_values)
+    if practice_areas_set:
+        # Район сменился: координаты прежнего района заменяются центром нового, а если у него нет центра -
+        # сбрасываются (иначе врач находился бы поиском near в старом районе). Явные координаты врача не трогаем
+        return insert_values, {
+            column: case((DoctorProfile.location_explicit, getattr(DoctorProfile, column)), else_=value)
+            for column, value in location_values(*coordinates).items()
+        }
+    return insert_values, {}
 
 
 # Эндпоинт для создания или обновления профиля Врача. Требует авторизации и роли 'doctor'.
@@ -413,23 +602,33 @@ def create_doctor_profile(
     Создать или обновить профиль Врача для текущего авторизованного пользователя.
     Доступно только для пользователей с ролью 'doctor'.
     """
-    # Проверяем, существует ли профиль врача для текущего пользователя
-    db_profile = db.query(DoctorProfile).filter(DoctorProfile.user_id == current_user.id).first()
-
-    if db_profile:
-        # Если профиль уже есть, обновляем его
-        for key, value in profile_data.model_dump(exclude_unset=True).items():
-            setattr(db_profile, key, value)
-        db.commit()
-        db.refresh(db_profile)
-        return db_profile
-    else:
-        # Если профиля нет, создаем новый
-        new_profile = DoctorProfile(user_id=current_user.id, **profile_data.model_dump())
-        db.add(new_profile)
-        db.commit()
-        db.refresh(new_profile)
-        return new_profile
+    # Рабочие часы приходят как расписание, а хранятся как битовые маски - пересчитываем их для записи
+    insert_values = profile_data.model_dump()
+    insert_values.update(encode_week(insert_values.pop("working_hours")))
+    update_values = profile_data.model_dump(exclude_unset=True)
+    if "working_hours" in update_values:
+        update_values.update(encode_week(update_values.pop("working_hours")))
+
+    location_insert, location_update = doctor_location_values(
+        profile_data.practice_areas, profile_data.latitude, profile_data.longitude,
+        location_set="latitude" in update_values, practice_areas_set="practice_areas" in update_values,
+    )
+    insert_values.update(location_insert)
+    update_values.update(location_update)
+
+    # Создаем или обновляем профиль одним запросом, опираясь на уникальность doctor_profiles.user_id
+    profile = upsert_returning(
+        db, DoctorProfile, "user_id",
+        insert_values={"user_id": current_user.id, **insert_values},
+        update_values=update_values,
+    )
+    record_doctor_change(db, profile.id)
+    db.commit()
+    if doctor_catalog is not None:
+        doctor_catalog.mark_stale()
+    doctor_suggestions.update_doctor(profile.id, profile.full_name, profile.specialization)
+    publish_user_event(profile.user_id, EVENT_PROFILE_UPDATED, {"role": "doctor", "profile_id": profile.id})
+    return {**profile._mapping, "working_hours": decode_week(profile)}
 
 
 # Эндпоинт для получения профиля текущего авторизованного пользователя (Пациента или Врача). Требует авторизации.
@@ -460,13 +659,33 @@ def read_my_profile(db: DbDependency, current_user: CurrentUser): # Требуе
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User role does not have a profile type")
 
 
+# Параметр ?fields= эндпоинтов чтения врачей
+FieldsQuery = Annotated[Optional[str], Query(
+    description="Поля ответа через запятую, например full_name,specialization,cost_per_consultation (id возвращается всегда)"
+)]
+
+
+def requested_fields(fields: Optional[str], model) -> Optional[tuple]:
+    """Проверенный список полей из ?fields= (None - все поля). Неизвестное поле - 400."""
+    try:
+        return parse_fields(fields, model)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+def sparse_dump(model, fields: tuple, data) -> dict:
+    """Данные ответа только с запрошенными полями (по модели, созданной для этого набора полей)."""
+    return sparse_model(model, fields).model_validate(data).model_dump(mode="json")
+
+
 # Эндпоинт для получения публичного профиля Врача по ID пользователя Врача. Пока не требует авторизации.
 @app.get("/doctors/{user_id}/profile", response_model=DoctorProfileResponse)
-def read_doctor_profile_by_user_id(user_id: int, db: DbDependency): # Не требует авторизации (пока)
+def read_doctor_profile_by_user_id(user_id: int, db: DbDependency, fields: FieldsQuery = None): # Не требует авторизации (пока)
     """
     Получить публичный профиль Врача по ID пользователя Врача.
-    Доступно без авторизации (пока).
+    Доступно без авторизации (пока). С ?fields= возвращаются (и читаются из БД) только перечисленные поля.
     """
+    selected = requested_fields(fields, DoctorProfileResponse)
     # Ищем пользователя по предоставленному ID
     user = db.query(User).filter(User.id == user_id).first()
     if user is None:
@@ -479,10 +698,12 @@ def read_doctor_profile_by_user_id(user_id: int, db: DbDependency): # Не тр
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User is not a doctor or their profile is not public")
 
     # Ищем профиль Врача, связанный с этим пользователем.
-    profile = db.query(DoctorProfile).filter(DoctorProfile.user_id == user.id).first()
+    profile = db.query(DoctorProfile).options(*doctor_load_options(selected)).filter(DoctorProfile.user_id == user.id).first()
     if profile is None:
         # Если профиль врача не найден (хотя пользователь есть и роль 'doctor')
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Doctor profile not found for this user")
+    if selected is not None:
+        return JSONResponse(sparse_dump(DoctorProfileResponse, selected, profile))
 
     # Возвращаем объект SQLAlchemy профиля врача. FastAPI/Pydantic преобразует его в DoctorProfileResponse.
     return profile
@@ -499,28 +720,69 @@ async def get_doctors(
     practice_area: Optional[str] = Query(None, description="Фильтр по району практики"),
     min_price: Optional[int] = Query(None, description="Минимальная стоимость"),
     max_price: Optional[int] = Query(None, description="Максимальная стоимость"),
+    open_now: Optional[bool] = Query(None, description="Только врачи, работающие сейчас"),
+    open_on: Optional[str] = Query(None, description="Только врачи, работающие в день недели (mon..sun) или дату (YYYY-MM-DD)"),
+    near: Optional[str] = Query(None, description="Точка lat,lon: врачи в радиусе radius, от ближнего к дальнему"),
+    radius: float = Query(5.0, gt=0, le=MAX_RADIUS_KM, description="Радиус поиска рядом с near, км"),
+    sort: Optional[str] = Query(None, description="Сортировка: price, -price, name, newest (по умолчанию - по id или по расстоянию при near)"),
     page: int = Query(1, description="Номер страницы (начиная с 1)"),
     size: int = Query(10, description="Размер страницы (количество элементов)")
 ):
     """
-    Получение списка всех врачей с возможностью фильтрации по специализации, району практики и диапазону цен.
+    Получение списка всех врачей с возможностью фильтрации по специализации, району практики, диапазону цен
+    и рабочему времени (open_now, open_on).
+    С параметром near возвращаются только врачи в радиусе radius км, отсортированные по расстоянию (distance_km).
+    Параметр sort задает порядок (price, -price, name, newest); без него порядок - по id.
     Поддерживает пагинацию для большого количества результатов.
     """
-    # Создаем базовый запрос на получение всех врачей
-    query = db.query(DoctorProfile)
-    
-    # Применяем фильтры, если они указаны
-    if specialization:
-        query = query.filter(DoctorProfile.specialization.ilike(f"%{specialization}%"))
-    if practice_area:
-        query = query.filter(DoctorProfile.practice_areas.ilike(f"%{practice_area}%"))
-    if min_price is not None:
-        query = query.filter(DoctorProfile.cost_per_consultation >= min_price)
-    if max_price is not None:
-        query = query.filter(DoctorProfile.cost_per_consultation <= max_price)
+    if sort is not None and sort not in DOCTOR_SORTS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"sort must be one of: {', '.join(DOCTOR_SORTS)}")
+
+    # Колоночный каталог отвечает на фильтры по специализации, району и цене без SQL;
+    # поиск рядом и фильтры по рабочему времени выполняются запросом к БД
+    if doctor_catalog is not None and not (near or open_now or open_on):
+        try:
+            doctor_ids = doctor_catalog.search(specialization, practice_area, min_price, max_price, sort)
+        except UnsupportedQuery:
+            doctor_ids = None
+        if doctor_ids is not None:
+            total = len(doctor_ids)
+            pages = ceil(total / size) if total > 0 else 0
+            if page < 1:
+                page = 1
+            elif page > pages and pages > 0:
+                page = pages
+            page_ids = doctor_ids[(page - 1) * size:page * size]
+            # Страница читается по первичному ключу и возвращается в порядке каталога
+            doctors = {doctor.id: doctor for doctor in db.query(DoctorProfile).filter(DoctorProfile.id.in_(page_ids)).all()} if page_ids else {}
+            return {
+                "items": [doctors[doctor_id] for doctor_id in page_ids if doctor_id in doctors],
+                "total": total,
+                "page": page,
+                "size": size,
+                "pages": pages
+            }
+
+    # Фильтры по рабочему времени и координаты точки проверяются до построения запроса
+    weekday = None
+    if open_on:
+        try:
+            weekday = parse_weekday(open_on)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="open_on must be mon..sun or a date in YYYY-MM-DD format")
+    point = None
+    if near:
+        try:
+            point = parse_point(near)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="near must be lat,lon")
+    query = build_doctor_query(
+        db, specialization=specialization, practice_area=practice_area, min_price=min_price, max_price=max_price,
+        open_on=weekday, open_now=bool(open_now), point=point, radius=radius, sort=sort,
+    )
     
     # Считаем общее количество записей после применения фильтров
-    total = query.count()
+    total = count_doctors(query)
     
     # Добавляем пагинацию
     pages = ceil(total / size) if total > 0 else 0
@@ -534,6 +796,11 @@ async def get_doctors(
     # Применяем пагинацию
     offset = (page - 1) * size
     doctors = query.offset(offset).limit(size).all()
+    if point is not None:
+        doctors = [
+            {**DoctorBrief.model_validate(doctor).model_dump(), "distance_km": round(haversine_km(*point, doctor.latitude, doctor.longitude), 3)}
+            for doctor in doctors
+        ]
     
     # Формируем ответ
     return {
@@ -544,34 +811,501 @@ async def get_doctors(
         "pages": pages
     }
 
+# Максимум ID в одном пакетном запросе: GET (ID в строке запроса) и POST (ID в теле)
+DOCTOR_BATCH_MAX_IDS_GET = 200
+DOCTOR_BATCH_MAX_IDS_POST = 500
+
+
+def doctor_public_fields(doctor: DoctorProfile) -> dict:
+    """Публичные поля профиля врача в виде JSON-совместимого словаря (для снимка каталога)."""
+    return DoctorProfileResponse.model_validate(doctor).model_dump(mode="json")
+
+
+def doctor_to_detail(doctor: Union[DoctorProfile, dict], fields: Optional[tuple] = None) -> dict:
+    """
+    Формирует данные для DoctorDetail из профиля врача (объекта модели или словаря из снимка каталога).
+    Используется и для одного врача, и для пакетной выдачи, чтобы ответы совпадали.
+    fields - запрошенные поля (?fields=): если профиль загружен не полностью, вычисляются только они.
+    """
+    if isinstance(doctor, dict):
+        doctor_detail = dict(doctor)
+    else:
+        # Создаем объект с расширенной информацией
+        doctor_detail = doctor.__dict__.copy()
+        # Рабочие часы - вычисляемое свойство, в __dict__ его нет
+        if fields is None or "working_hours" in fields:
+            doctor_detail["working_hours"] = doctor.working_hours
+    
+    # Добавляем заглушки для рейтинга и количества отзывов
+    # В реальном приложении эти данные будут получены из соответствующих таблиц
+    doctor_detail["rating"] = 4.5  # Заглушка, в будущем будет рассчитываться из таблицы отзывов
+    doctor_detail["reviews_count"] = 10  # Заглушка, в будущем будет считаться из таблицы отзывов
+    
+    return doctor_detail
+
+
+def load_doctors_batch(db: Session, ids: List[int], fields: Optional[tuple] = None):
+    """
+    Загружает врачей одним запросом WHERE id IN (...) и возвращает их в порядке запроса.
+    Повторяющиеся ID учитываются один раз, отсутствующие перечисляются в missing.
+    С fields из БД читаются только нужные колонки, а ответ содержит только эти поля.
+    """
+    ids = list(dict.fromkeys(ids))  # Убираем дубликаты, сохраняя порядок
+    doctors = {}
+    if catalog_snapshot is not None:
+        # Сначала снимок каталога (без запроса к БД), в БД ищем только тех, кого в снимке нет
+        for doctor_id in ids:
+            data = catalog_snapshot.get(doctor_id)
+            if data is not None:
+                doctors[doctor_id] = data
+    remaining = [doctor_id for doctor_id in ids if doctor_id not in doctors]
+    if remaining:
+        doctors.update({
+            doctor.id: doctor
+            for doctor in db.query(DoctorProfile).options(*doctor_load_options(fields)).filter(DoctorProfile.id.in_(remaining)).all()
+        })
+    items = [doctor_to_detail(doctors[doctor_id], fields) for doctor_id in ids if doctor_id in doctors]
+    missing = [doctor_id for doctor_id in ids if doctor_id not in doctors]
+    if fields is not None:
+        return JSONResponse({"items": [sparse_dump(DoctorDetail, fields, item) for item in items], "missing": missing})
+    return {"items": items, "missing": missing}
+
+
+# Подсказки для строки поиска врачей. Объявлен до /api/doctors/{doctor_id}, иначе "suggest" будет принят за doctor_id.
+@app.get("/api/doctors/suggest", response_model=List[DoctorSuggestion], tags=["doctors"])
+def suggest_doctors(
+    current_user: CurrentUser,
+    prefix: str = Query(..., min_length=1, max_length=100, description="Начало ФИО врача или специализации"),
+    limit: int = Query(10, ge=1, le=SUGGEST_MAX_LIMIT, description="Максимум подсказок")
+):
+    """
+    Подсказки при вводе: специализации и ФИО врачей, начинающиеся с prefix (без учета регистра, ё = е).
+    Для ФИО совпадение ищется с начала любого слова. Отвечает из индекса в памяти, без запросов к БД.
+    """
+    return doctor_suggestions.suggest(prefix, limit)
+
+
+# Пакетное получение врачей по списку ID (например, избранные или недавно просмотренные).
+# Объявлен до /api/doctors/{doctor_id}, иначе "batch" будет принят за doctor_id.
+@app.get("/api/doctors/batch", response_model=DoctorBatchResponse, tags=["doctors"])
+def get_doctors_batch(
+    db: DbDependency,
+    current_user: CurrentUser,
+    ids: str = Query(..., description="ID врачей через запятую, например 3,1,2"),
+    fields: FieldsQuery = None,
+):
+    """
+    Получение детальной информации о нескольких врачах одним запросом.
+    Порядок ответа совпадает с порядком ID в запросе; ненайденные ID возвращаются в missing.
+    """
+    try:
+        doctor_ids = [int(value) for value in ids.split(",") if value.strip()]
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ids must be a comma-separated list of integers")
+    if len(doctor_ids) > DOCTOR_BATCH_MAX_IDS_GET:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Too many ids (max {DOCTOR_BATCH_MAX_IDS_GET}), use POST /api/doctors/batch for longer lists"
+        )
+    return load_doctors_batch(db, doctor_ids, requested_fields(fields, DoctorDetail))
+
+
+# То же для длинных списков: ID передаются в теле запроса
+@app.post("/api/doctors/batch", response_model=DoctorBatchResponse, tags=["doctors"])
+def post_doctors_batch(
+    data: DoctorBatchRequest,
+    db: DbDependency,
+    current_user: CurrentUser,
+    fields: FieldsQuery = None,
+):
+    """
+    Получение детальной информации о нескольких врачах (ID в теле запроса).
+    """
+    if len(data.ids) > DOCTOR_BATCH_MAX_IDS_POST:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Too many ids (max {DOCTOR_BATCH_MAX_IDS_POST})")
+    return load_doctors_batch(db, data.ids, requested_fields(fields, DoctorDetail))
+
+
+# Лента изменений каталога врачей для внешних потребителей (индексатор, зеркала, аналитика).
+# Объявлен до /api/doctors/{doctor_id}, иначе "changes" будет принят за doctor_id.
+@app.get("/api/doctors/changes", response_model=DoctorChangesResponse, tags=["doctors"])
+def get_doctor_changes(
+    db: DbDependency,
+    current_user: CurrentUser,
+    since: Optional[int] = Query(None, ge=0, description="next_since из предыдущего ответа; без него - текущая позиция ленты"),
+    limit: int = Query(500, ge=1, le=DOCTOR_CHANGES_MAX_LIMIT, description="Максимум изменений за запрос"),
+):
+    """
+    Изменения врачей после позиции since по возрастанию seq: upsert с краткими данными или delete.
+    Без since возвращает пустой список и текущую позицию - с нее продолжают после полной загрузки каталога.
+    Изменения последних секунд могут прийти повторно в следующем ответе; применять их нужно идемпотентно.
+    410 - since старше срока хранения журнала: нужно заново загрузить каталог и начать без since.
+    """
+    if since is None:
+        return {"changes": [], "next_since": current_position(db), "has_more": False}
+    try:
+        return read_doctor_changes(db, since, limit)
+    except ChangeFeedExpired:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="Change feed position has expired, reload the catalog and restart without since"
+        )
+
+
 # Получение детальной информации о враче по ID
 @app.get("/api/doctors/{doctor_id}", response_model=DoctorDetail, tags=["doctors"])
 async def get_doctor_by_id(
     doctor_id: int,
     db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user)  # Опционально для публичного доступа
+    current_user: Optional[User] = Depends(get_current_user),  # Опционально для публичного доступа
+    fields: FieldsQuery = None,
 ):
     """
     Получение детальной информации о враче по ID.
     Доступно как для авторизованных, так и для неавторизованных пользователей.
+    С ?fields= возвращаются (и читаются из БД) только перечисленные поля.
     """
-    doctor = db.query(DoctorProfile).filter(DoctorProfile.id == doctor_id).first()
+    selected = requested_fields(fields, DoctorDetail)
+    # Профиль из общего снимка каталога (если включен) - без запроса к БД
+    doctor = catalog_snapshot.get(doctor_id) if catalog_snapshot is not None else None
+    if doctor is None:
+        doctor = db.query(DoctorProfile).options(*doctor_load_options(selected)).filter(DoctorProfile.id == doctor_id).first()
     
     if not doctor:
         raise HTTPException(status_code=404, detail="Врач не найден")
     
-    # Создаем объект с расширенной информацией
-    doctor_detail = doctor.__dict__.copy()
-    
-    # Добавляем заглушки для рейтинга и количества отзывов
-    # В реальном приложении эти данные будут получены из соответствующих таблиц
-    doctor_detail["rating"] = 4.5  # Заглушка, в будущем будет рассчитываться из таблицы отзывов
-    doctor_detail["reviews_count"] = 10  # Заглушка, в будущем будет считаться из таблицы отзывов
-    
-    return doctor_detail
+    if selected is not None:
+        return JSONResponse(sparse_dump(DoctorDetail, selected, doctor_to_detail(doctor, selected)))
+    return doctor_to_detail(doctor)
+
+
+# --- Эндпоинты для консультаций и истории сообщений ---
+
+def get_consultation_for_participant(db: Session, consultation_id: int, user: User) -> Consultation:
+    """Загружает консультацию и проверяет, что пользователь - ее пациент или врач."""
+    consultation = db.query(Consultation).filter(Consultation.id == consultation_id).first()
+    if consultation is None or user.id not in (consultation.patient_id, consultation.doctor_id):
+        # Не раскрываем, существует ли чужая консультация
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Consultation not found")
+    return consultation
+
+
+# Создание консультации пациентом. Требует роли 'patient'.
+@app.post("/api/consultations", response_model=ConsultationResponse, status_code=status.HTTP_201_CREATED, tags=["consultations"])
+def create_consultation(
+    data: ConsultationCreate,
+    db: DbDependency,
+    current_user: Annotated[User, Depends(require_role("patient"))]
+):
+    """
+    Создать консультацию с врачом. doctor_id - ID профиля врача из каталога.
+    """
+    doctor = db.query(DoctorProfile).filter(DoctorProfile.id == data.doctor_id).first()
+    if doctor is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Врач не найден")
+    consultation = Consultation(patient_id=current_user.id, doctor_id=doctor.user_id)
+    db.add(consultation)
+    db.commit()
+    db.refresh(consultation)
+    return consultation
+
+
+# Отправка сообщения в чат консультации. Доступно пациенту и врачу консультации.
+@app.post("/api/consultations/{consultation_id}/messages", response_model=MessageAccepted, status_code=status.HTTP_201_CREATED, tags=["consultations"])
+def post_message(
+    consultation_id: int,
+    message: MessageCreate,
+    response: Response,
+    db: DbDependency,
+    current_user: CurrentUser
+):
+    """
+    Добавить сообщение в консультацию. Сообщения записываются небольшими пачками
+    (многострочный INSERT), ответ возвращается после того, как пачка сохранена.
+    Повтор с тем же client_message_id не создает второе сообщение. Если пачка не записана
+    за MESSAGE_WRITE_TIMEOUT_SECONDS, ответ - 202 с ключом: сообщение еще может быть сохранено,
+    и повторять его нужно с тем же client_message_id.
+    """
+    get_consultation_for_participant(db, consultation_id, current_user)
+    # Завершаем транзакцию чтения, чтобы не держать соединение из пула, пока ждем записи пачки
+    db.rollback()
+    client_message_id = str(message.client_message_id or uuid.uuid4())
+    accepted_at = datetime.utcnow()
+    try:
+        created_at = message_buffer.append(consultation_id, current_user.id, message.content, client_message_id)
+    except TimeoutError:
+        response.status_code = status.HTTP_202_ACCEPTED
+        created_at = accepted_at
+    except Exception:
+        # Пачка не записана (транзакция откатилась) - повтор с тем же ключом безопасен
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Message could not be saved, please retry")
+    return {"consultation_id": consultation_id, "client_message_id": client_message_id, "created_at": created_at}
+
+
+# История сообщений консультации с пагинацией назад по курсору.
+@app.get("/api/consultations/{consultation_id}/messages", response_model=MessageHistoryResponse, tags=["consultations"])
+def get_message_history(
+    consultation_id: int,
+    db: DbDependency,
+    current_user: CurrentUser,
+    before_id: Optional[int] = Query(None, description="Вернуть сообщения старше этого id (курсор next_before_id предыдущей страницы)"),
+    limit: int = Query(50, ge=1, le=200, description="Количество сообщений на странице")
+):
+    """
+    Получить страницу истории консультации: самые новые сообщения, затем - более старые по курсору before_id.
+    Сообщения из архива старых консультаций возвращаются так же, как и обычные.
+    """
+    get_consultation_for_participant(db, consultation_id, current_user)
+    items, next_before_id = fetch_history(db, consultation_id, before_id, limit)
+    return {"items": items, "next_before_id": next_before_id}
+
+
+# --- Эндпоинты для расписания врачей и бронирования ---
+
+# Публикация свободных слотов врачом. Требует роли 'doctor' и заполненного профиля.
+@app.post("/doctors/me/slots", response_model=List[SlotResponse], status_code=status.HTTP_201_CREATED, tags=["booking"])
+def create_doctor_slots(
+    data: SlotsCreate,
+    db: DbDependency,
+    current_user: Annotated[User, Depends(require_role("doctor"))]
+):
+    """
+    Добавить слоты в календарь текущего врача.
+    Слоты не должны пересекаться ни между собой, ни с уже существующими слотами врача.
+    """
+    # Блокируем строку профиля врача (а не таблицу слотов), чтобы два одновременных запроса
+    # одного врача не добавили пересекающиеся слоты
+    doctor = db.query(DoctorProfile).filter(DoctorProfile.user_id == current_user.id).with_for_update().first()
+    if doctor is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Doctor profile not found")
+
+    try:
+        intervals = validate_intervals([(slot.start_at, slot.end_at) for slot in data.slots])
+    except SlotConflictError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    for start, end in intervals:
+        if find_overlapping_slots(db, doctor.id, start, end):
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Slot {start.isoformat()} overlaps an existing slot")
+
+    slots = [DoctorSlot(doctor_id=doctor.id, start_at=start, end_at=end, version=0) for start, end in intervals]
+    db.add_all(slots)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Уникальный индекс (doctor_id, start_at) сработал на параллельной вставке
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Slot already exists")
+    for slot in slots:
+        db.refresh(slot)
+    return slots
+
+
+# Календарь врача. Не требует авторизации.
+@app.get("/api/doctors/{doctor_id}/slots", response_model=List[SlotResponse], tags=["booking"])
+def get_doctor_slots(
+    doctor_id: int,
+    db: DbDependency,
+    date_from: Optional[datetime] = Query(None, description="Начало периода (по умолчанию - сейчас)"),
+    date_to: Optional[datetime] = Query(None, description="Конец периода (по умолчанию - через 14 дней)"),
+    only_free: bool = Query(True, description="Только свободные слоты")
+):
+    """
+    Получить слоты врача (ID профиля) за период, отсортированные по времени начала.
+    """
+    start = to_naive_utc(date_from) if date_from else datetime.utcnow()
+    end = to_naive_utc(date_to) if date_to else start + timedelta(days=14)
+    query = (
+        db.query(DoctorSlot)
+        .filter(DoctorSlot.doctor_id == doctor_id)
+        .filter(DoctorSlot.start_at >= start)
+        .filter(DoctorSlot.start_at < end)
+    )
+    if only_free:
+        query = query.filter(DoctorSlot.patient_id.is_(None))
+    return query.order_by(DoctorSlot.start_at).limit(500).all()
+
+
+# Бронирование слота пациентом. Требует роли 'patient'.
+@app.post("/api/slots/{slot_id}/book", response_model=SlotResponse, tags=["booking"])
+def book_doctor_slot(
+    slot_id: int,
+    db: DbDependency,
+    current_user: Annotated[User, Depends(require_role("patient"))]
+):
+    """
+    Забронировать слот. Если слот уже занят (в том числе параллельным запросом), возвращается 409.
+    """
+    if not book_slot(db, slot_id, current_user.id):
+        slot = db.query(DoctorSlot).filter(DoctorSlot.id == slot_id).first()
+        if slot is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Slot not found")
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Slot is already booked or has already started")
+    return db.query(DoctorSlot).filter(DoctorSlot.id == slot_id).first()
+
+
+# Отмена брони пациентом. Требует роли 'patient'.
+@app.delete("/api/slots/{slot_id}/book", response_model=SlotResponse, tags=["booking"])
+def cancel_doctor_slot_booking(
+    slot_id: int,
+    db: DbDependency,
+    current_user: Annotated[User, Depends(require_role("patient"))],
+    version: Optional[int] = Query(None, description="Ожидаемая версия слота (оптимистическая блокировка)")
+):
+    """
+    Отменить свою бронь. Если передана version и слот с тех пор изменился, возвращается 409.
+    """
+    if not cancel_booking(db, slot_id, current_user.id, version):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Booking not found or slot was modified")
+    return db.query(DoctorSlot).filter(DoctorSlot.id == slot_id).first()
+
+
+# --- TODO: Добавить дополнительные эндпоинты (отзывы, платежи) ---
+
+
+# Метрики ограничителей частоты и нагрузки. Только для администратора.
+@app.get("/admin/metrics/rate-limits", tags=["admin"])
+async def get_rate_limit_metrics(current_user: Annotated[User, Depends(require_role("admin"))]):
+    """
+    Счетчики отклоненных (429/503) и поставленных в очередь запросов,
+    текущая загрузка очереди bcrypt и пула потоков.
+    """
+    return limiter_metrics()
+
+
+# Состояние фонового обслуживания. Только для администратора.
+@app.get("/admin/maintenance", tags=["admin"])
+def get_maintenance_status(current_user: Annotated[User, Depends(require_role("admin"))]):
+    """
+    Текущий лидер (воркер, выполняющий задачи) и метрики последнего запуска каждой задачи:
+    длительность, число обработанных строк, ошибка.
+    """
+    return maintenance_status()
+
+
+# Подписанный заголовок для профилирования конкретных запросов. Только для администратора.
+@app.post("/admin/profiling/token", tags=["admin"])
+def create_profiling_token(
+    current_user: Annotated[User, Depends(require_role("admin"))],
+    minutes: int = Query(15, ge=1, le=PROFILING_TOKEN_MAX_MINUTES),
+):
+    """
+    Выдает значение заголовка X-Profile-Request: запросы с ним профилируются, профили сохраняются
+    в PROFILING_DIR (файл по маршруту, формат collapsed stacks для flame graph).
+    """
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Profiling is disabled")
+    value, expires_at = create_profile_token(minutes)
+    return {"header": PROFILE_HEADER, "value": value, "expires_at": expires_at}
+
+
+# --- Очередь верификации врачей (администратор) ---
+
+# Максимальный размер страницы очереди
+VERIFICATION_QUEUE_MAX_LIMIT = 100
+
+
+@app.get("/admin/doctors/unverified", response_model=DoctorVerificationQueueResponse, tags=["admin"])
+def get_unverified_doctors(
+    db: DbDependency,
+    current_user: Annotated[User, Depends(require_role("admin"))],
+    after: Optional[int] = Query(None, ge=0, description="ID последнего врача предыдущей страницы (next_after)"),
+    limit: int = Query(50, ge=1, le=VERIFICATION_QUEUE_MAX_LIMIT),
+):
+    """
+    Непроверенные врачи в порядке id. Постраничный обход по курсору (id > after) идет по индексу
+    (is_verified, id) и не замедляется на дальних страницах, в отличие от OFFSET.
+    """
+    query = (
+        select(
+            DoctorProfile.id, DoctorProfile.user_id, DoctorProfile.full_name,
+            DoctorProfile.specialization, DoctorProfile.cost_per_consultation, DoctorProfile.is_verified,
+        )
+        .where(DoctorProfile.is_verified == false())
+        .order_by(DoctorProfile.id)
+        .limit(limit)
+    )
+    if after is not None:
+        query = query.where(DoctorProfile.id > after)
+    rows = db.execute(query).all()
+    return {
+        "items": [row._mapping for row in rows],
+        "next_after": rows[-1].id if len(rows) == limit else None,
+    }
+
 
+@app.post("/admin/doctors/verification", response_model=DoctorVerificationResult, tags=["admin"])
+def set_doctors_verification(
+    data: DoctorVerificationRequest,
+    db: DbDependency,
+    current_user: Annotated[User, Depends(require_role("admin"))],
+):
+    """
+    Массовая верификация (is_verified=true) или отклонение (is_verified=false) врачей.
+    Статус меняется одним UPDATE для всех врачей, профили в сессию не загружаются.
+    """
+    doctor_ids = sorted(set(data.doctor_ids))
+    # Блокируем строки, статус которых действительно меняется: по ним пишутся журнал изменений и события
+    changed = db.execute(
+        select(DoctorProfile.id, DoctorProfile.user_id)
+        .where(DoctorProfile.id.in_(doctor_ids))
+        .where(DoctorProfile.is_verified != data.is_verified)
+        .with_for_update()
+    ).all()
+    changed_ids = [row.id for row in changed]
+    if changed_ids:
+        db.execute(update(DoctorProfile).where(DoctorProfile.id.in_(changed_ids)).values(is_verified=data.is_verified))
+        # Журнал изменений обновляет колоночный каталог и снимок каталога в других воркерах
+        record_doctor_changes(db, changed_ids)
+        db.commit()
+        if doctor_catalog is not None:
+            doctor_catalog.mark_stale()
+        # Индекс подсказок хранит только ФИО и специализации - статус верификации его не затрагивает
+        for row in changed:
+            publish_user_event(row.user_id, EVENT_DOCTOR_VERIFIED, {"profile_id": row.id, "is_verified": data.is_verified})
+    changed_set = set(changed_ids)
+    return {"updated": changed_ids, "unchanged": [doctor_id for doctor_id in doctor_ids if doctor_id not in changed_set]}
 
-# --- TODO: Добавить дополнительные эндпоинты (консультации, отзывы, платежи) ---
+
+# --- Поиск и выгрузка пользователей (администратор) ---
+
+@app.get("/admin/users", response_model=UserSearchResponse, tags=["admin"])
+def admin_search_users(
+    db: DbDependency,
+    current_user: Annotated[User, Depends(require_role("admin"))],
+    email_prefix: Optional[str] = Query(None, min_length=1, max_length=255, description="Начало email"),
+    role: Optional[str] = Query(None, pattern="^(patient|doctor|admin)$"),
+    is_active: Optional[bool] = Query(None),
+    after: Optional[str] = Query(None, description="Email последнего пользователя предыдущей страницы (next_after)"),
+    limit: int = Query(50, ge=1, le=USER_SEARCH_MAX_LIMIT),
+):
+    """
+    Поиск пользователей по началу email, роли и статусу активации.
+    Постраничный обход по курсору (email > after) - без OFFSET и без подсчета общего числа строк.
+    """
+    return search_users(db, after, limit, email_prefix=email_prefix, role=role, is_active=is_active)
+
+
+@app.get("/admin/users/export", tags=["admin"])
+def admin_export_users(
+    current_user: Annotated[User, Depends(require_role("admin"))],
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    email_prefix: Optional[str] = Query(None, min_length=1, max_length=255),
+    role: Optional[str] = Query(None, pattern="^(patient|doctor|admin)$"),
+    is_active: Optional[bool] = Query(None),
+):
+    """
+    Потоковая выгрузка пользователей (с теми же фильтрами, что и поиск) вместе с данными профилей в CSV или NDJSON.
+    Ответ формируется по мере чтения из БД, поэтому выгрузка не ограничена памятью сервера.
+    """
+    filename = f"users-{datetime.utcnow():%Y%m%d-%H%M%S}.{format}"
+    return StreamingResponse(
+        iter_user_export(format, email_prefix=email_prefix, role=role, is_active=is_active),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"},
+    )
 
 # Модель для Google OAuth запроса
 class GoogleAuthRequest(BaseModel):
@@ -613,8 +1347,12 @@ async def google_auth(
             expires_delta=access_token_expires
         )
         
-        # Возвращаем токен
-        return {"access_token": access_token, "token_type": "bearer"}
+        # Возвращаем токен доступа и refresh-токен
+        refresh_token = issue_refresh_token(db, user.id)
+        return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+    except ServiceOverloaded:
+        # Перегрузку отдаем как 503, а не как ошибку авторизации
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -665,42 +1403,64 @@ async def create_update_google_profile(
                 profile.contact_address = profile_data.contact_address
         
         # Если роль пользователя отличается от указанной, обновляем её
-        if current_user.role != "patient":
+        role_changed = current_user.role != "patient"
+        if role_changed:
             current_user.role = "patient"
         
         db.commit()
         db.refresh(profile)
+        publish_user_event(current_user.id, EVENT_PROFILE_UPDATED, {"role": "patient", "profile_id": profile.id})
+        if role_changed:
+            publish_user_event(current_user.id, EVENT_ROLE_CHANGED, {"role": "patient"})
         return profile
         
     elif profile_data.role == "doctor":
         # Проверяем, существует ли профиль врача
         profile = db.query(DoctorProfile).filter(DoctorProfile.user_id == current_user.id).first()
         
+        # Место практики - центр района (как в create_doctor_profile); при смене района координаты пересчитываются
+        location_insert, location_update = doctor_location_values(
+            profile_data.district, None, None, location_set=False, practice_areas_set=bool(profile_data.district),
+        )
+
         # Данные для профиля врача нужно будет запросить дополнительно
         # Здесь мы создаем только базовый профиль
         if not profile:
             profile = DoctorProfile(
                 user_id=current_user.id,
                 full_name=profile_data.full_name,
-                specialization="Общая практика",  # Дефолтное значение
+                specialization=DEFAULT_SPECIALIZATION,  # Дефолтное значение из справочника
                 experience="",
                 education="",
                 cost_per_consultation=1000,  # Дефолтное значение
-                practice_areas=profile_data.district if profile_data.district else ""
+                practice_areas=profile_data.district if profile_data.district else "",
+                **location_insert,
             )
             db.add(profile)
         else:
-            # Обновляем только имя, остальные данные нужно обновлять через другой эндпоинт
+            # Обновляем только имя и район, остальные данные нужно обновлять через другой эндпоинт
             profile.full_name = profile_data.full_name
             if profile_data.district:
                 profile.practice_areas = profile_data.district
+            # SQL-выражения (CASE по location_explicit) вычисляются в UPDATE, атрибуты перечитаются после commit
+            for column, value in location_update.items():
+                setattr(profile, column, value)
         
         # Если роль пользователя отличается от указанной, обновляем её
-        if current_user.role != "doctor":
+        role_changed = current_user.role != "doctor"
+        if role_changed:
             current_user.role = "doctor"
-            
+
+        db.flush() # Нужен id нового профиля для журнала изменений
+        record_doctor_change(db, profile.id)
         db.commit()
         db.refresh(profile)
+        if doctor_catalog is not None:
+            doctor_catalog.mark_stale()
+        doctor_suggestions.update_doctor(profile.id, profile.full_name, profile.specialization)
+        publish_user_event(current_user.id, EVENT_PROFILE_UPDATED, {"role": "doctor", "profile_id": profile.id})
+        if role_changed:
+            publish_user_event(current_user.id, EVENT_ROLE_CHANGED, {"role": "doctor"})
         return profile
     
     else:
@@ -710,21 +1470,102 @@ async def create_update_google_profile(
         )
 
 
+# --- Справочники (районы, специализации) ---
+
+def reference_response(request: Request, items: list, version: str, requested_version: Optional[str]) -> Response:
+    """
+    Ответ со справочником и заголовками кэширования. ETag - версия справочников:
+    повторный запрос с If-None-Match получает 304 без тела. Запрос с актуальной версией в параметре v
+    (например, из /users/me/bootstrap) можно кэшировать сколько угодно - при изменении данных изменится и URL.
+    """
+    etag = f'"{version}"'
+    if requested_version == version:
+        cache_control = "public, max-age=31536000, immutable"
+    else:
+        cache_control = "public, max-age=300"
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return JSONResponse(items, headers=headers)
+
+
 # Эндпоинт для получения списка районов Ташкента
 @app.get("/api/districts", response_model=List[str])
-async def get_districts():
+def get_districts(request: Request, v: Optional[str] = Query(None, description="Версия справочников")):
     """Возвращает список районов Ташкента"""
-    districts = [
-        "Алмазарский район",
-        "Бектемирский район",
-        "Мирабадский район",
-        "Мирзо-Улугбекский район",
-        "Сергелийский район",
-        "Учтепинский район",
-        "Чиланзарский район",
-        "Шайхантаурский район",
-        "Юнусабадский район",
-        "Яккасарайский район",
-        "Яшнабадский район"
-    ]
-    return districts
\ No newline at end of file
+    snapshot = reference_catalog.snapshot()
+    return reference_response(request, snapshot.districts, snapshot.version, v)
+
+
+# Эндпоинт для получения списка специализаций врачей
+@app.get("/api/specializations", response_model=List[str])
+def get_specializations(request: Request, v: Optional[str] = Query(None, description="Версия справочников")):
+    """Возвращает список специализаций врачей"""
+    snapshot = reference_catalog.snapshot()
+    return reference_response(request, snapshot.specializations, snapshot.version, v)
+
+
+# Изменение справочников администратором. Новая версия применяется в этом воркере сразу,
+# в остальных - при следующей проверке (REFERENCE_RELOAD_SECONDS).
+@app.post("/admin/districts", response_model=ReferenceDataResponse, status_code=status.HTTP_201_CREATED, tags=["admin"])
+def add_district(
+    data: DistrictCreate,
+    db: DbDependency,
+    current_user: Annotated[User, Depends(require_role("admin"))]
+):
+    """Добавляет район в справочник."""
+    try:
+        db.execute(insert(District).values(**data.model_dump()))
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="District already exists")
+    reference_catalog.reload()
+    return get_reference_data()
+
+
+@app.delete("/admin/districts/{name}", response_model=ReferenceDataResponse, tags=["admin"])
+def delete_district(
+    name: str,
+    db: DbDependency,
+    current_user: Annotated[User, Depends(require_role("admin"))]
+):
+    """Удаляет район из справочника."""
+    if db.query(District).filter(District.name == name).delete() == 0:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="District not found")
+    db.commit()
+    reference_catalog.reload()
+    return get_reference_data()
+
+
+@app.post("/admin/specializations", response_model=ReferenceDataResponse, status_code=status.HTTP_201_CREATED, tags=["admin"])
+def add_specialization(
+    data: SpecializationCreate,
+    db: DbDependency,
+    current_user: Annotated[User, Depends(require_role("admin"))]
+):
+    """Добавляет специализацию в справочник."""
+    try:
+        db.execute(insert(Specialization).values(**data.model_dump()))
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Specialization already exists")
+    reference_catalog.reload()
+    return get_reference_data()
+
+
+@app.delete("/admin/specializations/{name}", response_model=ReferenceDataResponse, tags=["admin"])
+def delete_specialization(
+    name: str,
+    db: DbDependency,
+    current_user: Annotated[User, Depends(require_role("admin"))]
+):
+    """Удаляет специализацию из справочника. Профили врачей с этой специализацией не меняются."""
+    if name == DEFAULT_SPECIALIZATION:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Default specialization cannot be deleted")
+    if db.query(Specialization).filter(Specialization.name == name).delete() == 0:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Specialization not found")
+    db.commit()
+    reference_catalog.reload()
+    return get_reference_data()
@@ -0,0 +1,289 @@
+# backend/maintenance.py
+
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from sqlalchemy import select, update, delete, insert, func
+from sqlalchemy.exc import IntegrityError
+
+from models import SessionLocal, User, MaintenanceLease, MaintenanceJob, DoctorProfileChange
+from auth import EMAIL_VERIFICATION_TOKEN_EXPIRE_HOURS
+from refresh_tokens import purge_expired_refresh_tokens
+from chat import archive_old_consultations
+from change_feed import DOCTOR_CHANGES_RETENTION_DAYS
+
+logger = logging.getLogger(__name__)
+
+# --- Фоновое обслуживание БД ---
+# Планировщик запускается в каждом воркере, но задачи выполняет только лидер - воркер, который держит
+# аренду (lease) в таблице maintenance_leases. Аренда продлевается каждый тик; если лидер упал,
+# через MAINTENANCE_LEASE_SECONDS ее забирает другой воркер (в том числе на другом сервере).
+# Все задачи идемпотентны и работают пачками по MAINTENANCE_BATCH_SIZE строк в коротких транзакциях,
+# поэтому повторный или прерванный запуск безопасен и не держит долгих блокировок.
+MAINTENANCE_ENABLED = os.getenv("MAINTENANCE_ENABLED", "on") == "on"
+MAINTENANCE_TICK_SECONDS = float(os.getenv("MAINTENANCE_TICK_SECONDS", "15"))
+MAINTENANCE_LEASE_SECONDS = float(os.getenv("MAINTENANCE_LEASE_SECONDS", "60"))
+MAINTENANCE_BATCH_SIZE = int(os.getenv("MAINTENANCE_BATCH_SIZE", "500"))
+# Пауза между пачками: дает место обычным запросам к тем же таблицам
+MAINTENANCE_BATCH_PAUSE_SECONDS = float(os.getenv("MAINTENANCE_BATCH_PAUSE_SECONDS", "0.05"))
+# Сколько дней неподтвержденный аккаунт хранится после истечения ссылки подтверждения
+UNVERIFIED_ACCOUNT_GRACE_DAYS = int(os.getenv("UNVERIFIED_ACCOUNT_GRACE_DAYS", "7"))
+
+LEASE_NAME = "maintenance"
+
+
+def _batched(select_ids, apply: Callable[[object, List[int]], None], batch_size: int = MAINTENANCE_BATCH_SIZE) -> int:
+    """
+    Выполняет apply(db, ids) для всех строк, которые возвращает select_ids (SELECT id ... - без LIMIT),
+    пачками по batch_size, каждая пачка - отдельная транзакция. Возвращает число обработанных строк.
+    """
+    affected = 0
+    while True:
+        with SessionLocal() as db:
+            ids = db.execute(select_ids.limit(batch_size)).scalars().all()
+            if not ids:
+                return affected
+            apply(db, ids)
+            db.commit()
+        affected += len(ids)
+        if len(ids) < batch_size:
+            return affected
+        time.sleep(MAINTENANCE_BATCH_PAUSE_SECONDS)
+
+
+def expire_verification_tokens() -> int:
+    """Очищает просроченные токены подтверждения email (ссылка из письма больше не действует)."""
+    cutoff = datetime.utcnow() - timedelta(hours=EMAIL_VERIFICATION_TOKEN_EXPIRE_HOURS)
+    return _batched(
+        select(User.id)
+        .where(User.email_verification_token.is_not(None))
+        .where(User.email_verification_token_created_at < cutoff)
+        .order_by(User.id),
+        lambda db, ids: db.execute(update(User).where(User.id.in_(ids)).values(email_verification_token=None)),
+    )
+
+
+def purge_unverified_users() -> int:
+    """
+    Удаляет аккаунты, которые так и не подтвердили email: срок ссылки истек
+    и прошло еще UNVERIFIED_ACCOUNT_GRACE_DAYS дней. Email снова становится свободным для регистрации.
+    """
+    cutoff = datetime.utcnow() - timedelta(hours=EMAIL_VERIFICATION_TOKEN_EXPIRE_HOURS, days=UNVERIFIED_ACCOUNT_GRACE_DAYS)
+    return _batched(
+        select(User.id)
+        .where(User.is_active.is_(False))
+        .where(User.email_verification_token_created_at < cutoff)
+        .order_by(User.id),
+        lambda db, ids: db.execute(
+            # Условия повторяются в DELETE: пользователь мог подтвердить email между SELECT и DELETE
+            delete(User)
+            .where(User.id.in_(ids))
+            .where(User.is_active.is_(False))
+            .where(User.email_verification_token_created_at < cutoff)
+        ),
+    )
+
+
+def sweep_refresh_tokens() -> int:
+    return purge_expired_refresh_tokens(MAINTENANCE_BATCH_SIZE)
+
+
+def archive_messages() -> int:
+    return archive_old_consultations()["messages"]
+
+
+def purge_doctor_changes() -> int:
+    """
+    Удаляет строки журнала изменений врачей старше DOCTOR_CHANGES_RETENTION_DAYS. Последняя строка
+    не удаляется никогда: по ней лента изменений отличает устаревший курсор от пустого журнала.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=DOCTOR_CHANGES_RETENTION_DAYS)
+    with SessionLocal() as db:
+        newest = db.execute(select(func.max(DoctorProfileChange.id))).scalar()
+    if newest is None:
+        return 0
+    return _batched(
+        select(DoctorProfileChange.id)
+        .where(DoctorProfileChange.changed_at < cutoff)
+        .where(DoctorProfileChange.id < newest)
+        .order_by(DoctorProfileChange.id),
+        lambda db, ids: db.execute(delete(DoctorProfileChange).where(DoctorProfileChange.id.in_(ids))),
+    )
+
+
+class Job:
+    """Задача обслуживания: функция, возвращающая число обработанных строк, и интервал запуска."""
+
+    def __init__(self, name: str, func: Callable[[], int], interval_seconds: float):
+        self.name = name
+        self.func = func
+        self.interval = timedelta(seconds=interval_seconds)
+
+
+JOBS: List[Job] = [
+    Job("expire_verification_tokens", expire_verification_tokens, 15 * 60),
+    Job("purge_unverified_users", purge_unverified_users, 60 * 60),
+    Job("sweep_refresh_tokens", sweep_refresh_tokens, 60 * 60),
+    Job("archive_messages", archive_messages, 6 * 60 * 60),
+    Job("purge_doctor_changes", purge_doctor_changes, 60 * 60),
+]
+
+
+class MaintenanceScheduler:
+    """Планировщик задач обслуживания с арендой лидера в БД."""
+
+    def __init__(self, jobs: List[Job] = JOBS):
+        self.jobs = jobs
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.is_leader = False
+
+    def acquire_lease(self) -> bool:
+        """Берет или продлевает аренду лидера. Одним условным UPDATE - без гонок между воркерами."""
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=MAINTENANCE_LEASE_SECONDS)
+        with SessionLocal() as db:
+            result = db.execute(
+                update(MaintenanceLease)
+                .where(MaintenanceLease.name == LEASE_NAME)
+                .where((MaintenanceLease.holder == self.holder) | (MaintenanceLease.expires_at < now))
+                .values(holder=self.holder, expires_at=expires_at)
+            )
+            if result.rowcount == 0:
+                try:
+                    db.execute(insert(MaintenanceLease).values(name=LEASE_NAME, holder=self.holder, expires_at=expires_at))
+                except IntegrityError:
+                    # Аренда существует и принадлежит другому живому воркеру
+                    db.rollback()
+                    return False
+            db.commit()
+        return True
+
+    def release_lease(self):
+        with SessionLocal() as db:
+            db.execute(
+                update(MaintenanceLease)
+                .where(MaintenanceLease.name == LEASE_NAME)
+                .where(MaintenanceLease.holder == self.holder)
+                .values(expires_at=datetime.utcnow())
+            )
+            db.commit()
+
+    def _due_jobs(self) -> List[Job]:
+        with SessionLocal() as db:
+            finished = dict(db.execute(select(MaintenanceJob.name, MaintenanceJob.last_finished_at)).all())
+        now = datetime.utcnow()
+        return [job for job in self.jobs if finished.get(job.name) is None or finished[job.name] + job.interval <= now]
+
+    def run_job(self, job: Job) -> dict:
+        """Выполняет задачу и сохраняет метрики запуска в maintenance_jobs."""
+        started_at = datetime.utcnow()
+        started = time.monotonic()
+        affected, error = 0, None
+        try:
+            affected = job.func()
+        except Exception as e:
+            logger.exception("Maintenance job %s failed", job.name)
+            error = f"{type(e).__name__}: {e}"[:1000]
+        metrics = {
+            "last_started_at": started_at,
+            "last_finished_at": datetime.utcnow(),
+            "last_duration_ms": int((time.monotonic() - started) * 1000),
+            "last_affected": affected,
+            "last_error": error,
+            "last_holder": self.holder,
+        }
+        with SessionLocal() as db:
+            result = db.execute(
+                update(MaintenanceJob)
+                .where(MaintenanceJob.name == job.name)
+                .values(
+                    runs=MaintenanceJob.runs + 1,
+                    failures=MaintenanceJob.failures + (1 if error else 0),
+                    total_affected=MaintenanceJob.total_affected + affected,
+                    **metrics,
+                )
+            )
+            if result.rowcount == 0:
+                db.execute(insert(MaintenanceJob).values(
+                    name=job.name, runs=1, failures=1 if error else 0, total_affected=affected, **metrics
+                ))
+            db.commit()
+        logger.info("Maintenance job %s: %d rows in %d ms%s", job.name, affected, metrics["last_duration_ms"],
+                    f", error: {error}" if error else "")
+        return {"name": job.name, **metrics}
+
+    def tick(self):
+        """Один цикл планировщика: продлить аренду и, если этот воркер лидер, выполнить задачи, чей срок подошел."""
+        self.is_leader = self.acquire_lease()
+        if not self.is_leader:
+            return
+        for job in self._due_jobs():
+            if self._stop.is_set():
+                return
+            self.run_job(job)
+            # Длинная задача не должна привести к потере аренды посреди цикла
+            if not self.acquire_lease():
+                self.is_leader = False
+                return
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("Maintenance scheduler tick failed")
+            self._stop.wait(MAINTENANCE_TICK_SECONDS)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="maintenance-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Останавливает планировщик и отдает аренду, чтобы другой воркер не ждал ее истечения."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=MAINTENANCE_LEASE_SECONDS)
+        if self.is_leader:
+            try:
+                self.release_lease()
+            except Exception:
+                logger.exception("Failed to release maintenance lease")
+
+
+def maintenance_status() -> dict:
+    """Текущий лидер и метрики последних запусков задач (для эндпоинта администратора)."""
+    with SessionLocal() as db:
+        lease = db.execute(select(MaintenanceLease).where(MaintenanceLease.name == LEASE_NAME)).scalar()
+        jobs = db.execute(select(MaintenanceJob).order_by(MaintenanceJob.name)).scalars().all()
+        return {
+            "leader": lease.holder if lease is not None and lease.expires_at > datetime.utcnow() else None,
+            "lease_expires_at": lease.expires_at if lease is not None else None,
+            "jobs": [
+                {
+                    "name": job.name,
+                    "runs": job.runs,
+                    "failures": job.failures,
+                    "total_affected": job.total_affected,
+                    "last_started_at": job.last_started_at,
+                    "last_finished_at": job.last_finished_at,
+                    "last_duration_ms": job.last_duration_ms,
+                    "last_affected": job.last_affected,
+                    "last_error": job.last_error,
+                    "last_holder": job.last_holder,
+                }
+                for job in jobs
+            ],
+        }
+
+
+# Планировщик процесса (None, если обслуживание выключено)
+maintenance_scheduler: Optional[MaintenanceScheduler] = MaintenanceScheduler() if MAINTENANCE_ENABLED else None
@@ -0,0 +1,182 @@
+# backend/migration_utils.py
+
+import os
+import time
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence
+
+import sqlalchemy as sa
+from sqlalchemy.engine import Connection, Engine
+
+from models import DataMigrationProgress
+
+logger = logging.getLogger(__name__)
+
+# --- Пакетные миграции данных для Alembic ---
+# Один большой UPDATE по таблице на миллионы строк держит блокировки и раздувает undo-лог до конца транзакции,
+# а реплики применяют его одним куском (задержка репликации). Здесь заполнение идет пачками:
+#  - ключи берутся по индексу первичного ключа (id > последний обработанный ORDER BY id LIMIT N) - без OFFSET;
+#  - каждая пачка - отдельная короткая транзакция, в которой же сохраняется прогресс (data_migration_progress),
+#    поэтому прерванную миграцию можно запустить снова, и она продолжит с места остановки;
+#  - между пачками пауза, а при задержке репликации больше MIGRATION_MAX_REPLICA_LAG_SECONDS - ожидание.
+#
+# Использование в файле миграции (прогресс пишется отдельным соединением, поэтому внутри autocommit_block -
+# DDL миграции к этому моменту уже зафиксирован):
+#
+#     with op.get_context().autocommit_block():
+#         backfill(op.get_bind(), "doctor_profiles_geohash", doctor_profiles, process_batch,
+#                  where=doctor_profiles.c.geohash.is_(None))
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "1000"))
+MIGRATION_BATCH_SLEEP_SECONDS = float(os.getenv("MIGRATION_BATCH_SLEEP_SECONDS", "0.05"))
+# Реплики MySQL, задержку которых нужно проверять (URL через запятую); пусто - не проверять
+MIGRATION_REPLICA_URLS = [url.strip() for url in os.getenv("MIGRATION_REPLICA_URLS", "").split(",") if url.strip()]
+MIGRATION_MAX_REPLICA_LAG_SECONDS = float(os.getenv("MIGRATION_MAX_REPLICA_LAG_SECONDS", "5"))
+# Как часто проверять задержку репликации (в пачках)
+MIGRATION_LAG_CHECK_EVERY = 10
+
+progress_table = DataMigrationProgress.__table__
+
+_replica_engines: Dict[str, Engine] = {}
+
+
+def replica_lag_seconds() -> Optional[float]:
+    """
+    Наибольшая задержка среди реплик (SHOW REPLICA STATUS). None - реплики не настроены.
+    Остановленная репликация (Seconds_Behind_Source = NULL) считается бесконечной задержкой.
+    """
+    if not MIGRATION_REPLICA_URLS:
+        return None
+    worst = 0.0
+    for url in MIGRATION_REPLICA_URLS:
+        if url not in _replica_engines:
+            _replica_engines[url] = sa.create_engine(url, pool_size=1)
+        with _replica_engines[url].connect() as connection:
+            try:
+                row = connection.exec_driver_sql("SHOW REPLICA STATUS").mappings().first()
+            except sa.exc.DBAPIError:
+                # MySQL до 8.0.22
+                row = connection.exec_driver_sql("SHOW SLAVE STATUS").mappings().first()
+        if row is None:
+            continue
+        lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+        worst = max(worst, float("inf") if lag is None else float(lag))
+    return worst
+
+
+def wait_for_replicas(max_lag: float = MIGRATION_MAX_REPLICA_LAG_SECONDS):
+    """Ждет, пока задержка репликации не опустится ниже max_lag."""
+    while True:
+        lag = replica_lag_seconds()
+        if lag is None or lag <= max_lag:
+            return
+        logger.info("Replica lag %.1fs > %.1fs, pausing backfill", lag, max_lag)
+        time.sleep(min(max(lag - max_lag, 1.0), 30.0))
+
+
+def _load_progress(connection: Connection, name: str):
+    # Таблица создается миграцией 4e9a7b1c6d58; checkfirst - на случай заполнения в более ранней миграции
+    progress_table.create(connection, checkfirst=True)
+    row = connection.execute(sa.select(progress_table).where(progress_table.c.name == name)).first()
+    if row is None:
+        now = datetime.utcnow()
+        connection.execute(sa.insert(progress_table).values(name=name, last_key=None, rows_done=0, started_at=now, updated_at=now))
+        row = connection.execute(sa.select(progress_table).where(progress_table.c.name == name)).first()
+    return row
+
+
+def backfill(
+    bind: Connection,
+    name: str,
+    table: sa.Table,
+    process_batch: Callable[[Connection, List[sa.Row]], None],
+    where=None,
+    columns: Sequence[sa.Column] = (),
+    key_column: Optional[sa.Column] = None,
+    batch_size: int = MIGRATION_BATCH_SIZE,
+    sleep_seconds: float = MIGRATION_BATCH_SLEEP_SECONDS,
+) -> int:
+    """
+    Обходит строки table (с условием where) пачками по возрастанию ключа и вызывает process_batch(connection, rows)
+    для каждой пачки в отдельной транзакции. rows содержат ключ и columns. Возвращает число строк за этот запуск.
+
+    Args:
+        bind: Соединение миграции (op.get_bind()); пачки выполняются в отдельном соединении того же engine.
+        name: Уникальное имя заполнения - ключ строки прогресса (повторный запуск продолжает с last_key).
+        key_column: Целочисленный уникальный ключ обхода (по умолчанию table.c.id).
+    """
+    key_column = key_column if key_column is not None else table.c.id
+    with bind.engine.connect() as connection:
+        with connection.begin():
+            progress = _load_progress(connection, name)
+        if progress.finished_at is not None:
+            logger.info("Backfill %s already finished (%d rows)", name, progress.rows_done)
+            return 0
+
+        last_key = progress.last_key
+        processed = 0
+        batches = 0
+        started = time.monotonic()
+        while True:
+            query = sa.select(key_column, *columns).order_by(key_column).limit(batch_size)
+            if where is not None:
+                query = query.where(where)
+            if last_key is not None:
+                query = query.where(key_column > last_key)
+
+            with connection.begin():
+                rows = connection.execute(query).all()
+                if rows:
+                    process_batch(connection, rows)
+                    last_key = rows[-1][0]
+                connection.execute(
+                    sa.update(progress_table).where(progress_table.c.name == name).values(
+                        last_key=last_key,
+                        rows_done=progress_table.c.rows_done + len(rows),
+                        updated_at=datetime.utcnow(),
+                        finished_at=datetime.utcnow() if len(rows) < batch_size else None,
+                    )
+                )
+            processed += len(rows)
+            batches += 1
+            if len(rows) < batch_size:
+                break
+            if batches % 100 == 0:
+                logger.info("Backfill %s: %d rows, last key %s, %.0f rows/s",
+                            name, processed, last_key, processed / (time.monotonic() - started))
+            time.sleep(sleep_seconds)
+            if batches % MIGRATION_LAG_CHECK_EVERY == 0:
+                wait_for_replicas()
+
+    logger.info("Backfill %s finished: %d rows in %.1fs", name, processed, time.monotonic() - started)
+    return processed
+
+
+def reset_backfill(bind: Connection, name: str):
+    """Удаляет прогресс заполнения (для downgrade: повторный upgrade начнет с начала)."""
+    if sa.inspect(bind).has_table(progress_table.name):
+        bind.execute(sa.delete(progress_table).where(progress_table.c.name == name))
+
+
+def create_index_online(bind: Connection, name: str, table_name: str, columns: Sequence[str]):
+    """
+    Создает индекс без блокировки записи в таблицу:
+      - MySQL: ALTER TABLE ... ADD INDEX ..., ALGORITHM=INPLACE, LOCK=NONE (ошибка, если online невозможен);
+      - PostgreSQL: CREATE INDEX CONCURRENTLY (вызывать внутри op.get_context().autocommit_block());
+      - остальные СУБД: обычный CREATE INDEX.
+    Если индекс уже есть (миграция прервалась после его создания), ничего не делает.
+    """
+    if any(index["name"] == name for index in sa.inspect(bind).get_indexes(table_name)):
+        return
+    preparer = bind.dialect.identifier_preparer
+    quoted_columns = ", ".join(preparer.quote(column) for column in columns)
+    dialect = bind.dialect.name
+    if dialect == "mysql":
+        bind.exec_driver_sql(
+            f"ALTER TABLE {preparer.quote(table_name)} ADD INDEX {preparer.quote(name)} ({quoted_columns}), "
+            "ALGORITHM=INPLACE, LOCK=NONE"
+        )
+    elif dialect == "postgresql":
+        bind.exec_driver_sql(f"CREATE INDEX CONCURRENTLY {preparer.quote(name)} ON {preparer.quote(table_name)} ({quoted_columns})")
+    else:
+        bind.exec_driver_sql(f"CREATE INDEX {preparer.quote(name)} ON {preparer.quote(table_name)} ({quoted_columns})")
@@ -1,11 +1,13 @@
 # backend/models.py
 
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, ForeignKey, Text, DateTime
+from sqlalchemy import create_engine, Column, Integer, BigInteger, SmallInteger, Float, String, Boolean, ForeignKey, Text, DateTime, LargeBinary, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime # Импортируем datetime для работы с датой и временем
 
+from working_hours import encode_week, decode_week # Кодирование рабочих часов врача в битовые маски
+
 from dotenv import load_dotenv # Импортируем load_dotenv
 load_dotenv() # Загружаем переменные из .env файла
 
@@ -45,7 +47,7 @@ class User(Base):
 
     # Поля для подтверждения email
     email_verification_token = Column(String(255), unique=True, nullable=True) # Токен подтверждения email (может быть NULL)
-    email_verification_token_created_at = Column(DateTime, nullable=True) # Время создания токена (может быть NULL)
+    email_verification_token_created_at = Column(DateTime, nullable=True, index=True) # Время создания токена (может быть NULL); индекс - для фоновой очистки просроченных
 
 
     # Отношения к профилям (один пользователь может иметь ОДИН профиль пациента или ОДИН профиль врача)
@@ -89,15 +91,217 @@ class DoctorProfile(Base):
     practice_areas = Column(String(511)) # Районы практики (можно хранить как строку)
     is_verified = Column(Boolean, default=False) # Статус верификации Администратором
 
-    # TODO: Добавить связи с моделями Отзывов, Консультаций, Расписания
+    # Рабочие часы: по битовой маске получасовых слотов на каждый день недели (см. working_hours.py).
+    # Пересчитываются при каждой записи через свойство working_hours.
+    hours_mon = Column(BigInteger, nullable=False, default=0, server_default="0")
+    hours_tue = Column(BigInteger, nullable=False, default=0, server_default="0")
+    hours_wed = Column(BigInteger, nullable=False, default=0, server_default="0")
+    hours_thu = Column(BigInteger, nullable=False, default=0, server_default="0")
+    hours_fri = Column(BigInteger, nullable=False, default=0, server_default="0")
+    hours_sat = Column(BigInteger, nullable=False, default=0, server_default="0")
+    hours_sun = Column(BigInteger, nullable=False, default=0, server_default="0")
+    working_days = Column(SmallInteger, nullable=False, default=0, server_default="0", index=True) # Маска рабочих дней (бит 0 - понедельник)
+
+    # Место практики (см. geo.py): координаты и geohash для поиска ближайших врачей по индексу
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+    geohash = Column(String(12), nullable=True, index=True)
+    # Координаты указаны врачом явно (True) или взяты из центра района практики (False).
+    # Смена practice_areas пересчитывает только координаты района, явные остаются
+    location_explicit = Column(Boolean, nullable=False, default=False, server_default="0")
+
+    # TODO: Добавить связи с моделями Отзывов, Консультаций
 
     # Отношение к пользователю (обратная связь)
     user = relationship("User", back_populates="doctor_profile")
 
+    # Составные индексы для сортировок и фильтров каталога (GET /api/doctors):
+    #  - (cost_per_consultation, id): диапазон цен и sort=price/-price (специализация - поиск подстроки, без индекса);
+    #  - (full_name, id): sort=name;
+    #  - (is_verified, id): очередь непроверенных врачей для администратора (постраничный обход по id).
+    __table_args__ = (
+        Index("ix_doctor_profiles_cost_id", "cost_per_consultation", "id"),
+        Index("ix_doctor_profiles_full_name_id", "full_name", "id"),
+        Index("ix_doctor_profiles_is_verified_id", "is_verified", "id"),
+    )
+
+    @property
+    def working_hours(self) -> dict:
+        """Расписание в виде {"mon": [{"start": "09:00", "end": "13:00"}], ...}, восстановленное из масок."""
+        return decode_week(self)
+
+    @working_hours.setter
+    def working_hours(self, schedule):
+        # Позволяет передавать working_hours в конструктор и в setattr - маски пересчитываются сразу
+        for column, value in encode_week(schedule).items():
+            setattr(self, column, value)
+
+
+# Журнал изменений профилей врачей: строка на каждую запись профиля (в той же транзакции).
+# По нему колоночный каталог (doctor_catalog.py) дочитывает изменения, не перечитывая всю таблицу.
+class DoctorProfileChange(Base):
+    __tablename__ = "doctor_profile_changes"
+
+    # Монотонно растущий id - позиция в журнале (BigInteger для MySQL, Integer для SQLite)
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    doctor_id = Column(Integer, nullable=False, index=True) # Без внешнего ключа: запись об удалении переживает профиль
+    operation = Column(String(10), nullable=False, default="upsert") # 'upsert' или 'delete'
+    changed_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        {"sqlite_autoincrement": True},
+    )
+
+
+# Модель слота в календаре врача. Врач публикует свободные слоты, пациент бронирует один из них.
+class DoctorSlot(Base):
+    __tablename__ = "doctor_slots"
+
+    id = Column(Integer, primary_key=True, index=True)
+    doctor_id = Column(Integer, ForeignKey("doctor_profiles.id", ondelete="CASCADE"), nullable=False) # ID профиля врача
+    start_at = Column(DateTime, nullable=False) # Начало приема (UTC)
+    end_at = Column(DateTime, nullable=False) # Конец приема (UTC)
+    patient_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True, index=True) # Кто забронировал (NULL - слот свободен)
+    booked_at = Column(DateTime, nullable=True) # Время бронирования
+    version = Column(Integer, nullable=False, default=0) # Версия строки, растет при каждом бронировании/отмене
+
+    # Уникальный индекс (doctor_id, start_at):
+    #  - не дает создать два слота врача с одним началом даже при одновременных запросах;
+    #  - служит интервальным индексом: поиск пересечений - это диапазон по start_at внутри одного врача.
+    __table_args__ = (
+        UniqueConstraint("doctor_id", "start_at", name="uq_doctor_slots_doctor_id_start_at"),
+    )
+
+    @property
+    def is_booked(self) -> bool:
+        return self.patient_id is not None
+
+
+# Модель refresh-токена (хранится только SHA-256 токена)
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    token_hash = Column(String(64), unique=True, nullable=False) # SHA-256 токена в hex, поиск по уникальному индексу
+    family_id = Column(String(32), nullable=False, index=True) # Цепочка ротаций одного входа: отзывается целиком при повторном использовании
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True) # Индекс нужен для пакетной очистки просроченных токенов
+    revoked_at = Column(DateTime, nullable=True) # Время использования (ротации) или отзыва; NULL - токен действует
+
+
+# Модель консультации (чат пациента с врачом)
+class Consultation(Base):
+    __tablename__ = "consultations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    patient_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True) # Пользователь-пациент
+    doctor_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True) # Пользователь-врач
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow) # Время создания консультации
+    last_message_at = Column(DateTime, nullable=True, index=True) # Время последнего сообщения (для архивации)
+    archived_at = Column(DateTime, nullable=True) # Когда сообщения консультации были перенесены в архив
+
+
+# Модель сообщения чата. Таблица только для добавления (append-only): сообщения не изменяются.
+class Message(Base):
+    __tablename__ = "messages"
+
+    # Монотонно растущий id. BigInteger для MySQL, Integer для SQLite (там автоинкремент работает только у INTEGER PRIMARY KEY)
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    consultation_id = Column(Integer, ForeignKey("consultations.id", ondelete="CASCADE"), nullable=False)
+    sender_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # Ключ идемпотентности (UUID): повторная отправка с тем же ключом не создает второе сообщение.
+    # Задается клиентом или генерируется сервером; у сообщений, записанных до появления колонки, - NULL
+    client_message_id = Column(String(36), nullable=True)
+
+    # Индекс (consultation_id, id) покрывает выборку истории по курсору:
+    # WHERE consultation_id = ? AND id < ? ORDER BY id DESC LIMIT ? - это один проход по диапазону индекса.
+    # Уникальность (consultation_id, client_message_id) защищает от дублей при повторе запроса (NULL не конфликтуют).
+    # sqlite_autoincrement: без него SQLite повторно выдает id удаленных (заархивированных) сообщений
+    __table_args__ = (
+        Index("ix_messages_consultation_id_id", "consultation_id", "id"),
+        UniqueConstraint("consultation_id", "client_message_id", name="uq_messages_consultation_id_client_message_id"),
+        {"sqlite_autoincrement": True},
+    )
+
+
+# Архив сообщений старых консультаций: пачка сообщений хранится одной строкой в сжатом виде (zlib + JSON)
+class MessageArchive(Base):
+    __tablename__ = "message_archives"
+
+    id = Column(Integer, primary_key=True, index=True)
+    consultation_id = Column(Integer, ForeignKey("consultations.id", ondelete="CASCADE"), nullable=False)
+    first_message_id = Column(BigInteger, nullable=False) # id первого сообщения в пачке
+    last_message_id = Column(BigInteger, nullable=False) # id последнего сообщения в пачке
+    message_count = Column(Integer, nullable=False)
+    payload = Column(LargeBinary(16777215), nullable=False) # Сжатый JSON-список сообщений (MEDIUMBLOB в MySQL)
+    archived_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_message_archives_consultation_id_last_message_id", "consultation_id", "last_message_id"),
+    )
+
+
+# Справочник районов (см. reference_data.py)
+class District(Base):
+    __tablename__ = "districts"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(255), unique=True, nullable=False)
+    latitude = Column(Float, nullable=True) # Приблизительный центр района
+    longitude = Column(Float, nullable=True)
+    sort_order = Column(Integer, nullable=False, default=0) # Порядок в выпадающем списке
+
+
+# Справочник специализаций врачей (см. reference_data.py)
+class Specialization(Base):
+    __tablename__ = "specializations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(255), unique=True, nullable=False)
+    sort_order = Column(Integer, nullable=False, default=0)
+
+
+# Аренда лидера фонового обслуживания (см. maintenance.py): задачи выполняет только воркер-держатель
+class MaintenanceLease(Base):
+    __tablename__ = "maintenance_leases"
+
+    name = Column(String(64), primary_key=True)
+    holder = Column(String(255), nullable=False) # hostname:pid:случайный суффикс воркера
+    expires_at = Column(DateTime, nullable=False) # После этого времени аренду может забрать другой воркер
+
+
+# Метрики последнего запуска задач обслуживания (см. maintenance.py)
+class MaintenanceJob(Base):
+    __tablename__ = "maintenance_jobs"
+
+    name = Column(String(64), primary_key=True)
+    runs = Column(Integer, nullable=False, default=0)
+    failures = Column(Integer, nullable=False, default=0)
+    total_affected = Column(BigInteger, nullable=False, default=0) # Сколько строк обработано за все запуски
+    last_started_at = Column(DateTime, nullable=True)
+    last_finished_at = Column(DateTime, nullable=True) # По нему считается следующий запуск (переживает смену лидера)
+    last_duration_ms = Column(Integer, nullable=True)
+    last_affected = Column(Integer, nullable=True)
+    last_error = Column(Text, nullable=True)
+    last_holder = Column(String(255), nullable=True)
+
+
+# Прогресс пакетных миграций данных (см. migration_utils.py): повторный запуск продолжает с last_key
+class DataMigrationProgress(Base):
+    __tablename__ = "data_migration_progress"
+
+    name = Column(String(128), primary_key=True)
+    last_key = Column(BigInteger, nullable=True) # Последний обработанный ключ (NULL - еще не начато)
+    rows_done = Column(BigInteger, nullable=False, default=0)
+    started_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True) # NULL - заполнение не закончено
+
 
 # TODO: Определить модели для других сущностей:
-# class Consultation(Base): ...
-# class Message(Base): ...
 # class Review(Base): ...
 
 
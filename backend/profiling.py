@@ -0,0 +1,234 @@
+# backend/profiling.py
+
+import os
+import sys
+import hmac
+import time
+import random
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+import anyio
+import anyio.to_thread
+
+from auth import SECRET_KEY
+
+logger = logging.getLogger(__name__)
+
+# --- Выборочное профилирование запросов ---
+# Для доли запросов (PROFILING_SAMPLE_RATE) или для запроса с подписанным заголовком X-Profile-Request
+# (подпись выдает администратор, см. POST /admin/profiling/token) запускается поток-сэмплер:
+# каждые PROFILING_INTERVAL_MS он снимает стеки рабочих потоков через sys._current_frames().
+# Сэмплер не замедляет сам запрос (в отличие от cProfile/sys.setprofile), поэтому его можно
+# включать в продакшене. Результат - файл в формате "collapsed stacks" (строка "f1;f2;f3 N"),
+# из которого flamegraph.pl или speedscope строят flame graph.
+#
+# Снимаются стеки потока цикла событий (async-эндпоинты) и занятых потоков пула (sync-эндпоинты,
+# зависимости, bcrypt). Если одновременно выполняются другие запросы, их стеки в пуле тоже попадут
+# в профиль - корень каждого стека подписан именем потока.
+#
+# Если профилирование выключено (PROFILING_ENABLED=off, по умолчанию), middleware не подключается вовсе.
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "off") == "on"
+# Доля запросов, которые профилируются без заголовка (0.001 = каждый тысячный)
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "5"))
+PROFILING_DIR = os.getenv("PROFILING_DIR", os.path.join(tempfile.gettempdir(), "vrachi-profiles"))
+# Общий размер файлов профилей: при превышении удаляются самые старые
+PROFILING_MAX_BYTES = int(os.getenv("PROFILING_MAX_BYTES", str(100 * 1024 * 1024)))
+# Ключ подписи заголовка X-Profile-Request (по умолчанию - ключ JWT)
+PROFILING_SECRET = os.getenv("PROFILING_SECRET", SECRET_KEY)
+PROFILING_TOKEN_MAX_MINUTES = 60
+
+PROFILE_HEADER = "X-Profile-Request"
+_PROFILE_HEADER_KEY = PROFILE_HEADER.lower().encode("latin-1")
+# Заголовок ответа: префикс имени файла профиля (метод и маршрут)
+PROFILE_ROUTE_HEADER = b"x-profile-route"
+
+# Потоки, в которых выполняется работа запросов
+_WORKER_THREAD_NAME = "AnyIO worker thread"
+# Модули, в которых поток ждет (блокировки, очереди, select цикла событий)
+_WAIT_MODULES = ("/threading.py", "/queue.py", "/selectors.py")
+# Код сервера и пула потоков: если под ожиданием сразу он, поток простаивает (ждет задачу или события)
+_IDLE_OWNERS = ("/anyio/", "/uvicorn/")
+
+
+def _sign(expires: int) -> str:
+    return hmac.new(PROFILING_SECRET.encode("utf-8"), f"profile:{expires}".encode("ascii"), hashlib.sha256).hexdigest()
+
+
+def create_profile_token(minutes: int) -> Tuple[str, datetime]:
+    """Значение заголовка X-Profile-Request, действующее minutes минут: "<срок в unix-времени>.<HMAC>"."""
+    expires = int(time.time()) + minutes * 60
+    return f"{expires}.{_sign(expires)}", datetime.utcfromtimestamp(expires)
+
+
+def verify_profile_token(value: str) -> bool:
+    expires, _, signature = value.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, _sign(int(expires)))
+
+
+def _frame_label(code) -> str:
+    # Номер первой строки функции, а не текущей: сэмплы одной функции складываются в один узел графа
+    path = code.co_filename.replace("\\", "/").rsplit("/", 2)
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+def _is_idle(frame) -> bool:
+    """
+    Поток простаивает, если под ожиданием нет кода приложения: поток пула ждет задачу,
+    цикл событий ждет в select. Ожидание внутри кода запроса (семафор bcrypt, блокировка) простоем не считается.
+    """
+    while frame is not None:
+        filename = frame.f_code.co_filename.replace("\\", "/")
+        if not filename.endswith(_WAIT_MODULES) and "/asyncio/" not in filename:
+            return any(owner in filename for owner in _IDLE_OWNERS)
+        frame = frame.f_back
+    return True
+
+
+def _stack(frame) -> Optional[str]:
+    if _is_idle(frame):
+        return None
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return ";".join(labels)
+
+
+class RequestProfile:
+    """Сэмплер одного запроса: фоновый поток, который копит стеки, пока запрос выполняется."""
+
+    def __init__(self, loop_thread_id: int, interval: float = PROFILING_INTERVAL_MS / 1000):
+        self.loop_thread_id = loop_thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self.started = 0.0
+        self.duration = 0.0
+
+    def _sample(self):
+        threads: Dict[int, str] = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == self.loop_thread_id:
+                root = "event-loop"
+            elif threads.get(thread_id) == _WORKER_THREAD_NAME:
+                root = "worker"
+            else:
+                continue
+            stack = _stack(frame)
+            if stack is not None:
+                self.samples[f"{root};{stack}"] += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self.duration = time.perf_counter() - self.started
+        self._stop.set()
+        self._thread.join()
+
+
+def _route_slug(scope) -> str:
+    route = scope.get("route")
+    path = getattr(route, "path", None) or scope.get("path", "")
+    slug = "".join(char if char.isalnum() else "_" for char in path).strip("_") or "root"
+    return f"{scope.get('method', 'GET')}_{slug}"[:120]
+
+
+def _enforce_size_cap(directory: str):
+    """Удаляет самые старые профили, пока общий размер больше PROFILING_MAX_BYTES."""
+    files = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith(".folded"):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= PROFILING_MAX_BYTES:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def save_profile(profile: RequestProfile, scope, directory: str = PROFILING_DIR) -> Optional[str]:
+    """Записывает профиль запроса в файл <метод>_<маршрут>__<время>_<мс>ms.folded. Возвращает имя файла."""
+    if not profile.samples:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    name = f"{_route_slug(scope)}__{datetime.utcnow():%Y%m%dT%H%M%S%f}_{int(profile.duration * 1000)}ms.folded"
+    with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+        for stack, count in profile.samples.most_common():
+            f.write(f"{stack} {count}\n")
+    _enforce_size_cap(directory)
+    return name
+
+
+class SamplingProfilerMiddleware:
+    """
+    ASGI middleware: профилирует выбранные запросы. Для остальных запросов - одна проверка заголовка
+    и одно случайное число.
+    """
+
+    def __init__(self, app, sample_rate: float = PROFILING_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    @staticmethod
+    def _finish(profile: RequestProfile, scope):
+        """Останавливает сэмплер и записывает профиль (в потоке пула: join потока и файловый ввод-вывод)."""
+        profile.stop()
+        try:
+            name = save_profile(profile, scope)
+        except OSError:
+            logger.exception("Failed to save request profile")
+            return
+        if name is not None:
+            logger.info("Request profile saved: %s (%d samples)", name, sum(profile.samples.values()))
+
+    def _should_profile(self, scope) -> bool:
+        for key, value in scope["headers"]:
+            if key == _PROFILE_HEADER_KEY:
+                return verify_profile_token(value.decode("latin-1"))
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(threading.get_ident())
+
+        async def send_with_profile_route(message):
+            # Полное имя файла известно только в конце запроса, поэтому в заголовке - префикс, по которому его легко найти
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((PROFILE_ROUTE_HEADER, _route_slug(scope).encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_profile_route)
+        finally:
+            # Запись файла и очистка каталога не выполняются в цикле событий: иначе на время ввода-вывода
+            # останавливаются все запросы воркера. shield - сэмплер останавливается, даже если запрос отменен
+            with anyio.CancelScope(shield=True):
+                await anyio.to_thread.run_sync(self._finish, profile, scope)
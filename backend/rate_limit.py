@@ -0,0 +1,305 @@
+# backend/rate_limit.py
+
+import os
+import time
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager, asynccontextmanager
+from functools import partial
+from math import ceil
+from typing import Dict, Optional, Tuple
+
+import anyio.to_thread
+from fastapi import HTTPException, Request, status
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# --- Настройки лимитов для эндпоинтов аутентификации ---
+
+# Token bucket по IP: допускается всплеск до BURST запросов, затем RATE запросов в секунду
+AUTH_IP_BURST = int(os.getenv("AUTH_IP_BURST", "20"))
+AUTH_IP_RATE = float(os.getenv("AUTH_IP_RATE", "0.5"))
+# Token bucket по email: один аккаунт нельзя перебирать быстрее, чем с одного IP
+AUTH_EMAIL_BURST = int(os.getenv("AUTH_EMAIL_BURST", "5"))
+AUTH_EMAIL_RATE = float(os.getenv("AUTH_EMAIL_RATE", "0.1"))
+# Скользящее окно: не больше LIMIT попыток входа на email за WINDOW секунд
+LOGIN_EMAIL_WINDOW_LIMIT = int(os.getenv("LOGIN_EMAIL_WINDOW_LIMIT", "30"))
+LOGIN_EMAIL_WINDOW_SECONDS = int(os.getenv("LOGIN_EMAIL_WINDOW_SECONDS", "900"))
+# Скользящее окно: не больше LIMIT регистраций с одного IP за WINDOW секунд
+REGISTER_IP_WINDOW_LIMIT = int(os.getenv("REGISTER_IP_WINDOW_LIMIT", "10"))
+REGISTER_IP_WINDOW_SECONDS = int(os.getenv("REGISTER_IP_WINDOW_SECONDS", "3600"))
+
+# Ограничение параллельных вычислений bcrypt: сколько хэшей считается одновременно
+# и сколько запросов может ждать своей очереди, прежде чем получить 503
+BCRYPT_MAX_CONCURRENT = int(os.getenv("BCRYPT_MAX_CONCURRENT", str(os.cpu_count() or 2)))
+BCRYPT_MAX_QUEUE = int(os.getenv("BCRYPT_MAX_QUEUE", "32"))
+BCRYPT_QUEUE_TIMEOUT = float(os.getenv("BCRYPT_QUEUE_TIMEOUT", "2.0"))
+# Сколько задач может ждать свободный поток пула, прежде чем дорогие эндпоинты начнут отвечать 503
+THREADPOOL_MAX_WAITING = int(os.getenv("THREADPOOL_MAX_WAITING", "16"))
+
+
+class ServiceOverloaded(Exception):
+    """Сервис перегружен: очередь к ограниченному ресурсу заполнена. Превращается в ответ 503."""
+
+    def __init__(self, resource: str, retry_after: int = 1):
+        super().__init__(f"{resource} is saturated")
+        self.resource = resource
+        self.retry_after = retry_after
+
+
+class TokenBucketLimiter:
+    """
+    Token bucket по произвольному ключу (IP, email).
+    Состояние ключа - [токены, время последнего пополнения]; число ключей ограничено,
+    при переполнении вытесняются давно не использовавшиеся (LRU).
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str) -> Tuple[bool, float]:
+        """Забирает токен. Возвращает (разрешено ли, через сколько секунд появится следующий токен)."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = [float(self.burst), now]
+                self._buckets[key] = bucket
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return True, 0.0
+            return False, (1 - bucket[0]) / self.rate
+
+
+class SlidingWindowCounter:
+    """
+    Счетчик событий в скользящем окне с фиксированным объемом памяти.
+    Счетчики текущего и предыдущего окна хранятся в массивах array('I') размером depth * width
+    (count-min sketch), поэтому память не растет с числом ключей. Коллизии хэшей могут только
+    завысить оценку, но никогда ее не занижают.
+    Оценка в окне: count_prev * (доля предыдущего окна, еще попадающая в скользящее окно) + count_current.
+    """
+
+    def __init__(self, limit: int, window_seconds: int, width: int = 1 << 15, depth: int = 2):
+        self.limit = limit
+        self.window = window_seconds
+        self.width = width
+        self.depth = depth
+        self._current = array("I", bytes(4 * width * depth))
+        self._previous = array("I", bytes(4 * width * depth))
+        self._window_index = int(time.time() // window_seconds)
+        self._lock = threading.Lock()
+
+    def _cells(self, key: str):
+        # Независимые хэши для каждой строки скетча - из одного дайджеста blake2b
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=4 * self.depth).digest()
+        for row in range(self.depth):
+            value = int.from_bytes(digest[4 * row:4 * row + 4], "little")
+            yield row * self.width + value % self.width
+
+    def _rotate(self, now: float):
+        index = int(now // self.window)
+        if index == self._window_index:
+            return
+        if index == self._window_index + 1:
+            self._previous, self._current = self._current, self._previous
+        else:
+            # Пропущено больше одного окна - предыдущее окно пустое
+            self._previous[:] = array("I", bytes(4 * self.width * self.depth))
+        self._current[:] = array("I", bytes(4 * self.width * self.depth))
+        self._window_index = index
+
+    def hit(self, key: str) -> Tuple[bool, float]:
+        """Учитывает событие. Возвращает (не превышен ли лимит, сколько секунд ждать до конца текущего окна)."""
+        now = time.time()
+        with self._lock:
+            self._rotate(now)
+            cells = list(self._cells(key))
+            current = min(self._current[cell] for cell in cells)
+            previous = min(self._previous[cell] for cell in cells)
+            elapsed = (now % self.window) / self.window
+            estimate = previous * (1 - elapsed) + current
+            if estimate >= self.limit:
+                return False, self.window - now % self.window
+            for cell in cells:
+                if self._current[cell] < 0xFFFFFFFF:
+                    self._current[cell] += 1
+            return True, 0.0
+
+
+class ConcurrencyLimiter:
+    """
+    Ограничивает число одновременных вычислений дорогой операции (bcrypt).
+    Если ждущих уже max_queue или место не освободилось за queue_timeout секунд, выбрасывает ServiceOverloaded.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.active = 0
+
+    def _enqueue(self):
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                metrics.increment(f"{self.name}.rejected")
+                raise ServiceOverloaded(self.name)
+            self.waiting += 1
+
+    def _dequeue(self, acquired: bool):
+        with self._lock:
+            self.waiting -= 1
+            if acquired:
+                self.active += 1
+        if not acquired:
+            metrics.increment(f"{self.name}.rejected")
+            raise ServiceOverloaded(self.name)
+
+    def _release(self):
+        with self._lock:
+            self.active -= 1
+        self._semaphore.release()
+
+    @contextmanager
+    def slot(self):
+        """Место для вызова из потока (sync-эндпоинты, пул потоков): ожидание блокирует текущий поток."""
+        self._enqueue()
+        # Быстрая проверка без ожидания: если место есть сразу, запрос не считается поставленным в очередь
+        acquired = self._semaphore.acquire(blocking=False)
+        if not acquired:
+            metrics.increment(f"{self.name}.queued")
+            acquired = self._semaphore.acquire(timeout=self.queue_timeout)
+        self._dequeue(acquired)
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def async_slot(self):
+        """
+        Место для вызова из цикла событий (async-эндпоинты): ожидание семафора выполняется в пуле потоков,
+        цикл событий в это время обслуживает другие запросы. Ожидающих не больше max_queue, поэтому
+        потоки пула не заканчиваются. Отмена во время ожидания откладывается до его конца - место не теряется.
+        """
+        self._enqueue()
+        acquired = self._semaphore.acquire(blocking=False)
+        if not acquired:
+            metrics.increment(f"{self.name}.queued")
+            acquired = await anyio.to_thread.run_sync(partial(self._semaphore.acquire, timeout=self.queue_timeout))
+        self._dequeue(acquired)
+        try:
+            yield
+        finally:
+            self._release()
+
+
+class Metrics:
+    """Потокобезопасные счетчики отказов и очередей для эндпоинта метрик."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {}
+
+    def increment(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+
+metrics = Metrics()
+
+# --- Лимитеры процесса ---
+ip_limiter = TokenBucketLimiter(AUTH_IP_RATE, AUTH_IP_BURST)
+email_limiter = TokenBucketLimiter(AUTH_EMAIL_RATE, AUTH_EMAIL_BURST)
+login_email_window = SlidingWindowCounter(LOGIN_EMAIL_WINDOW_LIMIT, LOGIN_EMAIL_WINDOW_SECONDS)
+register_ip_window = SlidingWindowCounter(REGISTER_IP_WINDOW_LIMIT, REGISTER_IP_WINDOW_SECONDS)
+bcrypt_limiter = ConcurrencyLimiter("bcrypt", BCRYPT_MAX_CONCURRENT, BCRYPT_MAX_QUEUE, BCRYPT_QUEUE_TIMEOUT)
+
+
+def client_ip(request: Request) -> str:
+    """IP клиента. За прокси uvicorn нужно запускать с --proxy-headers, чтобы здесь был реальный адрес."""
+    return request.client.host if request.client else "unknown"
+
+
+def _too_many_requests(endpoint: str, limiter: str, retry_after: float):
+    metrics.increment(f"{endpoint}.rate_limited.{limiter}")
+    raise HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many requests, please try again later",
+        headers={"Retry-After": str(max(1, ceil(retry_after)))},
+    )
+
+
+def enforce_auth_rate_limit(request: Request, endpoint: str, email: Optional[str] = None):
+    """
+    Проверяет лимиты для эндпоинта аутентификации ДО дорогой работы (bcrypt, SMTP).
+    Выбрасывает HTTPException 429 с заголовком Retry-After, если лимит превышен.
+    """
+    ip = client_ip(request)
+    allowed, retry_after = ip_limiter.acquire(f"{endpoint}:{ip}")
+    if not allowed:
+        _too_many_requests(endpoint, "ip", retry_after)
+    if endpoint == "register":
+        allowed, retry_after = register_ip_window.hit(ip)
+        if not allowed:
+            _too_many_requests(endpoint, "ip_window", retry_after)
+    if email:
+        email = email.strip().lower()
+        allowed, retry_after = email_limiter.acquire(f"{endpoint}:{email}")
+        if not allowed:
+            _too_many_requests(endpoint, "email", retry_after)
+        if endpoint == "token":
+            allowed, retry_after = login_email_window.hit(email)
+            if not allowed:
+                _too_many_requests(endpoint, "email_window", retry_after)
+
+
+async def shed_load_if_saturated():
+    """
+    Зависимость FastAPI для дорогих эндпоинтов: если в очереди к пулу потоков уже много задач,
+    сразу отвечаем 503, не добавляя в очередь еще одну.
+    """
+    statistics = anyio.to_thread.current_default_thread_limiter().statistics()
+    if statistics.borrowed_tokens >= statistics.total_tokens and statistics.tasks_waiting >= THREADPOOL_MAX_WAITING:
+        metrics.increment("threadpool.rejected")
+        raise ServiceOverloaded("threadpool")
+
+
+def limiter_metrics() -> dict:
+    """Текущее состояние ограничителей и счетчики отказов."""
+    statistics = anyio.to_thread.current_default_thread_limiter().statistics()
+    return {
+        "counters": metrics.snapshot(),
+        "bcrypt": {
+            "active": bcrypt_limiter.active,
+            "waiting": bcrypt_limiter.waiting,
+            "max_concurrent": bcrypt_limiter.max_concurrent,
+            "max_queue": bcrypt_limiter.max_queue,
+        },
+        "threadpool": {
+            "busy": statistics.borrowed_tokens,
+            "total": statistics.total_tokens,
+            "waiting": statistics.tasks_waiting,
+        },
+    }
@@ -0,0 +1,165 @@
+# backend/reference_data.py
+
+import os
+import json
+import hashlib
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, insert
+from sqlalchemy.exc import IntegrityError
+
+from models import SessionLocal, District, Specialization
+
+logger = logging.getLogger(__name__)
+
+# --- Справочники: районы Ташкента и специализации врачей ---
+# Хранятся в таблицах districts и specializations (администратор может их менять),
+# а отдаются из копии в памяти процесса вместе с версией - хэшем содержимого.
+# Версия меняется только при изменении данных, поэтому клиент может кэшировать справочники надолго.
+
+# Начальное содержимое таблиц: записывается, если таблица пустая (первый запуск).
+# Координаты - приблизительные центры районов (широта, долгота); используются как место практики врача,
+# если он указал районы практики, но не координаты.
+SEED_DISTRICTS: List[Tuple[str, float, float]] = [
+    ("Алмазарский район", 41.3480, 69.2140),
+    ("Бектемирский район", 41.2090, 69.3340),
+    ("Мирабадский район", 41.2900, 69.2820),
+    ("Мирзо-Улугбекский район", 41.3350, 69.3350),
+    ("Сергелийский район", 41.2250, 69.2200),
+    ("Учтепинский район", 41.2950, 69.1700),
+    ("Чиланзарский район", 41.2750, 69.2050),
+    ("Шайхантаурский район", 41.3250, 69.2450),
+    ("Юнусабадский район", 41.3650, 69.2850),
+    ("Яккасарайский район", 41.2800, 69.2500),
+    ("Яшнабадский район", 41.3000, 69.3350),
+]
+
+# Специализация по умолчанию (например, для профиля врача, созданного после входа через Google)
+DEFAULT_SPECIALIZATION = "Общая практика"
+
+SEED_SPECIALIZATIONS: List[str] = [
+    DEFAULT_SPECIALIZATION,
+    "Терапевт",
+    "Педиатр",
+    "Хирург",
+    "Невролог",
+    "Кардиолог",
+    "Окулист",
+    "ЛОР",
+    "Стоматолог",
+    "Гинеколог",
+]
+
+# Как часто (в секундах) процесс проверяет таблицы справочников на изменения, сделанные другими воркерами.
+# В процессе, где администратор изменил справочник, новая версия применяется сразу (reload()).
+REFERENCE_RELOAD_SECONDS = float(os.getenv("REFERENCE_RELOAD_SECONDS", "30"))
+
+
+def _content_version(data) -> str:
+    """Версия справочника - короткий хэш его содержимого: меняется только при изменении данных."""
+    payload = json.dumps(data, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()[:16]
+
+
+class ReferenceSnapshot:
+    """Неизменяемая копия справочников. Подменяется целиком при перезагрузке."""
+
+    def __init__(self, districts: List[Tuple[str, Optional[float], Optional[float]]], specializations: List[str]):
+        self.districts = [name for name, _, _ in districts]
+        self.centroids: Dict[str, Tuple[float, float]] = {
+            name: (latitude, longitude) for name, latitude, longitude in districts
+            if latitude is not None and longitude is not None
+        }
+        self.specializations = list(specializations)
+        self.version = _content_version({"districts": districts, "specializations": self.specializations})
+
+
+class ReferenceCatalog:
+    """Справочники процесса: загружаются из БД при первом обращении и перечитываются раз в REFERENCE_RELOAD_SECONDS."""
+
+    def __init__(self, reload_seconds: float = REFERENCE_RELOAD_SECONDS):
+        self.reload_seconds = reload_seconds
+        self._snapshot: Optional[ReferenceSnapshot] = None
+        self._checked_at = 0.0
+        self._reload_lock = threading.Lock()
+
+    def _seed(self, db):
+        """Заполняет пустые таблицы начальными данными. Одновременный запуск в нескольких воркерах безопасен."""
+        try:
+            if db.execute(select(District.id).limit(1)).first() is None:
+                db.execute(insert(District), [
+                    {"name": name, "latitude": latitude, "longitude": longitude, "sort_order": index}
+                    for index, (name, latitude, longitude) in enumerate(SEED_DISTRICTS)
+                ])
+            if db.execute(select(Specialization.id).limit(1)).first() is None:
+                db.execute(insert(Specialization), [
+                    {"name": name, "sort_order": index} for index, name in enumerate(SEED_SPECIALIZATIONS)
+                ])
+            db.commit()
+        except IntegrityError:
+            # Другой воркер успел заполнить таблицы
+            db.rollback()
+
+    def reload(self) -> ReferenceSnapshot:
+        """Перечитывает справочники из БД (после изменений администратором - сразу)."""
+        with self._reload_lock:
+            self._checked_at = time.monotonic()
+            with SessionLocal() as db:
+                self._seed(db)
+                districts = db.execute(
+                    select(District.name, District.latitude, District.longitude).order_by(District.sort_order, District.name)
+                ).all()
+                specializations = db.execute(
+                    select(Specialization.name).order_by(Specialization.sort_order, Specialization.name)
+                ).scalars().all()
+            snapshot = ReferenceSnapshot([tuple(row) for row in districts], specializations)
+            if self._snapshot is None or snapshot.version != self._snapshot.version:
+                logger.info("Reference data loaded, version %s", snapshot.version)
+            self._snapshot = snapshot
+            return snapshot
+
+    def snapshot(self) -> ReferenceSnapshot:
+        """Текущая копия справочников. Если БД недоступна при первом обращении - начальные данные."""
+        if self._snapshot is None:
+            try:
+                return self.reload()
+            except Exception:
+                logger.exception("Failed to load reference data, serving seed data")
+                return ReferenceSnapshot(SEED_DISTRICTS, SEED_SPECIALIZATIONS)
+        if time.monotonic() - self._checked_at >= self.reload_seconds and not self._reload_lock.locked():
+            # Перечитывает один поток, остальные в это время отдают текущую копию
+            try:
+                self.reload()
+            except Exception:
+                logger.exception("Failed to reload reference data")
+        return self._snapshot
+
+
+# Общие справочники процесса
+reference_catalog = ReferenceCatalog()
+
+
+def get_reference_data() -> dict:
+    """Справочные данные для фронтенда вместе с их версией."""
+    snapshot = reference_catalog.snapshot()
+    return {"version": snapshot.version, "districts": snapshot.districts, "specializations": snapshot.specializations}
+
+
+def district_centroid(practice_areas: Optional[str], centroids: Optional[Dict[str, Tuple[float, float]]] = None) -> Optional[Tuple[float, float]]:
+    """
+    Центр первого известного района из строки районов практики (районы перечисляются через запятую).
+    centroids - центры районов по названию (по умолчанию из текущего справочника; миграции передают свои).
+    """
+    if centroids is None:
+        centroids = reference_catalog.snapshot().centroids
+    for area in (practice_areas or "").split(","):
+        area = area.strip().lower()
+        if len(area) < 4: # Слишком короткая строка совпала бы с несколькими районами
+            continue
+        for district, centroid in centroids.items():
+            if district.lower().startswith(area) or area.startswith(district.lower().split()[0]):
+                return centroid
+    return None
@@ -0,0 +1,150 @@
+# backend/refresh_tokens.py
+
+import os
+import hashlib
+import secrets
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.orm import Session
+
+from models import SessionLocal, User, RefreshToken
+
+logger = logging.getLogger(__name__)
+
+# --- Настройки refresh-токенов ---
+
+# Время жизни refresh-токена в днях. Access-токен живет ACCESS_TOKEN_EXPIRE_MINUTES и обновляется
+# через /token/refresh без повторного ввода пароля (и без bcrypt).
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+# Сколько просроченных токенов удаляется одной транзакцией при очистке
+REFRESH_TOKEN_SWEEP_BATCH_SIZE = int(os.getenv("REFRESH_TOKEN_SWEEP_BATCH_SIZE", "1000"))
+
+# Схема ротации:
+#  - клиент получает refresh-токен при входе, в БД хранится только его SHA-256 (токен случайный,
+#    256 бит энтропии, поэтому соль и медленный хэш не нужны - поиск идет по уникальному индексу);
+#  - каждое обновление помечает старый токен использованным и выдает новый из того же семейства (family_id);
+#  - повторное предъявление уже использованного токена означает, что токен украден:
+#    отзывается все семейство, и обе стороны должны войти заново.
+
+
+class RefreshTokenError(Exception):
+    """Refresh-токен невалиден, просрочен, отозван или использован повторно."""
+
+
+def hash_refresh_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def issue_refresh_token(db: Session, user_id: int, family_id: Optional[str] = None) -> str:
+    """
+    Создает refresh-токен пользователя и возвращает его исходное значение (в БД сохраняется только хэш).
+    Без family_id начинается новое семейство (новый вход). Выполняет commit.
+    """
+    token = secrets.token_urlsafe(32)
+    now = datetime.utcnow()
+    db.add(RefreshToken(
+        user_id=user_id,
+        token_hash=hash_refresh_token(token),
+        family_id=family_id or secrets.token_hex(16),
+        created_at=now,
+        expires_at=now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    ))
+    db.commit()
+    return token
+
+
+def revoke_family(db: Session, family_id: str) -> int:
+    """Отзывает все действующие токены семейства. Выполняет commit."""
+    result = db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.family_id == family_id)
+        .where(RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=datetime.utcnow())
+    )
+    db.commit()
+    return result.rowcount
+
+
+def rotate_refresh_token(db: Session, token: str) -> Tuple[User, str]:
+    """
+    Обменивает refresh-токен на новый из того же семейства.
+    Старый токен гасится условным UPDATE (revoked_at IS NULL), поэтому из двух одновременных
+    запросов с одним токеном успешен только один, а второй считается повторным использованием.
+
+    Returns:
+        (пользователь, новый refresh-токен)
+
+    Raises:
+        RefreshTokenError: Если токен не найден, просрочен, отозван или пользователь неактивен.
+    """
+    token_hash = hash_refresh_token(token)
+    now = datetime.utcnow()
+    stored = db.execute(
+        select(RefreshToken.id, RefreshToken.user_id, RefreshToken.family_id, RefreshToken.expires_at, RefreshToken.revoked_at)
+        .where(RefreshToken.token_hash == token_hash)
+    ).first()
+    if stored is None or stored.expires_at <= now:
+        raise RefreshTokenError("Invalid or expired refresh token")
+
+    consumed = db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.id == stored.id)
+        .where(RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=now)
+    ).rowcount == 1
+    if not consumed:
+        # Токен уже был использован: кто-то, кроме владельца, получил его копию
+        db.rollback()
+        revoked = revoke_family(db, stored.family_id)
+        logger.warning("Refresh token reuse detected for user %s, revoked %d tokens", stored.user_id, revoked)
+        raise RefreshTokenError("Refresh token has already been used")
+
+    user = db.get(User, stored.user_id)
+    if user is None or not user.is_active:
+        db.commit()
+        raise RefreshTokenError("User is inactive")
+    return user, issue_refresh_token(db, user.id, stored.family_id)
+
+
+def revoke_refresh_token(db: Session, token: str) -> bool:
+    """Выход из системы: отзывает семейство, к которому относится токен. Возвращает False, если токен не найден."""
+    family_id = db.execute(
+        select(RefreshToken.family_id).where(RefreshToken.token_hash == hash_refresh_token(token))
+    ).scalar()
+    if family_id is None:
+        return False
+    revoke_family(db, family_id)
+    return True
+
+
+def purge_expired_refresh_tokens(batch_size: int = REFRESH_TOKEN_SWEEP_BATCH_SIZE) -> int:
+    """
+    Удаляет просроченные refresh-токены пачками по batch_size: каждая пачка - отдельная короткая
+    транзакция по индексу expires_at, поэтому очистка не держит длинных блокировок.
+    Отозванные, но еще не просроченные токены сохраняются - они нужны для обнаружения повторного использования.
+
+    Returns:
+        int: Сколько токенов удалено.
+    """
+    deleted = 0
+    while True:
+        with SessionLocal() as db:
+            ids = db.execute(
+                select(RefreshToken.id)
+                .where(RefreshToken.expires_at < datetime.utcnow())
+                .order_by(RefreshToken.expires_at)
+                .limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                return deleted
+            db.execute(delete(RefreshToken).where(RefreshToken.id.in_(ids)))
+            db.commit()
+            deleted += len(ids)
+
+
+if __name__ == "__main__":
+    # Ручной запуск очистки: python refresh_tokens.py
+    print({"deleted": purge_expired_refresh_tokens()})
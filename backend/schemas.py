@@ -1,7 +1,10 @@
 # backend/schemas.py
 
-from pydantic import BaseModel, EmailStr, Field
-from typing import Optional, List # Добавляем List, может понадобиться позже для списков
+from pydantic import BaseModel, EmailStr, Field, field_validator, model_validator
+from typing import Optional, List, Dict, Literal # Добавляем List, может понадобиться позже для списков
+from datetime import datetime
+from uuid import UUID
+from working_hours import parse_time # Проверка шага рабочих часов
 
 
 # --- Pydantic модели для базовых пользователей и аутентификации ---
@@ -32,6 +35,11 @@ class UserResponse(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None # Для получения нового access-токена через /token/refresh без пароля
+
+# Модель запроса обновления токена и выхода
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
 
 
 # --- Pydantic модели для профилей Пациента и Врача ---
@@ -62,6 +70,24 @@ class PatientProfileResponse(BaseModel):
         from_attributes = True
 
 
+# Интервал рабочего времени врача внутри дня ("09:00" - "13:30", шаг 30 минут)
+class WorkingInterval(BaseModel):
+    start: str = Field(..., pattern=r"^\d{2}:\d{2}$")
+    end: str = Field(..., pattern=r"^\d{2}:\d{2}$")
+
+    @field_validator("end")
+    @classmethod
+    def check_interval(cls, end, info):
+        # Проверяем шаг и порядок времени так же, как это сделает кодирование в битовую маску
+        start = info.data.get("start")
+        if start is not None and parse_time(start) >= parse_time(end):
+            raise ValueError("start must be before end")
+        return end
+
+# Недельное расписание: ключ - день недели, значение - список рабочих интервалов
+WeeklySchedule = Dict[Literal["mon", "tue", "wed", "thu", "fri", "sat", "sun"], List[WorkingInterval]]
+
+
 # Модель для данных, приходящих при создании или обновлении профиля Врача
 class DoctorProfileCreateUpdate(BaseModel):
     full_name: Optional[str] = Field(None, max_length=255)
@@ -71,6 +97,16 @@ class DoctorProfileCreateUpdate(BaseModel):
     # Стоимость консультации, обязательна, должна быть больше 0
     cost_per_consultation: int = Field(..., gt=0) # gt=0 - greater than 0
     practice_areas: Optional[str] = Field(None, max_length=511)
+    working_hours: Optional[WeeklySchedule] = None # Рабочие часы по дням недели
+    # Координаты места практики. Если не указаны - берется центр первого района из practice_areas.
+    latitude: Optional[float] = Field(None, ge=-90, le=90)
+    longitude: Optional[float] = Field(None, ge=-180, le=180)
+
+    @model_validator(mode="after")
+    def check_coordinates_pair(self):
+        if (self.latitude is None) != (self.longitude is None):
+            raise ValueError("latitude and longitude must be provided together")
+        return self
     # Поле is_verified не включаем в модель для создания/обновления, т.к. его устанавливает Администратор
 
 
@@ -85,6 +121,9 @@ class DoctorProfileResponse(BaseModel):
     cost_per_consultation: int
     practice_areas: Optional[str] = None
     is_verified: bool # Статус верификации (возвращаем в ответе)
+    working_hours: WeeklySchedule = {} # Рабочие часы по дням недели
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
 
     # Настройка для работы с SQLAlchemy ORM
     class Config:
@@ -99,6 +138,10 @@ class DoctorFilter(BaseModel):
     practice_area: Optional[str] = None   # Район практики для фильтрации
     min_price: Optional[int] = None       # Минимальная стоимость консультации
     max_price: Optional[int] = None       # Максимальная стоимость консультации
+    open_now: Optional[bool] = None       # Только врачи, работающие сейчас
+    open_on: Optional[str] = None         # Только врачи, работающие в день недели (mon..sun) или дату (YYYY-MM-DD)
+    near: Optional[str] = None            # Точка "lat,lon" для поиска ближайших врачей
+    radius: Optional[float] = None        # Радиус поиска в километрах
 
 # Модель для краткой информации о враче (для списка)
 class DoctorBrief(BaseModel):
@@ -108,10 +151,18 @@ class DoctorBrief(BaseModel):
     specialization: str          # Специализация
     cost_per_consultation: int   # Стоимость консультации
     is_verified: bool            # Статус верификации
+    distance_km: Optional[float] = None  # Расстояние до точки near (только при поиске рядом)
 
     class Config:
         from_attributes = True
 
+# Подсказка при вводе в строке поиска врачей
+class DoctorSuggestion(BaseModel):
+    text: str                                      # Специализация или ФИО врача
+    kind: Literal["specialization", "name"]        # Что именно подсказывается
+    doctor_id: Optional[int] = None                # ID профиля, если ФИО принадлежит одному врачу
+    count: int                                     # Сколько врачей с такой специализацией/ФИО
+
 # Модель для подробной информации о враче (для детальной страницы)
 class DoctorDetail(DoctorProfileResponse):
     # Наследуем все поля из DoctorProfileResponse и при необходимости
@@ -122,6 +173,51 @@ class DoctorDetail(DoctorProfileResponse):
     class Config:
         from_attributes = True
 
+# Модель для пакетного запроса врачей по списку ID (POST /api/doctors/batch)
+class DoctorBatchRequest(BaseModel):
+    ids: List[int] = Field(..., min_length=1)
+
+# Модель ответа пакетного запроса
+class DoctorBatchResponse(BaseModel):
+    items: List[DoctorDetail]  # Найденные врачи в порядке запроса
+    missing: List[int]         # ID, для которых врач не найден
+
+# --- Pydantic модели для очереди верификации врачей (администратор) ---
+
+# Страница очереди непроверенных врачей. Следующая страница - GET с after=next_after.
+class DoctorVerificationQueueResponse(BaseModel):
+    items: List[DoctorBrief]
+    next_after: Optional[int] = None  # ID последнего врача на странице; None - страница последняя
+
+# Массовая верификация (is_verified=true) или отклонение/отзыв верификации (is_verified=false)
+class DoctorVerificationRequest(BaseModel):
+    doctor_ids: List[int] = Field(..., min_length=1, max_length=500)
+    is_verified: bool = True
+
+class DoctorVerificationResult(BaseModel):
+    updated: List[int]    # ID врачей, у которых статус изменился
+    unchanged: List[int]  # ID, у которых статус уже был таким, или несуществующие
+
+# Страница поиска пользователей (администратор). Следующая страница - GET с after=next_after.
+class UserSearchResponse(BaseModel):
+    items: List[UserResponse]
+    next_after: Optional[str] = None  # Email последнего пользователя на странице; None - страница последняя
+
+# --- Pydantic модели для ленты изменений каталога врачей (GET /api/doctors/changes) ---
+
+# Изменение врача: upsert - текущие краткие данные, delete - профиль удален (doctor = None)
+class DoctorChange(BaseModel):
+    seq: int                             # Позиция изменения в ленте
+    op: Literal["upsert", "delete"]
+    doctor_id: int
+    doctor: Optional[DoctorBrief] = None
+
+# Страница ленты. Следующий запрос - с since=next_since.
+class DoctorChangesResponse(BaseModel):
+    changes: List[DoctorChange]  # По возрастанию seq, не больше одного изменения на врача
+    next_since: int              # Курсор для следующего запроса
+    has_more: bool               # true - есть еще изменения, запросить сразу
+
 # Модель для списка врачей с пагинацией (для ответа API)
 class DoctorListResponse(BaseModel):
     items: List[DoctorBrief]       # Список врачей
@@ -130,10 +226,99 @@ class DoctorListResponse(BaseModel):
     size: int                      # Размер страницы (количество элементов на странице)
     pages: int                     # Общее количество страниц
 
+# --- Pydantic модели для стартовой загрузки сессии ---
+
+# Справочные данные с версией (клиент может кэшировать их по версии)
+class ReferenceDataResponse(BaseModel):
+    version: str                    # Хэш содержимого справочников
+    districts: List[str]            # Районы Ташкента
+    specializations: List[str] = [] # Специализации врачей
+
+# Добавление района в справочник (администратор)
+class DistrictCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=255)
+    latitude: Optional[float] = Field(None, ge=-90, le=90)
+    longitude: Optional[float] = Field(None, ge=-180, le=180)
+    sort_order: int = 0
+
+# Добавление специализации в справочник (администратор)
+class SpecializationCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=255)
+    sort_order: int = 0
+
+# Ответ /users/me/bootstrap: все, что нужно для первой отрисовки страницы
+class SessionBootstrapResponse(BaseModel):
+    user: UserResponse
+    profile: Optional[PatientProfileResponse | DoctorProfileResponse] = None  # Профиль по роли пользователя (None, если не заполнен)
+    reference: Optional[ReferenceDataResponse] = None  # None, если у клиента уже актуальная версия
+
+# --- Pydantic модели для консультаций и истории сообщений ---
+
+# Модель для создания консультации (пациент выбирает врача из каталога)
+class ConsultationCreate(BaseModel):
+    doctor_id: int # ID профиля врача (как в /api/doctors)
+
+# Модель для данных, возвращаемых о консультации
+class ConsultationResponse(BaseModel):
+    id: int
+    patient_id: int # ID пользователя-пациента
+    doctor_id: int # ID пользователя-врача
+    created_at: datetime
+    last_message_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+# Модель для отправки сообщения в чат консультации
+class MessageCreate(BaseModel):
+    content: str = Field(..., min_length=1, max_length=4000)
+    # Ключ идемпотентности: при повторе запроса (таймаут, обрыв связи) клиент отправляет тот же ключ,
+    # и сообщение не дублируется. Без ключа сервер генерирует его сам и возвращает в ответе
+    client_message_id: Optional[UUID] = None
+
+# Подтверждение записи сообщения (201) или приема без подтверждения записи (202)
+class MessageAccepted(BaseModel):
+    consultation_id: int
+    client_message_id: str
+    created_at: datetime
+
+# Модель сообщения в истории
+class MessageResponse(BaseModel):
+    id: int
+    consultation_id: int
+    sender_id: int
+    content: str
+    created_at: datetime
+    client_message_id: Optional[str] = None
+
+# Страница истории сообщений (пагинация назад по курсору before_id)
+class MessageHistoryResponse(BaseModel):
+    items: List[MessageResponse]          # Сообщения страницы от старых к новым
+    next_before_id: Optional[int] = None  # Курсор для следующей (более старой) страницы, None - история закончилась
+
+# --- Pydantic модели для расписания врача и бронирования ---
+
+# Интервал времени приема
+class SlotInterval(BaseModel):
+    start_at: datetime # Начало приема (если без часового пояса - считается UTC)
+    end_at: datetime   # Конец приема
+
+# Модель для публикации слотов врачом (одной пачкой)
+class SlotsCreate(BaseModel):
+    slots: List[SlotInterval] = Field(..., min_length=1, max_length=200)
+
+# Модель слота в ответах API (без данных пациента)
+class SlotResponse(BaseModel):
+    id: int
+    doctor_id: int   # ID профиля врача
+    start_at: datetime
+    end_at: datetime
+    is_booked: bool  # Забронирован ли слот
+    version: int     # Версия слота (для оптимистической блокировки при отмене)
+
+    class Config:
+        from_attributes = True
+
 # TODO: Добавить Pydantic модели для других сущностей:
-# class ConsultationCreate(BaseModel): ...
-# class ConsultationResponse(BaseModel): ...
-# class MessageCreate(BaseModel): ...
-# class MessageResponse(BaseModel): ...
 # class ReviewCreate(BaseModel): ...
 # class ReviewResponse(BaseModel): ...
\ No newline at end of file
@@ -0,0 +1,139 @@
+# backend/signing_keys.py
+
+import os
+import sys
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+from jose import jwk
+
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Ключи подписи JWT ---
+# Токены подписываются ES256 (ECDSA P-256) закрытым ключом из каталога JWT_KEYS_DIR.
+# Каждый ключ - файл <kid>.pem; kid попадает в заголовок токена, а открытые ключи публикуются
+# в /.well-known/jwks.json, поэтому другие сервисы проверяют токены сами, без обращения к этому API.
+# Если в каталоге нет ключей, используется прежняя подпись HS256 с SECRET_KEY.
+#
+# Ротация ключа без разлогинивания пользователей:
+#  1. python signing_keys.py generate - новый ключ появляется в JWKS, но подписывает по-прежнему старый
+#     (если задан JWT_ACTIVE_KID) либо сразу новый (активным считается самый свежий файл);
+#  2. старый файл удаляется не раньше, чем истекут выданные им токены (ACCESS_TOKEN_EXPIRE_MINUTES).
+JWT_KEYS_DIR = os.getenv("JWT_KEYS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "keys"))
+# kid ключа для подписи. Если не задан - самый новый ключ каталога.
+JWT_ACTIVE_KID = os.getenv("JWT_ACTIVE_KID")
+# Как часто (в секундах) проверять каталог ключей на изменения
+JWT_KEYS_RELOAD_SECONDS = float(os.getenv("JWT_KEYS_RELOAD_SECONDS", "30"))
+
+KEY_ALGORITHM = "ES256"
+
+
+class SigningKey:
+    """Ключ подписи: kid, закрытый ключ в PEM и открытый ключ для проверки и JWKS."""
+
+    def __init__(self, kid: str, private_pem: str, modified_at: float):
+        self.kid = kid
+        self.private_pem = private_pem
+        self.modified_at = modified_at
+        self.public_key = jwk.construct(private_pem, algorithm=KEY_ALGORITHM).public_key()
+
+    def to_jwk(self) -> dict:
+        return {**self.public_key.to_dict(), "kid": self.kid, "use": "sig"}
+
+
+class KeyRing:
+    """
+    Набор ключей процесса. Каталог перечитывается не чаще раза в JWT_KEYS_RELOAD_SECONDS
+    и только при изменении его mtime; токен с незнакомым kid вызывает внеочередную проверку,
+    поэтому новый ключ, добавленный на другом сервере, подхватывается сразу.
+    """
+
+    def __init__(self, directory: str = JWT_KEYS_DIR, active_kid: Optional[str] = JWT_ACTIVE_KID):
+        self.directory = directory
+        self.active_kid = active_kid
+        self._keys: Dict[str, SigningKey] = {}
+        self._directory_mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self, force: bool = False):
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                mtime = os.stat(self.directory).st_mtime
+            except FileNotFoundError:
+                self._keys, self._directory_mtime = {}, None
+                return
+            if not force and mtime == self._directory_mtime:
+                return
+            keys = {}
+            for name in sorted(os.listdir(self.directory)):
+                if not name.endswith(".pem"):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    with open(path) as f:
+                        keys[name[:-4]] = SigningKey(name[:-4], f.read(), os.path.getmtime(path))
+                except Exception:
+                    logger.exception("Failed to load JWT signing key %s", path)
+            self._keys, self._directory_mtime = keys, mtime
+
+    def _maybe_reload(self):
+        if time.monotonic() - self._checked_at >= JWT_KEYS_RELOAD_SECONDS:
+            self.reload()
+
+    def signing_key(self) -> Optional[SigningKey]:
+        """Ключ для подписи новых токенов или None, если ключей нет (подпись HS256)."""
+        self._maybe_reload()
+        keys = self._keys
+        if not keys:
+            return None
+        if self.active_kid and self.active_kid in keys:
+            return keys[self.active_kid]
+        return max(keys.values(), key=lambda key: (key.modified_at, key.kid))
+
+    def verification_key(self, kid: str) -> Optional[SigningKey]:
+        """Ключ для проверки токена по kid из его заголовка."""
+        self._maybe_reload()
+        key = self._keys.get(kid)
+        if key is None and time.monotonic() - self._checked_at >= 1:
+            # Незнакомый kid: возможно, ключ только что добавлен. Перечитываем каталог не чаще раза в секунду.
+            self.reload()
+            key = self._keys.get(kid)
+        return key
+
+    def jwks(self) -> dict:
+        """Открытые ключи в формате JWK Set (RFC 7517)."""
+        self._maybe_reload()
+        return {"keys": [key.to_jwk() for key in self._keys.values()]}
+
+
+keyring = KeyRing()
+
+
+def generate_key(directory: str = JWT_KEYS_DIR) -> str:
+    """Создает новый ключ ES256 в каталоге ключей и возвращает его kid."""
+    from ecdsa import SigningKey as EcdsaSigningKey, NIST256p
+    os.makedirs(directory, exist_ok=True)
+    kid = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+    path = os.path.join(directory, f"{kid}.pem")
+    # Закрытый ключ доступен только владельцу файла
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(descriptor, "wb") as f:
+        f.write(EcdsaSigningKey.generate(curve=NIST256p).to_pem())
+    return kid
+
+
+if __name__ == "__main__":
+    # Создание нового ключа: python signing_keys.py generate
+    if sys.argv[1:] == ["generate"]:
+        print(generate_key())
+    else:
+        print("Usage: python signing_keys.py generate")
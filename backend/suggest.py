@@ -0,0 +1,200 @@
+# backend/suggest.py
+
+import os
+import time
+import logging
+import threading
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from models import SessionLocal, DoctorProfile
+
+logger = logging.getLogger(__name__)
+
+# --- Подсказки при вводе (typeahead) для имен врачей и специализаций ---
+# Индекс - два отсортированных массива нормализованных ключей (для имен и для специализаций).
+# Поиск по префиксу - bisect до первого подходящего ключа и чтение подряд идущих ключей,
+# без обращения к БД. Имя индексируется по каждому слову, поэтому "иван" находит "Петров Иван".
+
+# Как часто (в секундах) индекс перестраивается из БД, чтобы подхватить изменения, сделанные другими воркерами.
+# Изменения в текущем процессе применяются к индексу сразу (update_doctor).
+SUGGEST_REFRESH_SECONDS = float(os.getenv("SUGGEST_REFRESH_SECONDS", "60"))
+SUGGEST_MAX_LIMIT = 20
+
+KIND_SPECIALIZATION = "specialization"
+KIND_NAME = "name"
+
+
+def normalize(text: str) -> str:
+    """Ключ для сравнения: casefold (кириллица и латиница) и е вместо ё."""
+    return " ".join(text.casefold().replace("ё", "е").split())
+
+
+def _keys(kind: str, text: str) -> List[str]:
+    """Ключи индекса для текста: вся строка и (для имен) строка с каждого следующего слова."""
+    words = normalize(text).split(" ")
+    if kind == KIND_SPECIALIZATION:
+        return [" ".join(words)] if words[0] else []
+    return [" ".join(words[i:]) for i in range(len(words)) if words[i]]
+
+
+class _SortedKeys:
+    """
+    Отсортированный массив записей (ключ, текст) со счетчиком ссылок:
+    одна специализация у тысячи врачей - одна запись, а не тысяча.
+    """
+
+    def __init__(self):
+        self.entries: List[Tuple[str, str]] = []
+        self.refs: Dict[Tuple[str, str], int] = {}
+
+    def add(self, key: str, text: str, bulk: bool = False):
+        entry = (key, text)
+        count = self.refs.get(entry, 0)
+        if count == 0 and not bulk:
+            insort(self.entries, entry)
+        self.refs[entry] = count + 1
+
+    def finish_bulk(self):
+        """После загрузки с bulk=True: одна сортировка вместо вставки каждого ключа по месту."""
+        self.entries = sorted(self.refs)
+
+    def remove(self, key: str, text: str):
+        entry = (key, text)
+        count = self.refs.get(entry, 0)
+        if count <= 1:
+            self.refs.pop(entry, None)
+            index = bisect_left(self.entries, entry)
+            if index < len(self.entries) and self.entries[index] == entry:
+                del self.entries[index]
+        else:
+            self.refs[entry] = count - 1
+
+    def search(self, prefix: str, limit: int) -> List[Tuple[str, int]]:
+        """До limit разных текстов, у которых есть ключ с префиксом prefix: [(текст, число врачей)]."""
+        found: Dict[str, int] = {}
+        index = bisect_left(self.entries, (prefix,))
+        while index < len(self.entries) and len(found) < limit:
+            key, text = self.entries[index]
+            if not key.startswith(prefix):
+                break
+            found.setdefault(text, self.refs[(key, text)])
+            index += 1
+        return list(found.items())
+
+
+class DoctorSuggestionIndex:
+    """Индекс подсказок процесса. Потокобезопасен; перестраивается в фоне, старый индекс продолжает отвечать."""
+
+    def __init__(self, refresh_seconds: float = SUGGEST_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._specializations = _SortedKeys()
+        self._names = _SortedKeys()
+        # Текущие значения врачей (id -> (имя, специализация)) - чтобы при изменении убрать старые ключи
+        self._doctors: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+        self._name_doctors: Dict[str, set] = {}
+        self._built_at: Optional[float] = None
+        self._rebuilding = False
+
+    def _add(self, doctor_id: int, full_name: Optional[str], specialization: Optional[str], bulk: bool = False):
+        self._doctors[doctor_id] = (full_name, specialization)
+        if specialization:
+            for key in _keys(KIND_SPECIALIZATION, specialization):
+                self._specializations.add(key, specialization, bulk)
+        if full_name:
+            for key in _keys(KIND_NAME, full_name):
+                self._names.add(key, full_name, bulk)
+            self._name_doctors.setdefault(full_name, set()).add(doctor_id)
+
+    def _remove(self, doctor_id: int):
+        full_name, specialization = self._doctors.pop(doctor_id, (None, None))
+        if specialization:
+            for key in _keys(KIND_SPECIALIZATION, specialization):
+                self._specializations.remove(key, specialization)
+        if full_name:
+            for key in _keys(KIND_NAME, full_name):
+                self._names.remove(key, full_name)
+            doctor_ids = self._name_doctors.get(full_name)
+            if doctor_ids is not None:
+                doctor_ids.discard(doctor_id)
+                if not doctor_ids:
+                    del self._name_doctors[full_name]
+
+    def update_doctor(self, doctor_id: int, full_name: Optional[str], specialization: Optional[str]):
+        """Применяет изменение профиля врача к индексу (вызывается после записи профиля)."""
+        with self._lock:
+            if self._built_at is None:
+                return # Индекс еще не построен - изменение попадет в него при построении
+            if self._doctors.get(doctor_id) == (full_name, specialization):
+                return
+            self._remove(doctor_id)
+            self._add(doctor_id, full_name, specialization)
+
+    def remove_doctor(self, doctor_id: int):
+        with self._lock:
+            self._remove(doctor_id)
+
+    def rebuild(self):
+        """Полностью перестраивает индекс из БД. Новый индекс собирается отдельно и подменяет старый целиком."""
+        fresh = DoctorSuggestionIndex(self.refresh_seconds)
+        with SessionLocal() as db:
+            rows = db.execute(select(DoctorProfile.id, DoctorProfile.full_name, DoctorProfile.specialization)).all()
+        for row in rows:
+            fresh._add(row.id, row.full_name, row.specialization, bulk=True)
+        fresh._specializations.finish_bulk()
+        fresh._names.finish_bulk()
+        with self._lock:
+            self._specializations, self._names = fresh._specializations, fresh._names
+            self._doctors, self._name_doctors = fresh._doctors, fresh._name_doctors
+            self._built_at = time.monotonic()
+            self._rebuilding = False
+
+    def _background_rebuild(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception("Failed to rebuild doctor suggestion index")
+            with self._lock:
+                self._rebuilding = False
+
+    def _ensure_fresh(self):
+        if self._built_at is None:
+            # Первый запрос процесса строит индекс синхронно
+            self.rebuild()
+            return
+        with self._lock:
+            if self._rebuilding or time.monotonic() - self._built_at < self.refresh_seconds:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._background_rebuild, name="doctor-suggest-rebuild", daemon=True).start()
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[dict]:
+        """
+        Подсказки для префикса: сначала специализации, затем имена врачей.
+        Для имени, которое носит один врач, возвращается его doctor_id.
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        self._ensure_fresh()
+        with self._lock:
+            suggestions = [
+                {"text": text, "kind": KIND_SPECIALIZATION, "doctor_id": None, "count": count}
+                for text, count in self._specializations.search(prefix, limit)
+            ]
+            for text, _ in self._names.search(prefix, limit - len(suggestions)):
+                doctor_ids = self._name_doctors.get(text, ())
+                suggestions.append({
+                    "text": text,
+                    "kind": KIND_NAME,
+                    "doctor_id": next(iter(doctor_ids)) if len(doctor_ids) == 1 else None,
+                    "count": len(doctor_ids),
+                })
+        return suggestions
+
+
+# Общий индекс процесса
+doctor_suggestions = DoctorSuggestionIndex()
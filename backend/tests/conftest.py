@@ -0,0 +1,25 @@
+# backend/tests/conftest.py
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Модули backend импортируются как в приложении (from models import ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Тесты не обращаются к рабочей БД: модели импортируются с временной SQLite. Файл, а не память:
+# фоновые потоки (буфер записи сообщений) работают со своими соединениями и должны видеть те же таблицы
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='backend-tests-'), 'test.db')}")
+
+
+@pytest.fixture
+def app_db():
+    """Сессия БД приложения (models.engine) с пустыми таблицами - своими для каждого теста."""
+    from models import Base, SessionLocal, engine
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    with SessionLocal() as session:
+        yield session
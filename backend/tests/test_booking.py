@@ -0,0 +1,96 @@
+# backend/tests/test_booking.py
+
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import DoctorSlot, SessionLocal
+from booking import book_slot, cancel_booking, find_overlapping_slots, validate_intervals, SlotConflictError
+
+# --- Бронирование слотов (booking.py) ---
+# Бронь - условный UPDATE (compare-and-set по patient_id IS NULL): из одновременных запросов на один слот
+# успешен ровно один, остальные получают False, а не перезаписывают чужую бронь.
+
+DOCTOR_ID = 1
+
+
+def _add_slot(db, start: datetime, minutes: int = 30) -> int:
+    slot = DoctorSlot(doctor_id=DOCTOR_ID, start_at=start, end_at=start + timedelta(minutes=minutes))
+    db.add(slot)
+    db.commit()
+    return slot.id
+
+
+@pytest.fixture
+def slot_id(app_db):
+    return _add_slot(app_db, datetime.utcnow() + timedelta(days=1))
+
+
+def test_second_booking_of_same_slot_is_rejected(app_db, slot_id):
+    assert book_slot(app_db, slot_id, patient_id=10) is True
+    assert book_slot(app_db, slot_id, patient_id=11) is False
+
+    slot = app_db.get(DoctorSlot, slot_id)
+    app_db.refresh(slot)
+    assert slot.patient_id == 10
+    assert slot.version == 1
+
+
+def test_concurrent_bookings_have_single_winner(app_db, slot_id):
+    patients = list(range(100, 108))
+    results = {}
+    barrier = threading.Barrier(len(patients))
+
+    def book(patient_id):
+        with SessionLocal() as db:
+            barrier.wait()
+            results[patient_id] = book_slot(db, slot_id, patient_id)
+
+    threads = [threading.Thread(target=book, args=(patient_id,)) for patient_id in patients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    winners = [patient_id for patient_id, booked in results.items() if booked]
+    assert len(winners) == 1
+    slot = app_db.get(DoctorSlot, slot_id)
+    assert slot.patient_id == winners[0]
+    assert slot.version == 1
+
+
+def test_past_slot_cannot_be_booked(app_db):
+    past_slot_id = _add_slot(app_db, datetime.utcnow() - timedelta(hours=1))
+    assert book_slot(app_db, past_slot_id, patient_id=10) is False
+
+
+def test_cancel_checks_patient_and_version(app_db, slot_id):
+    assert book_slot(app_db, slot_id, patient_id=10) is True
+
+    # Чужая бронь и устаревшая версия не отменяются
+    assert cancel_booking(app_db, slot_id, patient_id=11) is False
+    assert cancel_booking(app_db, slot_id, patient_id=10, expected_version=0) is False
+
+    assert cancel_booking(app_db, slot_id, patient_id=10, expected_version=1) is True
+    # Освобожденный слот снова можно забронировать
+    assert book_slot(app_db, slot_id, patient_id=11) is True
+    slot = app_db.get(DoctorSlot, slot_id)
+    app_db.refresh(slot)
+    assert (slot.patient_id, slot.version) == (11, 3)
+
+
+def test_overlapping_slots(app_db):
+    start = datetime.utcnow().replace(microsecond=0) + timedelta(days=2)
+    existing = _add_slot(app_db, start, minutes=60)
+
+    overlapping = find_overlapping_slots(app_db, DOCTOR_ID, start + timedelta(minutes=30), start + timedelta(minutes=90))
+    assert [slot.id for slot in overlapping] == [existing]
+    # Интервал, начинающийся в момент окончания слота, не пересекается с ним
+    assert find_overlapping_slots(app_db, DOCTOR_ID, start + timedelta(minutes=60), start + timedelta(minutes=90)) == []
+
+    with pytest.raises(SlotConflictError):
+        validate_intervals([
+            (start, start + timedelta(minutes=30)),
+            (start + timedelta(minutes=20), start + timedelta(minutes=50)),
+        ])
@@ -0,0 +1,110 @@
+# backend/tests/test_change_feed.py
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert
+
+from models import DoctorProfile, DoctorProfileChange
+from change_feed import ChangeFeedExpired, DOCTOR_CHANGES_RETENTION_DAYS, current_position, read_doctor_changes
+from doctor_catalog import CATALOG_CHANGE_GRACE_SECONDS
+from maintenance import purge_doctor_changes
+
+# --- Лента изменений каталога врачей (change_feed.read_doctor_changes) ---
+# Курсор next_since не проходит строки моложе CATALOG_CHANGE_GRACE_SECONDS: строка с меньшим id может
+# стать видимой позже. Курсор старше журнала (строки удалены очисткой) - ошибка, потребитель загружает каталог заново.
+
+OLD = timedelta(seconds=CATALOG_CHANGE_GRACE_SECONDS + 60)
+
+
+@pytest.fixture
+def doctors(app_db):
+    app_db.execute(insert(DoctorProfile), [
+        {"user_id": doctor_id, "full_name": f"Врач {doctor_id}", "specialization": "Терапевт", "cost_per_consultation": 100}
+        for doctor_id in (1, 2, 3)
+    ])
+    app_db.commit()
+    return [doctor.id for doctor in app_db.query(DoctorProfile).order_by(DoctorProfile.id)]
+
+
+def _record(db, changes) -> list:
+    """changes - [(doctor_id, возраст строки)]; возвращает seq добавленных строк."""
+    now = datetime.utcnow()
+    seqs = []
+    for doctor_id, age in changes:
+        result = db.execute(insert(DoctorProfileChange).values(doctor_id=doctor_id, operation="upsert", changed_at=now - age))
+        seqs.append(result.inserted_primary_key[0])
+    db.commit()
+    return seqs
+
+
+def test_cursor_stops_before_young_rows(app_db, doctors):
+    first, second, young = _record(app_db, [(doctors[0], OLD), (doctors[1], OLD), (doctors[2], timedelta(0))])
+
+    page = read_doctor_changes(app_db, since=0, limit=10)
+
+    # Молодая строка уже отдается, но курсор останавливается перед ней - следующий ответ вернет ее снова
+    assert [change["seq"] for change in page["changes"]] == [first, second, young]
+    assert page["next_since"] == second
+    assert page["has_more"] is False
+    assert [change["seq"] for change in read_doctor_changes(app_db, since=page["next_since"], limit=10)["changes"]] == [young]
+
+
+def test_cursor_does_not_pass_young_row_on_full_page(app_db, doctors):
+    first, young, _ = _record(app_db, [(doctors[0], OLD), (doctors[1], timedelta(0)), (doctors[2], OLD)])
+
+    page = read_doctor_changes(app_db, since=0, limit=3)
+
+    assert page["next_since"] == first
+    # Страница полная, но курсор остановился на молодой строке - повторять запрос сразу бессмысленно
+    assert page["has_more"] is False
+
+
+def test_pages_of_old_rows(app_db, doctors):
+    seqs = _record(app_db, [(doctors[0], OLD), (doctors[1], OLD), (doctors[2], OLD)])
+
+    page = read_doctor_changes(app_db, since=0, limit=2)
+    assert (page["next_since"], page["has_more"]) == (seqs[1], True)
+
+    page = read_doctor_changes(app_db, since=page["next_since"], limit=2)
+    assert (page["next_since"], page["has_more"]) == (seqs[2], False)
+    assert current_position(app_db) == seqs[2]
+
+
+def test_changes_of_one_doctor_collapse_and_deleted_doctor(app_db, doctors):
+    deleted_doctor_id = doctors[-1] + 1  # Профиля нет - в ленте это удаление
+    seqs = _record(app_db, [(doctors[0], OLD), (deleted_doctor_id, OLD), (doctors[0], OLD)])
+
+    changes = read_doctor_changes(app_db, since=0, limit=10)["changes"]
+
+    assert [(change["seq"], change["op"], change["doctor_id"]) for change in changes] == [
+        (seqs[1], "delete", deleted_doctor_id),
+        (seqs[2], "upsert", doctors[0]),
+    ]
+    assert changes[1]["doctor"]["full_name"] == "Врач 1"
+
+
+def test_expired_cursor(app_db, doctors):
+    expired = timedelta(days=DOCTOR_CHANGES_RETENTION_DAYS + 1)
+    seqs = _record(app_db, [(doctors[0], expired), (doctors[1], expired), (doctors[2], OLD)])
+
+    assert purge_doctor_changes() == 2
+
+    with pytest.raises(ChangeFeedExpired):
+        read_doctor_changes(app_db, since=seqs[0], limit=10)
+    # Курсор сразу перед самой старой оставшейся строкой еще действителен
+    page = read_doctor_changes(app_db, since=seqs[1], limit=10)
+    assert [change["seq"] for change in page["changes"]] == [seqs[2]]
+
+
+def test_purge_keeps_newest_row(app_db, doctors):
+    expired = timedelta(days=DOCTOR_CHANGES_RETENTION_DAYS + 1)
+    seqs = _record(app_db, [(doctors[0], expired), (doctors[1], expired)])
+
+    assert purge_doctor_changes() == 1
+
+    # Журнал не пуст: потребитель на последней позиции не получает ошибку
+    page = read_doctor_changes(app_db, since=seqs[1], limit=10)
+    assert (page["changes"], page["next_since"]) == ([], seqs[1])
+    with pytest.raises(ChangeFeedExpired):
+        read_doctor_changes(app_db, since=0, limit=10)
@@ -0,0 +1,85 @@
+# backend/tests/test_chat.py
+
+import uuid
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, select
+
+from models import Message
+from chat import MessageWriteBuffer, _PendingMessage, fetch_history
+
+# --- Идемпотентная запись сообщений (chat.MessageWriteBuffer) ---
+# Клиент повторяет POST сообщения с тем же client_message_id (например, после ответа 202 по таймауту).
+# Повтор не создает второе сообщение и получает время создания уже записанного.
+
+CONSULTATION_ID = 1
+SENDER_ID = 1
+
+
+@pytest.fixture
+def buffer(app_db):
+    buffer = MessageWriteBuffer(batch_size=10, flush_interval_ms=1)
+    yield buffer
+    buffer.close()
+
+
+def _pending(content: str, client_message_id: str, consultation_id: int = CONSULTATION_ID) -> _PendingMessage:
+    # Значения - как в MessageWriteBuffer.append; created_at у каждой попытки свое
+    return _PendingMessage({
+        "consultation_id": consultation_id,
+        "sender_id": SENDER_ID,
+        "content": content,
+        "created_at": datetime.utcnow(),
+        "client_message_id": client_message_id,
+    })
+
+
+def _message_count(db) -> int:
+    return db.execute(select(func.count()).select_from(Message)).scalar()
+
+
+def test_retry_with_same_key_returns_original_created_at(app_db, buffer):
+    key = str(uuid.uuid4())
+
+    created_at = buffer.append(CONSULTATION_ID, SENDER_ID, "Здравствуйте", key)
+    retried_at = buffer.append(CONSULTATION_ID, SENDER_ID, "Здравствуйте", key)
+
+    assert retried_at == created_at
+    assert _message_count(app_db) == 1
+    messages, _ = fetch_history(app_db, CONSULTATION_ID, None, 10)
+    assert [(message["content"], message["client_message_id"]) for message in messages] == [("Здравствуйте", key)]
+
+
+def test_duplicate_key_inside_one_batch_is_written_once(app_db, buffer):
+    key = str(uuid.uuid4())
+    first, retry, other = _pending("a", key), _pending("a", key), _pending("b", str(uuid.uuid4()))
+
+    buffer._flush([first, retry, other])
+
+    assert all(item.done.is_set() and item.error is None for item in (first, retry, other))
+    assert retry.values["created_at"] == first.values["created_at"]
+    assert _message_count(app_db) == 2
+
+
+def test_retry_in_later_batch_with_new_messages(app_db, buffer):
+    key = str(uuid.uuid4())
+    earlier = _pending("a", key)
+    buffer._flush([earlier])
+
+    # Повтор попал в пачку с новыми сообщениями: записываются только новые
+    retry, other = _pending("a", key), _pending("b", str(uuid.uuid4()))
+    buffer._flush([retry, other])
+
+    assert retry.error is None and other.error is None
+    assert retry.values["created_at"] == earlier.values["created_at"]
+    assert _message_count(app_db) == 2
+
+
+def test_same_key_in_other_consultation_is_separate_message(app_db, buffer):
+    key = str(uuid.uuid4())
+
+    buffer.append(CONSULTATION_ID, SENDER_ID, "a", key)
+    buffer.append(CONSULTATION_ID + 1, SENDER_ID, "a", key)
+
+    assert _message_count(app_db) == 2
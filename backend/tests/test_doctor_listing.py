@@ -0,0 +1,53 @@
+# backend/tests/test_doctor_listing.py
+
+import pytest
+from sqlalchemy import insert
+
+from models import DoctorProfile
+from doctor_queries import build_doctor_query
+from doctor_catalog import ColumnarDoctorCatalog
+
+# --- Результаты фильтра по специализации (GET /api/doctors) ---
+# Специализация врача - свободный текст, поэтому фильтр - поиск подстроки: врач "Терапевт, кардиолог"
+# находится и по "Терапевт", даже если "Терапевт" есть в справочнике. SQL-путь и колоночный каталог
+# (CATALOG_ENGINE=columnar) должны возвращать одних и тех же врачей.
+
+DOCTORS = [
+    ("Терапевт", 300),
+    ("Терапевт, кардиолог", 500),
+    ("Кардиолог", 400),
+    ("Невролог", 200),
+]
+
+
+@pytest.fixture
+def doctors(app_db):
+    app_db.execute(insert(DoctorProfile), [
+        {"user_id": index + 1, "full_name": f"Врач {index}", "specialization": specialization, "cost_per_consultation": cost}
+        for index, (specialization, cost) in enumerate(DOCTORS)
+    ])
+    app_db.commit()
+    return {doctor.specialization: doctor.id for doctor in app_db.query(DoctorProfile).all()}
+
+
+@pytest.mark.parametrize("specialization, expected", [
+    ("Терапевт", ["Терапевт", "Терапевт, кардиолог"]),
+    ("Невролог", ["Невролог"]),
+    ("Хирург", []),
+])
+def test_specialization_filter_matches_substring(app_db, doctors, specialization, expected):
+    expected_ids = [doctors[name] for name in expected]
+
+    query = build_doctor_query(app_db, specialization=specialization)
+    assert [doctor.id for doctor in query.all()] == expected_ids
+
+    assert ColumnarDoctorCatalog().search(specialization=specialization) == expected_ids
+
+
+def test_specialization_filter_with_price_and_sort(app_db, doctors):
+    expected_ids = [doctors["Терапевт, кардиолог"], doctors["Терапевт"]]
+
+    query = build_doctor_query(app_db, specialization="Терапевт", min_price=250, sort="-price")
+    assert [doctor.id for doctor in query.all()] == expected_ids
+
+    assert ColumnarDoctorCatalog().search(specialization="Терапевт", min_price=250, sort="-price") == expected_ids
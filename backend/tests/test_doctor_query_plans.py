@@ -0,0 +1,116 @@
+# backend/tests/test_doctor_query_plans.py
+
+import itertools
+import random
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session
+
+from models import Base, DoctorProfile
+from doctor_queries import DOCTOR_SORTS, build_doctor_query, count_doctors
+from geo import location_values
+from working_hours import encode_week
+
+# --- Планы запросов списка врачей (GET /api/doctors) ---
+# Для каждой комбинации фильтров и сортировки выполняются те же запросы, что и в эндпоинте (страница и count),
+# и для каждого проверяется EXPLAIN QUERY PLAN SQLite: таблица doctor_profiles не должна читаться целиком.
+# Count не должен обходить ни таблицу, ни индекс целиком (только SEARCH); страница с LIMIT может идти
+# по индексу сортировки, но не обходом самой таблицы ("SCAN doctor_profiles" без индекса). Схема - из models.py, со статистикой (ANALYZE)
+# на правдоподобных данных, иначе планировщик выбирает индексы наугад.
+
+SPECIALIZATIONS = [f"Специализация {i}" for i in range(20)]
+DISTRICTS = ["Чиланзарский район", "Юнусабадский район", "Мирзо-Улугбекский район", "Яккасарайский район"]
+DOCTORS = 3000
+
+SPECIALIZATION_FILTERS = {
+    None: {},
+    "specialization": {"specialization": "ализация 1"},  # Поиск подстроки
+}
+FLAG_FILTERS = {
+    "practice_area": {"practice_area": "Юнусабад"},
+    "min_price": {"min_price": 700},
+    "max_price": {"max_price": 150},
+    "open_on": {"open_on": 6},
+    "open_now": {"open_now": True},
+    "near": {"point": (41.31, 69.28), "radius": 2.0},
+}
+# Фильтры поиска подстроки (ILIKE '%...%') индекс использовать не могут: если кроме них отбора нет,
+# чтение всей таблицы ожидаемо (strict xfail - тест заметит, если это когда-нибудь изменится)
+SUBSTRING_FILTERS = {"specialization", "practice_area"}
+
+
+def _combinations():
+    for specialization in SPECIALIZATION_FILTERS:
+        for size in range(len(FLAG_FILTERS) + 1):
+            for flags in itertools.combinations(FLAG_FILTERS, size):
+                for sort in [None, *DOCTOR_SORTS]:
+                    names = ([specialization] if specialization else []) + list(flags)
+                    marks = []
+                    if names and set(names) <= SUBSTRING_FILTERS:
+                        marks.append(pytest.mark.xfail(strict=True, reason="substring search cannot use an index"))
+                    yield pytest.param(specialization, flags, sort, id=f"{'+'.join(names) or 'all'}/sort={sort}", marks=marks)
+
+
+@pytest.fixture(scope="module")
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    rng = random.Random(42)
+    rows = []
+    for i in range(DOCTORS):
+        days = rng.sample(["mon", "tue", "wed", "thu", "fri", "sat", "sun"], rng.randint(0, 6))
+        rows.append({
+            "user_id": i + 1,
+            "full_name": f"Врач {rng.randint(0, 10 ** 6):07d}",
+            "specialization": rng.choice(SPECIALIZATIONS),
+            "cost_per_consultation": rng.randint(50, 1000),
+            "practice_areas": rng.choice(DISTRICTS),
+            "is_verified": rng.random() < 0.8,
+            **encode_week({day: [{"start": "09:00", "end": "18:00"}] for day in days}),
+            **location_values(41.2 + rng.random() * 0.2, 69.1 + rng.random() * 0.3),
+        })
+    with engine.begin() as connection:
+        connection.execute(DoctorProfile.__table__.insert(), rows)
+        connection.execute(text("ANALYZE"))
+    with Session(engine) as session:
+        yield session
+    engine.dispose()
+
+
+def _capture_statements(db: Session, run) -> list:
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    engine = db.get_bind()
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        run()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+@pytest.mark.parametrize("specialization, flags, sort", list(_combinations()))
+def test_doctor_list_query_uses_index(db, specialization, flags, sort):
+    filters = dict(SPECIALIZATION_FILTERS[specialization])
+    for flag in flags:
+        filters.update(FLAG_FILTERS[flag])
+    query = build_doctor_query(db, sort=sort, **filters)
+
+    # Те же запросы, что выполняет эндпоинт: общее число и первая страница
+    statements = _capture_statements(db, lambda: (count_doctors(query), query.offset(0).limit(10).all()))
+    assert len(statements) == 2
+
+    for statement, parameters in statements:
+        plan = [row[3] for row in db.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+        if "WHERE" not in statement:
+            # Без фильтров результат - вся таблица: страница читается по первичному ключу до LIMIT
+            continue
+        scans = [line for line in plan if line.startswith("SCAN doctor_profiles")]
+        if "LIMIT" in statement:
+            # Страница может читаться обходом индекса сортировки до LIMIT, но не обходом самой таблицы
+            scans = [line for line in scans if line == "SCAN doctor_profiles"]
+        assert not scans, f"full table scan:\n{statement}\n{plan}"
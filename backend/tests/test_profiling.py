@@ -0,0 +1,57 @@
+# backend/tests/test_profiling.py
+
+import time
+
+import anyio
+
+import profiling
+from profiling import SamplingProfilerMiddleware
+
+# --- Сохранение профиля запроса (profiling.SamplingProfilerMiddleware) ---
+# Остановка сэмплера и запись файла выполняются в потоке пула: пока профиль пишется на диск,
+# цикл событий продолжает обслуживать другие запросы воркера.
+
+SAVE_SECONDS = 0.3
+
+
+async def _app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def test_profile_is_saved_off_the_event_loop(monkeypatch, tmp_path):
+    saved = []
+
+    def slow_save(profile, scope, directory=str(tmp_path)):
+        time.sleep(SAVE_SECONDS)  # Медленный диск
+        saved.append(scope["path"])
+        return None
+
+    monkeypatch.setattr(profiling, "save_profile", slow_save)
+    middleware = SamplingProfilerMiddleware(_app, sample_rate=1.0)
+    scope = {"type": "http", "method": "GET", "path": "/api/doctors", "headers": []}
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    async def main():
+        ticks = []
+
+        async def ticker():
+            while len(ticks) < 1000:
+                ticks.append(time.perf_counter())
+                await anyio.sleep(0.01)
+
+        async with anyio.create_task_group() as tasks:
+            tasks.start_soon(ticker)
+            await middleware(scope, receive, send)
+            tasks.cancel_scope.cancel()
+        return max(later - earlier for earlier, later in zip(ticks, ticks[1:]))
+
+    longest_pause = anyio.run(main)
+
+    assert saved == ["/api/doctors"]
+    assert longest_pause < SAVE_SECONDS / 2
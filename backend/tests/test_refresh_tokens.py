@@ -0,0 +1,111 @@
+# backend/tests/test_refresh_tokens.py
+
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+from models import RefreshToken, SessionLocal, User
+from refresh_tokens import (
+    RefreshTokenError, hash_refresh_token, issue_refresh_token, purge_expired_refresh_tokens,
+    revoke_refresh_token, rotate_refresh_token,
+)
+
+# --- Ротация refresh-токенов (refresh_tokens.py) ---
+# Каждое обновление гасит старый токен и выдает новый из того же семейства. Повторное предъявление
+# погашенного токена - признак кражи: отзывается все семейство, включая последний выданный токен.
+
+
+@pytest.fixture
+def user_id(app_db):
+    user = User(email="patient@example.com", hashed_password="x", role="patient", is_active=True)
+    app_db.add(user)
+    app_db.commit()
+    return user.id
+
+
+def _family_tokens(db, token: str):
+    family_id = db.execute(select(RefreshToken.family_id).where(RefreshToken.token_hash == hash_refresh_token(token))).scalar()
+    return db.execute(select(RefreshToken).where(RefreshToken.family_id == family_id)).scalars().all()
+
+
+def test_rotation_issues_new_token_of_same_family(app_db, user_id):
+    token = issue_refresh_token(app_db, user_id)
+
+    user, new_token = rotate_refresh_token(app_db, token)
+
+    assert user.id == user_id
+    assert new_token != token
+    tokens = {stored.token_hash: stored for stored in _family_tokens(app_db, token)}
+    assert set(tokens) == {hash_refresh_token(token), hash_refresh_token(new_token)}
+    assert tokens[hash_refresh_token(token)].revoked_at is not None
+    assert tokens[hash_refresh_token(new_token)].revoked_at is None
+
+
+def test_reuse_revokes_whole_family(app_db, user_id):
+    token = issue_refresh_token(app_db, user_id)
+    _, second = rotate_refresh_token(app_db, token)
+    _, third = rotate_refresh_token(app_db, second)
+    other_login = issue_refresh_token(app_db, user_id)
+
+    # Старый токен предъявлен снова (копия у злоумышленника)
+    with pytest.raises(RefreshTokenError):
+        rotate_refresh_token(app_db, token)
+
+    app_db.expire_all()
+    assert all(stored.revoked_at is not None for stored in _family_tokens(app_db, token))
+    # Последний токен семейства тоже отозван - владелец должен войти заново
+    with pytest.raises(RefreshTokenError):
+        rotate_refresh_token(app_db, third)
+    # Другие семейства (другие входы) не затронуты
+    rotate_refresh_token(app_db, other_login)
+
+
+def test_concurrent_rotation_of_same_token(app_db, user_id):
+    token = issue_refresh_token(app_db, user_id)
+    results = []
+    barrier = threading.Barrier(4)
+
+    def rotate():
+        with SessionLocal() as db:
+            barrier.wait()
+            try:
+                rotate_refresh_token(db, token)
+                results.append("rotated")
+            except RefreshTokenError:
+                results.append("rejected")
+
+    threads = [threading.Thread(target=rotate) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Из одновременных запросов с одним токеном успешен только один, остальные - повторное использование
+    assert sorted(results) == ["rejected", "rejected", "rejected", "rotated"]
+    app_db.expire_all()
+    assert all(stored.revoked_at is not None for stored in _family_tokens(app_db, token))
+
+
+def test_expired_and_unknown_tokens_are_rejected(app_db, user_id):
+    token = issue_refresh_token(app_db, user_id)
+    app_db.execute(update(RefreshToken).values(expires_at=datetime.utcnow() - timedelta(seconds=1)))
+    app_db.commit()
+
+    with pytest.raises(RefreshTokenError):
+        rotate_refresh_token(app_db, token)
+    with pytest.raises(RefreshTokenError):
+        rotate_refresh_token(app_db, "unknown-token")
+
+    assert purge_expired_refresh_tokens(batch_size=1) == 1
+
+
+def test_logout_revokes_family(app_db, user_id):
+    token = issue_refresh_token(app_db, user_id)
+    _, new_token = rotate_refresh_token(app_db, token)
+
+    assert revoke_refresh_token(app_db, token) is True
+    with pytest.raises(RefreshTokenError):
+        rotate_refresh_token(app_db, new_token)
+    assert revoke_refresh_token(app_db, "unknown-token") is False
@@ -0,0 +1,75 @@
+# backend/upserts.py
+
+from typing import Optional
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import Update
+
+# Запись "одним запросом" с опорой на уникальные ограничения таблиц:
+#  - MySQL: INSERT ... ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id), ...
+#    После такого запроса cursor.lastrowid содержит id строки и для вставки, и для обновления,
+#    без дополнительного SELECT.
+#  - SQLite / PostgreSQL: INSERT ... ON CONFLICT DO UPDATE ... RETURNING * - строка возвращается сразу.
+
+
+def _dialect(db: Session) -> str:
+    return db.get_bind().dialect.name
+
+
+def upsert_returning(db: Session, model, conflict_column: str, insert_values: dict, update_values: dict):
+    """
+    Вставляет строку или обновляет существующую по уникальной колонке conflict_column
+    и возвращает итоговую строку (Row с атрибутами колонок). Не выполняет commit.
+
+    Args:
+        model: Модель SQLAlchemy (например, PatientProfile).
+        conflict_column (str): Уникальная колонка, по которой определяется существующая строка.
+        insert_values (dict): Значения для новой строки.
+        update_values (dict): Значения для обновления существующей строки (может быть пустым).
+    """
+    table = model.__table__
+    dialect = _dialect(db)
+
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        statement = mysql_insert(table).values(**insert_values)
+        statement = statement.on_duplicate_key_update(id=func.last_insert_id(table.c.id), **update_values)
+        row_id = db.execute(statement).lastrowid
+        # В MySQL нет RETURNING: неизмененные колонки существующей строки дочитываем по первичному ключу
+        return db.execute(select(table).where(table.c.id == row_id)).one()
+
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        statement = dialect_insert(table).values(**insert_values)
+        # DO UPDATE нужен даже без изменений, иначе RETURNING не вернет существующую строку
+        set_values = update_values or {conflict_column: statement.excluded[conflict_column]}
+        statement = statement.on_conflict_do_update(index_elements=[conflict_column], set_=set_values)
+        return db.execute(statement.returning(*table.c)).one()
+
+    # Другие СУБД: обычная проверка существования
+    existing = db.execute(select(table.c.id).where(table.c[conflict_column] == insert_values[conflict_column])).first()
+    if existing is None:
+        row_id = db.execute(insert(table).values(**insert_values)).inserted_primary_key[0]
+    else:
+        row_id = existing.id
+        if update_values:
+            db.execute(table.update().where(table.c.id == row_id).values(**update_values))
+    return db.execute(select(table).where(table.c.id == row_id)).one()
+
+
+def update_returning_id(db: Session, statement: Update, model) -> Optional[int]:
+    """
+    Выполняет UPDATE, затрагивающий не больше одной строки, и возвращает id обновленной строки
+    (или None, если ни одна строка не подошла). Не выполняет commit.
+    """
+    table = model.__table__
+    if _dialect(db) == "mysql":
+        # id = LAST_INSERT_ID(id) ничего не меняет в строке, но передает id клиенту в ответе на UPDATE
+        result = db.execute(statement.values(id=func.last_insert_id(table.c.id)))
+        return result.lastrowid if result.rowcount else None
+    row = db.execute(statement.returning(table.c.id)).first()
+    return row.id if row else None
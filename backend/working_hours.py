@@ -0,0 +1,147 @@
+# backend/working_hours.py
+
+import os
+from datetime import datetime, date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# --- Формат хранения рабочих часов ---
+# Неделя врача хранится как 7 битовых масок (по одной на день недели) в колонках hours_mon ... hours_sun.
+# Бит i маски означает, что врач работает в слоте [i * SLOT_MINUTES, (i + 1) * SLOT_MINUTES) минут от начала дня.
+# 48 получасовых слотов помещаются в BIGINT, поэтому проверка "работает ли врач сейчас" -
+# это одна битовая операция в SQL без разбора расписания.
+# Дополнительно хранится маска рабочих дней working_days (бит 0 - понедельник), она проиндексирована.
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+WEEKDAY_COLUMNS = tuple(f"hours_{day}" for day in WEEKDAYS)
+FULL_DAY_MASK = (1 << SLOTS_PER_DAY) - 1
+
+# Часовой пояс, в котором врачи указывают рабочие часы (для фильтра open_now)
+DOCTOR_TIMEZONE_NAME = os.getenv("DOCTOR_TIMEZONE", "Asia/Tashkent")
+
+
+def _load_timezone():
+    try:
+        from zoneinfo import ZoneInfo
+        return ZoneInfo(DOCTOR_TIMEZONE_NAME)
+    except Exception:
+        # На Windows без пакета tzdata базы часовых поясов нет - используем фиксированное смещение Ташкента
+        from datetime import timedelta, timezone
+        return timezone(timedelta(hours=5))
+
+
+DOCTOR_TIMEZONE = _load_timezone()
+
+
+def parse_time(value: str) -> int:
+    """Переводит "ЧЧ:ММ" в номер слота. "24:00" допускается как конец дня."""
+    hours, minutes = value.split(":")
+    total = int(hours) * 60 + int(minutes)
+    if total % SLOT_MINUTES or not 0 <= total <= 24 * 60:
+        raise ValueError(f"Time must be between 00:00 and 24:00 in steps of {SLOT_MINUTES} minutes")
+    return total // SLOT_MINUTES
+
+
+def format_time(slot: int) -> str:
+    minutes = slot * SLOT_MINUTES
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def encode_day(intervals: Iterable) -> int:
+    """
+    Собирает битовую маску дня из интервалов [(start, end)] или [{"start": ..., "end": ...}].
+    Пересекающиеся интервалы просто объединяются.
+    """
+    mask = 0
+    for interval in intervals:
+        if isinstance(interval, dict):
+            start, end = interval["start"], interval["end"]
+        else:
+            start, end = interval
+        first, last = parse_time(start), parse_time(end)
+        if first >= last:
+            raise ValueError("Interval start must be before its end")
+        mask |= ((1 << (last - first)) - 1) << first
+    return mask
+
+
+def decode_day(mask: int) -> List[Dict[str, str]]:
+    """Разворачивает маску дня обратно в список непрерывных интервалов."""
+    intervals = []
+    slot = 0
+    mask = mask or 0
+    while slot < SLOTS_PER_DAY:
+        if mask >> slot & 1:
+            start = slot
+            while slot < SLOTS_PER_DAY and mask >> slot & 1:
+                slot += 1
+            intervals.append({"start": format_time(start), "end": format_time(slot)})
+        else:
+            slot += 1
+    return intervals
+
+
+def encode_week(schedule: Optional[dict]) -> Dict[str, int]:
+    """
+    Пересчитывает колонки hours_* и working_days из расписания вида {"mon": [...], ...}.
+    Дни, которых нет в расписании, считаются нерабочими; None - расписание очищается.
+    """
+    values = {column: 0 for column in WEEKDAY_COLUMNS}
+    working_days = 0
+    for index, day in enumerate(WEEKDAYS):
+        mask = encode_day((schedule or {}).get(day) or [])
+        values[WEEKDAY_COLUMNS[index]] = mask
+        if mask:
+            working_days |= 1 << index
+    values["working_days"] = working_days
+    return values
+
+
+def decode_week(profile) -> Dict[str, List[Dict[str, str]]]:
+    """Возвращает расписание профиля в виде {"mon": [{"start": "09:00", "end": "13:00"}], ...} (только рабочие дни)."""
+    schedule = {}
+    for day, column in zip(WEEKDAYS, WEEKDAY_COLUMNS):
+        intervals = decode_day(getattr(profile, column))
+        if intervals:
+            schedule[day] = intervals
+    return schedule
+
+
+def parse_weekday(value: str) -> int:
+    """Принимает код дня недели ("mon" ... "sun") или дату в формате YYYY-MM-DD и возвращает номер дня (0 - понедельник)."""
+    value = value.strip().lower()
+    if value in WEEKDAYS:
+        return WEEKDAYS.index(value)
+    return date.fromisoformat(value).weekday()
+
+
+def current_slot(now: Optional[datetime] = None) -> Tuple[int, int]:
+    """Текущий день недели и номер слота в часовом поясе врачей."""
+    now = now or datetime.now(DOCTOR_TIMEZONE)
+    return now.weekday(), (now.hour * 60 + now.minute) // SLOT_MINUTES
+
+
+def working_days_values(weekday: int) -> List[int]:
+    """
+    Все возможные значения working_days, в которых установлен бит дня weekday (64 из 128).
+    Условие working_days IN (...) с константами использует индекс по working_days,
+    в отличие от working_days & bit, которое БД вычисляет для каждой строки.
+    """
+    bit = 1 << weekday
+    return [value for value in range(1 << len(WEEKDAYS)) if value & bit]
+
+
+def apply_open_on_filter(query, model, weekday: int):
+    """Оставляет врачей, работающих в указанный день недели."""
+    return query.filter(model.working_days.in_(working_days_values(weekday)))
+
+
+def apply_open_now_filter(query, model, now: Optional[datetime] = None):
+    """Оставляет врачей, работающих прямо сейчас: индексированный отбор по дню + битовая проверка слота."""
+    weekday, slot = current_slot(now)
+    column = getattr(model, WEEKDAY_COLUMNS[weekday])
+    query = apply_open_on_filter(query, model, weekday)
+    return query.filter(column.op("&")(1 << slot) != 0)